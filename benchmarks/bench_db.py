@@ -0,0 +1,410 @@
+"""
+Micro-benchmarks for the database hot paths.
+
+Times _insert_ip_info, _is_db_entry_recent, _fetch_ip_info and
+_check_rate_limits against databases pre-populated with 10k, 1M or 10M
+ip_data rows and 100k or 10M api_queries rows.
+
+Usage:
+    python benchmarks/bench_db.py
+    python benchmarks/bench_db.py --preset full --output 1.6.1.json
+    python benchmarks/bench_db.py --compare 1.6.1.json
+
+Populated databases are cached in --cache_dir, keyed by size and schema
+version, since the larger ones take minutes to build. The ip_data databases
+have no api_queries rows and the other way around, so each function is
+measured against the one table size it depends on.
+"""
+import argparse
+import ipaddress
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import tabulate
+
+import ip_info
+from ip_info.config import (
+    API_METADATA,
+    IP_TABLE_NAME,
+    LOCAL_TIMEZONE,
+    PROVIDER_TABLE_NAME,
+    QUERY_TABLE_NAME,
+    RAW_JSON_TABLE_NAME,
+)
+from ip_info._compress_json import _compress_json
+from ip_info._pack_ip_address import _pack_ip_address
+from ip_info.db._add_to_db import _insert_ip_info
+from ip_info.db._initialize_db import ensure_columns_exist, initialize_db
+from ip_info.db._migrate_db import SCHEMA_VERSION
+from ip_info.db._query_db import _check_rate_limits, _fetch_ip_info, _is_db_entry_recent
+
+PRESETS = {
+    "small": {"ip_rows": [10_000], "query_rows": [100_000]},
+    "full": {"ip_rows": [10_000, 1_000_000, 10_000_000], "query_rows": [100_000, 10_000_000]},
+}
+
+POPULATE_BATCH_SIZE = 50_000
+
+# each populated ip gets a row from this many providers
+PROVIDERS_PER_IP = 3
+
+# how many distinct raw_json payloads ip_data rows share
+RAW_JSON_PAYLOADS = 100
+
+# spread of the populated timestamps
+IP_DATA_SPAN = timedelta(days=400)
+QUERY_SPAN = timedelta(days=30)
+
+# a limit that's never reached, so _check_rate_limits does all its work but never sleeps
+BENCH_RATE_LIMITS = [
+    {"query_limit": 10**12, "timeframe": "day", "type": "rolling", "status_code": 429},
+]
+
+
+def _bench_ip(index: int) -> ipaddress.IPv4Address:
+    """The index'th populated IP. Spread over the address space, all public."""
+    return ipaddress.IPv4Address(0x0B000000 + index * 37)
+
+
+def _connect(path: str) -> sqlite3.Connection:
+    return sqlite3.connect(path, detect_types=sqlite3.PARSE_DECLTYPES)
+
+
+def _populate_ip_data(db_conn: sqlite3.Connection, rows: int, now: datetime) -> None:
+    api_names = list(API_METADATA)
+    cursor = db_conn.cursor()
+
+    cursor.executemany(
+        f"INSERT INTO {PROVIDER_TABLE_NAME} (api_name, api_display_name) VALUES (?, ?)",
+        [(api_name, API_METADATA[api_name]["api_display_name"]) for api_name in api_names]
+    )
+    cursor.executemany(
+        f"INSERT INTO {RAW_JSON_TABLE_NAME} (id, digest, payload) VALUES (?, ?, ?)",
+        [
+            (index + 1, *_compress_json({"ip": str(_bench_ip(index)), "city": "Springfield", "payload": index}))
+            for index in range(RAW_JSON_PAYLOADS)
+        ]
+    )
+
+    step = IP_DATA_SPAN / max(rows, 1)
+
+    def _rows(start: int, stop: int):
+        for row in range(start, stop):
+            ip_index, slot = divmod(row, PROVIDERS_PER_IP)
+            ip = _bench_ip(ip_index)
+            provider_id = (ip_index + slot) % len(api_names) + 1
+            yield (
+                now - IP_DATA_SPAN + step * row,
+                str(ip),
+                _pack_ip_address(ip),
+                provider_id,
+                row % 2 == 0,
+                "Springfield",
+                "Ohio",
+                "US",
+                "Example",
+                "Example",
+                "AS64500 Example",
+                "",
+                "",
+                row % RAW_JSON_PAYLOADS + 1,
+            )
+
+    for start in range(0, rows, POPULATE_BATCH_SIZE):
+        cursor.executemany(
+            f"INSERT INTO {IP_TABLE_NAME} "
+            "(timestamp, ip_address, ip_bytes, provider_id, risk, city, state, cc, "
+            "company, isp, as_name, hostname, flags, raw_json_id) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            _rows(start, min(start + POPULATE_BATCH_SIZE, rows))
+        )
+
+
+def _populate_api_queries(db_conn: sqlite3.Connection, rows: int, now: datetime) -> None:
+    api_names = list(API_METADATA)
+    cursor = db_conn.cursor()
+
+    cursor.executemany(
+        f"INSERT INTO {PROVIDER_TABLE_NAME} (api_name, api_display_name) VALUES (?, ?)",
+        [(api_name, API_METADATA[api_name]["api_display_name"]) for api_name in api_names]
+    )
+
+    step = QUERY_SPAN / max(rows, 1)
+
+    def _rows(start: int, stop: int):
+        for row in range(start, stop):
+            status_code = 429 if row % 50 == 0 else 200
+            yield (
+                row % len(api_names) + 1,
+                now - QUERY_SPAN + step * row,
+                status_code,
+                "Too Many Requests" if status_code == 429 else "OK",
+            )
+
+    for start in range(0, rows, POPULATE_BATCH_SIZE):
+        cursor.executemany(
+            f"INSERT INTO {QUERY_TABLE_NAME} (provider_id, timestamp, status_code, error_text) "
+            "VALUES (?, ?, ?, ?)",
+            _rows(start, min(start + POPULATE_BATCH_SIZE, rows))
+        )
+
+
+def prepare_db(cache_dir: str, table: str, rows: int, rebuild: bool = False) -> str:
+    """
+    Path to a database with rows rows in table, building it if it isn't cached.
+    """
+    path = os.path.join(cache_dir, f"{table}_{rows}_v{SCHEMA_VERSION}.db")
+    if os.path.exists(path) and not rebuild:
+        return path
+
+    print(f"Populating {rows:,} {table} rows...", file=sys.stderr)
+    start = time.perf_counter()
+
+    partial_path = path + ".partial"
+    if os.path.exists(partial_path):
+        os.remove(partial_path)
+
+    db_conn = _connect(partial_path)
+    try:
+        initialize_db(db_conn=db_conn)
+        ensure_columns_exist(db_conn=db_conn)
+
+        db_conn.execute("PRAGMA journal_mode = OFF")
+        db_conn.execute("PRAGMA synchronous = OFF")
+
+        now = datetime.now(LOCAL_TIMEZONE)
+        if table == IP_TABLE_NAME:
+            _populate_ip_data(db_conn, rows, now)
+        else:
+            _populate_api_queries(db_conn, rows, now)
+        db_conn.commit()
+        db_conn.execute("ANALYZE")
+        db_conn.commit()
+    finally:
+        db_conn.close()
+
+    os.replace(partial_path, path)
+    print(f"  done in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+
+    return path
+
+
+def _time(function, min_time: float, min_runs: int = 3, max_runs: int = 1000) -> list[float]:
+    """Call function repeatedly, after one warm up call. Returns seconds per call."""
+    function()
+
+    timings = []
+    total = 0.0
+    while len(timings) < max_runs and (len(timings) < min_runs or total < min_time):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        timings.append(elapsed)
+        total += elapsed
+
+    return timings
+
+
+def _ip_data_cases(db_conn: sqlite3.Connection, rows: int, rng: random.Random) -> dict:
+    """Benchmarked calls against a populated ip_data table, by name."""
+    populated_ips = max(rows // PROVIDERS_PER_IP, 1)
+    api_names = list(API_METADATA)
+    now = datetime.now(LOCAL_TIMEZONE)
+
+    def _existing_ip():
+        return _bench_ip(rng.randrange(populated_ips))
+
+    def _entries(ips) -> list[dict]:
+        return [
+            {
+                "timestamp": now,
+                "ip_address": str(ip),
+                "api_name": api_names[0],
+                "api_display_name": API_METADATA[api_names[0]]["api_display_name"],
+                "risk": False,
+                "city": "Springfield",
+                "state": "Ohio",
+                "cc": "US",
+                "company": "Example",
+                "isp": "Example",
+                "as_name": "AS64500 Example",
+                "hostname": "",
+                "flags": "",
+                "raw_json": {"ip": str(ip), "city": "Springfield"},
+            }
+            for ip in ips
+        ]
+
+    # new rows go above the populated range, so later runs still find them new
+    next_new_ip = populated_ips
+
+    def _insert_new():
+        nonlocal next_new_ip
+        ips = [_bench_ip(next_new_ip + offset) for offset in range(100)]
+        next_new_ip += 100
+        _insert_ip_info(entries=_entries(ips), db_conn=db_conn)
+
+    def _insert_existing():
+        _insert_ip_info(entries=_entries(_existing_ip() for _ in range(100)), db_conn=db_conn)
+
+    return {
+        "_insert_ip_info (100 new rows)": _insert_new,
+        "_insert_ip_info (100 upserts)": _insert_existing,
+        "_is_db_entry_recent (hit)": lambda: _is_db_entry_recent(
+            api_names[0], _existing_ip(), db_conn
+        ),
+        "_is_db_entry_recent (miss)": lambda: _is_db_entry_recent(
+            api_names[0], ipaddress.IPv4Address("203.0.113.1"), db_conn
+        ),
+        "_fetch_ip_info (all apis)": lambda: _fetch_ip_info(
+            api_names=["all"], ip_address=_existing_ip(), db_conn=db_conn
+        ),
+        "_fetch_ip_info (all apis, raw_json)": lambda: _fetch_ip_info(
+            api_names=["all"], ip_address=_existing_ip(), db_conn=db_conn, include_raw_json=True
+        ),
+    }
+
+
+def _api_queries_cases(db_conn: sqlite3.Connection) -> dict:
+    """Benchmarked calls against a populated api_queries table, by name."""
+    api_name = next(iter(API_METADATA))
+
+    return {
+        "_check_rate_limits": lambda: _check_rate_limits(api_name, BENCH_RATE_LIMITS, db_conn),
+    }
+
+
+def run_benchmarks(args) -> list[dict]:
+    os.makedirs(args.cache_dir, exist_ok=True)
+    rng = random.Random(args.seed)
+
+    scenarios = (
+        [(IP_TABLE_NAME, rows) for rows in args.ip_rows] +
+        [(QUERY_TABLE_NAME, rows) for rows in args.query_rows]
+    )
+
+    results = []
+    for table, rows in scenarios:
+        path = prepare_db(args.cache_dir, table, rows, rebuild=args.rebuild)
+
+        # benchmark on a copy, so inserts don't grow the cached database
+        work_path = path + ".run"
+        with open(path, "rb") as source, open(work_path, "wb") as target:
+            while chunk := source.read(1 << 24):
+                target.write(chunk)
+
+        db_conn = _connect(work_path)
+        try:
+            if table == IP_TABLE_NAME:
+                cases = _ip_data_cases(db_conn, rows, rng)
+            else:
+                cases = _api_queries_cases(db_conn)
+
+            for name, function in cases.items():
+                print(f"Timing {name} with {rows:,} {table} rows...", file=sys.stderr)
+                timings = _time(function, args.min_time)
+                results.append({
+                    "function": name,
+                    "table": table,
+                    "rows": rows,
+                    "runs": len(timings),
+                    "median_ms": statistics.median(timings) * 1000,
+                    "min_ms": min(timings) * 1000,
+                })
+        finally:
+            db_conn.close()
+            os.remove(work_path)
+
+    return results
+
+
+def _result_key(result: dict) -> tuple:
+    return (result["function"], result["table"], result["rows"])
+
+
+def print_results(results: list[dict], baseline: dict | None = None) -> None:
+    headers = ["function", "table", "rows", "runs", "median ms", "min ms"]
+    baseline_results = {}
+    if baseline is not None:
+        headers += [f"{baseline['version']} ms", "ratio"]
+        baseline_results = {_result_key(result): result for result in baseline["results"]}
+
+    table = []
+    for result in results:
+        line = [
+            result["function"],
+            result["table"],
+            f"{result['rows']:,}",
+            result["runs"],
+            f"{result['median_ms']:.3f}",
+            f"{result['min_ms']:.3f}",
+        ]
+        if baseline is not None:
+            previous = baseline_results.get(_result_key(result))
+            if previous is None:
+                line += ["", ""]
+            else:
+                line += [
+                    f"{previous['median_ms']:.3f}",
+                    f"{result['median_ms'] / previous['median_ms']:.2f}x",
+                ]
+        table.append(line)
+
+    print(tabulate.tabulate(table, headers=headers, tablefmt="simple_outline"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ip_info's database hot paths.")
+    parser.add_argument("--preset", choices=PRESETS, default="small",
+                        help="Table sizes to benchmark. (default small)")
+    parser.add_argument("--ip_rows", nargs="+", type=int,
+                        help="ip_data sizes, instead of the preset's.")
+    parser.add_argument("--query_rows", nargs="+", type=int,
+                        help="api_queries sizes, instead of the preset's.")
+    parser.add_argument("--min_time", type=float, default=1.0,
+                        help="Seconds to spend timing each function, at least. (default 1)")
+    parser.add_argument("--cache_dir", default=os.path.join(tempfile.gettempdir(), "ip_info_bench_db"),
+                        help="Where populated databases are kept between runs.")
+    parser.add_argument("--rebuild", action="store_true",
+                        help="Populate the databases again, even if cached.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the results to this JSON file.")
+    parser.add_argument("--compare", help="A previous --output file to compare against.")
+
+    args = parser.parse_args()
+
+    if args.ip_rows is None:
+        args.ip_rows = PRESETS[args.preset]["ip_rows"]
+    if args.query_rows is None:
+        args.query_rows = PRESETS[args.preset]["query_rows"]
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as file:
+            baseline = json.load(file)
+
+    results = run_benchmarks(args)
+    print_results(results, baseline)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump({
+                "version": ip_info.__version__,
+                "schema_version": SCHEMA_VERSION,
+                "python": platform.python_version(),
+                "sqlite": sqlite3.sqlite_version,
+                "date": datetime.now(LOCAL_TIMEZONE).isoformat(),
+                "results": results,
+            }, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
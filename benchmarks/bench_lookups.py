@@ -0,0 +1,210 @@
+"""
+End-to-end lookup benchmarks against the local mock provider server.
+
+Runs ip_info.main.main for batches of 1, 100, 10k and 100k random public IPs
+against a fresh database, and reports wall time, requests per second, sqlite
+commits and peak RSS for each scenario.
+
+Usage:
+    python benchmarks/bench_lookups.py
+    python benchmarks/bench_lookups.py --sizes 1 100 --apis all --latency_scale 0.1
+    python benchmarks/bench_lookups.py --output results.json
+
+Each scenario runs in its own subprocess, so peak RSS isn't carried over
+between scenarios. The mock server runs in this process.
+"""
+import argparse
+import contextlib
+import io
+import ipaddress
+import json
+import os
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+import tabulate
+
+from mock_providers import MockProviderServer, redirect_requests
+
+try:
+    import resource
+except ImportError:  # windows
+    resource = None
+
+DEFAULT_SIZES = [1, 100, 10_000, 100_000]
+
+
+def random_public_ips(count: int, seed: int = 0, ipv6_share: float = 0.1) -> list[str]:
+    """count distinct, global IP addresses. About ipv6_share of them are IPv6."""
+    rng = random.Random(seed)
+    ips: set[str] = set()
+
+    while len(ips) < count:
+        if rng.random() < ipv6_share:
+            # 2000::/3 is global unicast
+            ip = ipaddress.IPv6Address((0x2 << 124) | rng.getrandbits(124))
+        else:
+            ip = ipaddress.IPv4Address(rng.getrandbits(32))
+        if ip.is_global:
+            ips.add(str(ip))
+
+    return sorted(ips)
+
+
+def _resolve_apis(apis: list[str]) -> list[str]:
+    from ip_info.config import API_METADATA
+
+    if apis == ["all"]:
+        return list(API_METADATA.keys())
+    if apis == ["bulk"]:
+        return [name for name, metadata in API_METADATA.items() if metadata["allows_bulk"]]
+    return apis
+
+
+def run_child(args) -> None:
+    """Run one scenario in this process and print its measurements as JSON."""
+    import ip_info.main
+
+    redirect_requests(args.port)
+
+    # count every COMMIT issued on any connection
+    commits = 0
+    original_connect = sqlite3.connect
+
+    def _trace(statement: str):
+        nonlocal commits
+        if statement.strip().upper().startswith("COMMIT"):
+            commits += 1
+
+    def _connect(*connect_args, **connect_kwargs):
+        conn = original_connect(*connect_args, **connect_kwargs)
+        conn.set_trace_callback(_trace)
+        return conn
+
+    sqlite3.connect = _connect
+
+    db_dir = tempfile.mkdtemp(prefix="ip_info_bench_")
+    ip_info.main.DB_PATH = os.path.join(db_dir, "ip_info.db")
+    ip_info.main._get_api_key = lambda api_name: "benchmark"
+
+    ip_addresses = random_public_ips(args.size, seed=args.seed)
+
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        ip_info.main.main(
+            user_input=ip_addresses,
+            query_apis=_resolve_apis(args.apis),
+            output_format="none",
+        )
+    wall_time = time.perf_counter() - start
+
+    peak_rss_kb = None
+    if resource is not None:
+        peak_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if sys.platform == "darwin":  # bytes on macOS
+            peak_rss_kb //= 1024
+
+    print(json.dumps({
+        "wall_time": wall_time,
+        "commits": commits,
+        "peak_rss_kb": peak_rss_kb,
+        "db_bytes": os.path.getsize(ip_info.main.DB_PATH),
+    }))
+
+
+def run_scenarios(args) -> list[dict]:
+    server = MockProviderServer(
+        latency_scale=args.latency_scale,
+        enforce_rate_limits=not args.no_rate_limits,
+        seed=args.seed,
+    ).start()
+
+    results = []
+    try:
+        for size in args.sizes:
+            server.reset()
+            command = [
+                sys.executable, os.path.abspath(__file__), "--child",
+                "--port", str(server.port),
+                "--size", str(size),
+                "--seed", str(args.seed),
+                "--apis", *args.apis,
+            ]
+            print(f"Running {size} IPs...", file=sys.stderr)
+            completed = subprocess.run(command, capture_output=True, text=True)
+            if completed.returncode != 0:
+                sys.exit(f"Scenario with {size} IPs failed:\n{completed.stderr}")
+
+            measurements = json.loads(completed.stdout.strip().splitlines()[-1])
+            stats = server.stats()
+            requests_made = sum(stats["requests"].values())
+
+            results.append({
+                "ips": size,
+                **measurements,
+                "requests": requests_made,
+                "requests_per_second": requests_made / measurements["wall_time"],
+                "rate_limited": sum(stats["rate_limited"].values()),
+                "provider_requests": stats["requests"],
+            })
+    finally:
+        server.stop()
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ip_info lookups against mock providers.")
+    parser.add_argument("--sizes", nargs="+", type=int, default=DEFAULT_SIZES,
+                        help="Number of IPs per scenario.")
+    parser.add_argument("--apis", nargs="+", default=["bulk"],
+                        help="APIs to query: all, bulk, or api names. (default bulk)")
+    parser.add_argument("--latency_scale", type=float, default=1.0,
+                        help="Multiplier for simulated provider latency. 0 disables it.")
+    parser.add_argument("--no_rate_limits", action="store_true",
+                        help="Don't simulate provider side rate limit errors.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Also write the results to this JSON file.")
+    # internal: run a single scenario
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--size", type=int, help=argparse.SUPPRESS)
+
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args)
+        return
+
+    results = run_scenarios(args)
+
+    table = [
+        [
+            result["ips"],
+            f"{result['wall_time']:.2f}",
+            result["requests"],
+            f"{result['requests_per_second']:.1f}",
+            result["rate_limited"],
+            result["commits"],
+            result["peak_rss_kb"] and f"{result['peak_rss_kb'] / 1024:.1f}",
+            f"{result['db_bytes'] / 1024 / 1024:.1f}",
+        ]
+        for result in results
+    ]
+    print(tabulate.tabulate(
+        table,
+        headers=["ips", "wall s", "requests", "req/s", "429s", "commits", "peak RSS MiB", "db MiB"],
+        tablefmt="simple_outline",
+    ))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump({"apis": args.apis, "latency_scale": args.latency_scale, "results": results}, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
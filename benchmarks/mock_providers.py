@@ -0,0 +1,298 @@
+"""
+Local stand-in for every provider ip_info queries, for offline benchmarks.
+
+The server mimics each provider's endpoint layout, batch semantics and
+response shape closely enough for the handlers in ip_info.apis to parse the
+results. Latency is drawn from a log-normal distribution per provider, and
+the rate limits in API_METADATA are enforced server side, answering with the
+provider's documented status code and error text once they're exceeded.
+
+Requests reach the server through redirect_requests(), which rewrites
+https://<provider host>/<path> to http://127.0.0.1:<port>/<provider host>/<path>.
+"""
+import json
+import math
+import random
+import threading
+import time
+from collections import defaultdict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit, urlunsplit
+
+import requests
+
+from ip_info.config import API_METADATA
+
+# host name -> api_name
+PROVIDER_HOSTS = {
+    "ip-intelligence.abstractapi.com": "abstractapicom",
+    "api.abuseipdb.com": "abuseipdbcom",
+    "api.criminalip.io": "criminalipio",
+    "api.ip2location.io": "ip2locationio",
+    "ipapi.co": "ipapico",
+    "api.ipapi.com": "ipapicom",
+    "api.ipapi.is": "ipapiis",
+    "pro.ipapi.org": "ipapiorg",
+    "ip-api.com": "ipdashapicom",
+    "api.ipgeolocation.io": "ipgeolocationio",
+    "ipinfo.io": "ipinfoio",
+    "api.ipquery.io": "ipqueryio",
+    "api.ipregistry.co": "ipregistryco",
+    "www.virustotal.com": "virustotalcom",
+}
+
+# median latency in seconds, and the spread (sigma) of the log-normal distribution
+DEFAULT_LATENCY = (0.15, 0.5)
+PROVIDER_LATENCY = {
+    "ipdashapicom": (0.08, 0.4),
+    "ipqueryio": (0.12, 0.4),
+    "virustotalcom": (0.35, 0.6),
+    "criminalipio": (0.5, 0.6),
+}
+
+_TIMEFRAME_SECONDS = {
+    "second": 1,
+    "minute": 60,
+    "hour": 3600,
+    "day": 86400,
+    "month": 31 * 86400,
+}
+
+
+def _fake_result(api_name: str, ip: str) -> dict:
+    """A response body for one IP, in the shape api_name returns."""
+    location = {"city": "Springfield", "region": "Ohio", "country_code": "US"}
+
+    if api_name == "abstractapicom":
+        return {"ip_address": ip, "security": {"is_vpn": False}, "location": location,
+                "company": {"name": "Example"}, "asn": {"name": "AS64500 Example"}}
+    if api_name == "abuseipdbcom":
+        return {"data": {"ipAddress": ip, "abuseConfidenceScore": 0, "totalReports": 0,
+                         "countryCode": "US", "isp": "Example", "hostnames": []}}
+    if api_name == "criminalipio":
+        return {"ip": ip, "summary": {"connection": {"country": "us", "hostname": ""},
+                                      "detection": {}}, "ip_scoring": {}}
+    if api_name == "ip2locationio":
+        return {"ip": ip, "city_name": "Springfield", "region_name": "Ohio",
+                "country_code": "US", "as": "Example", "is_proxy": False}
+    if api_name in ("ipapico", "ipapicom"):
+        return {"ip": ip, "city": "Springfield", "region": "Ohio", "region_name": "Ohio",
+                "country": "US", "country_code": "US", "org": "Example", "asn": "AS64500"}
+    if api_name == "ipapiis":
+        return {"ip": ip, "location": location, "company": {"name": "Example", "abuser_score": "0 (Very Low)"},
+                "asn": {"org": "Example", "abuser_score": "0 (Very Low)"}, "vpn": {}}
+    if api_name in ("ipapiorg", "ipdashapicom"):
+        return {"status": "success", "query": ip, "city": "Springfield", "regionName": "Ohio",
+                "countryCode": "US", "org": "Example", "isp": "Example", "as": "AS64500", "asname": "EXAMPLE"}
+    if api_name == "ipgeolocationio":
+        return {"ip": ip, "location": {"city": "Springfield", "state_prov": "Ohio", "country_code2": "US"}}
+    if api_name == "ipinfoio":
+        return {"ip": ip, "city": "Springfield", "region": "Ohio", "country": "US", "org": "AS64500 Example"}
+    if api_name == "ipqueryio":
+        return {"ip": ip, "isp": {"asn": "AS64500", "org": "Example", "isp": "Example"},
+                "location": {"city": "Springfield", "state": "Ohio", "country_code": "US"},
+                "risk": {"risk_score": 0}}
+    if api_name == "ipregistryco":
+        return {"ip": ip, "security": {}, "connection": {"organization": "Example", "asn": 64500, "domain": ""},
+                "location": {"city": "Springfield", "region": {"name": "Ohio"}, "country": {"code": "US"}}}
+    if api_name == "virustotalcom":
+        return {"data": {"id": ip, "attributes": {"country": "US", "as_owner": "Example",
+                                                  "last_analysis_stats": {"harmless": 60}}}}
+
+    raise ValueError(f"Unknown provider {api_name!r}")
+
+
+def _requested_ips(api_name: str, path: str, query: dict, body: bytes) -> list[str]:
+    """Pull the IP addresses out of a request, following each provider's api."""
+    segments = [segment for segment in path.split("/") if segment]
+
+    if api_name == "abstractapicom":
+        return query["ip_address"]
+    if api_name == "abuseipdbcom":
+        return query["ipAddress"]
+    if api_name in ("criminalipio", "ip2locationio", "ipgeolocationio"):
+        return query["ip"]
+    if api_name == "ipapico":
+        return [segments[0]]
+    if api_name in ("ipapicom", "virustotalcom"):
+        return [segments[-1]]
+    if api_name == "ipapiis":
+        return json.loads(body)["ips"]
+    if api_name == "ipapiorg":
+        return query["ips"][0].split(",")
+    if api_name in ("ipdashapicom", "ipinfoio"):
+        return json.loads(body)
+    if api_name in ("ipqueryio", "ipregistryco"):
+        return segments[0].split(",")
+
+    raise ValueError(f"Unknown provider {api_name!r}")
+
+
+def _response_body(api_name: str, ips: list[str]):
+    """Wrap per-IP results the way each provider's batch endpoint does."""
+    results = [_fake_result(api_name, ip) for ip in ips]
+
+    if api_name == "ipapiis":
+        body = {ip: result for ip, result in zip(ips, results)}
+        body["total_elapsed_ms"] = 1
+        return body
+    if api_name == "ipinfoio":
+        return {ip: result for ip, result in zip(ips, results)}
+    if api_name == "ipregistryco":
+        return {"results": results}
+    if api_name in ("ipapiorg", "ipdashapicom", "ipqueryio"):
+        return results
+    return results[0]
+
+
+class MockProviderServer:
+    """
+    Threaded HTTP server standing in for every provider.
+
+    Args:
+        latency_scale: multiplies every latency sample. 0 disables latency.
+        enforce_rate_limits: answer with the provider's rate limit error once
+            the limits in API_METADATA are exceeded.
+        seed: seed for the latency samples
+    """
+
+    def __init__(self, *, latency_scale: float = 1.0, enforce_rate_limits: bool = True, seed: int = 0):
+        self.latency_scale = latency_scale
+        self.enforce_rate_limits = enforce_rate_limits
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.reset()
+
+        server = self
+
+        class _Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                server._handle(self, b"")
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                server._handle(self, self.rfile.read(length))
+
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+        self._httpd.daemon_threads = True
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+
+    @property
+    def port(self) -> int:
+        return self._httpd.server_address[1]
+
+    def start(self) -> "MockProviderServer":
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def reset(self) -> None:
+        """Clear counters and rate limit state, e.g. between scenarios."""
+        with self._lock:
+            self.requests = defaultdict(int)
+            self.ips = defaultdict(int)
+            self.rate_limited = defaultdict(int)
+            self._history = defaultdict(deque)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "requests": dict(self.requests),
+                "ips": dict(self.ips),
+                "rate_limited": dict(self.rate_limited),
+            }
+
+    def _sample_latency(self, api_name: str) -> float:
+        median, sigma = PROVIDER_LATENCY.get(api_name, DEFAULT_LATENCY)
+        with self._lock:
+            sample = self._random.lognormvariate(math.log(median), sigma)
+        return sample * self.latency_scale
+
+    def _check_limits(self, api_name: str) -> dict | None:
+        """Record a request, and return the rate limit it broke, if any."""
+        now = time.monotonic()
+        rate_limits = API_METADATA[api_name]["rate_limits"]
+        longest = max((_TIMEFRAME_SECONDS[limit["timeframe"]] for limit in rate_limits), default=0)
+
+        with self._lock:
+            history = self._history[api_name]
+            while history and history[0] < now - longest:
+                history.popleft()
+
+            if self.enforce_rate_limits:
+                for rate_limit in rate_limits:
+                    window = _TIMEFRAME_SECONDS[rate_limit["timeframe"]]
+                    used = sum(1 for ts in history if ts >= now - window)
+                    if used >= rate_limit["query_limit"]:
+                        self.rate_limited[api_name] += 1
+                        return rate_limit
+
+            history.append(now)
+            return None
+
+    def _handle(self, handler: BaseHTTPRequestHandler, body: bytes) -> None:
+        url = urlsplit(handler.path)
+        host, _, path = url.path.lstrip("/").partition("/")
+        api_name = PROVIDER_HOSTS.get(host)
+
+        if api_name is None:
+            self._send(handler, 404, {"error": f"unknown host {host}"})
+            return
+
+        ips = _requested_ips(api_name, path, parse_qs(url.query), body)
+        with self._lock:
+            self.requests[api_name] += 1
+            self.ips[api_name] += len(ips)
+
+        time.sleep(self._sample_latency(api_name))
+
+        broken_limit = self._check_limits(api_name)
+        if broken_limit is not None:
+            status = broken_limit.get("status_code", 429)
+            # some providers report limits with non-http codes. (e.g. 10001)
+            if not 100 <= status <= 599:
+                status = 429
+            reason = broken_limit.get("error_text", "Too Many Requests")
+            self._send(handler, status, {"error": reason}, reason=reason)
+            return
+
+        self._send(handler, 200, _response_body(api_name, ips))
+
+    @staticmethod
+    def _send(handler, status: int, body, reason: str | None = None) -> None:
+        data = json.dumps(body).encode("utf-8")
+        handler.send_response(status, reason)
+        handler.send_header("Content-Type", "application/json")
+        handler.send_header("Content-Length", str(len(data)))
+        handler.end_headers()
+        handler.wfile.write(data)
+
+
+def redirect_requests(port: int) -> None:
+    """
+    Send every request made through the requests library to the mock server
+    on port, instead of the real provider.
+    """
+    original_request = requests.sessions.Session.request
+
+    def _request(self, method, url, *args, **kwargs):
+        parts = urlsplit(url)
+        if parts.hostname in PROVIDER_HOSTS:
+            url = urlunsplit((
+                "http",
+                f"127.0.0.1:{port}",
+                f"/{parts.hostname}{parts.path or '/'}",
+                parts.query,
+                parts.fragment,
+            ))
+        return original_request(self, method, url, *args, **kwargs)
+
+    requests.sessions.Session.request = _request
@@ -0,0 +1,93 @@
+"""
+Quota aware assignment of IPs to providers. (ipi --sources)
+
+Instead of asking every provider about every IP, each IP goes to just
+enough providers to have K results, counting the recent ones already
+stored. Unlimited providers are used first. After those, the provider with
+the most IPs left in its quota (remaining requests times batch size) goes
+first, so scarce quotas are spread thin rather than used up. QUOTA_RESERVE
+of each quota is never assigned.
+"""
+from collections import Counter
+import ipaddress
+import math
+import sqlite3
+
+from ip_info.config import API_METADATA, QUOTA_RESERVE
+from ip_info.db._query_db import _answered_ip_addresses, _filter_stale_ip_addresses
+from ip_info.db._quota_ledger import _remaining_quota
+
+IPAddress = ipaddress.IPv4Address | ipaddress.IPv6Address
+
+
+def _ip_capacity(api_name: str, db_conn: sqlite3.Connection) -> int | None:
+    """IPs api_name's quotas allow, less the reserve. None for unlimited providers."""
+    quotas = _remaining_quota(api_name, db_conn)
+    if not quotas:
+        return None
+
+    requests = min(
+        quota["remaining"] - math.ceil(quota["query_limit"] * QUOTA_RESERVE)
+        for quota in quotas
+    )
+    return max(requests, 0) * API_METADATA[api_name].get("batch_size", 1)
+
+
+def _assign_sources(
+    *,
+    ip_addresses: list[IPAddress],
+    api_names: list[str],
+    sources: int,
+    db_conn: sqlite3.Connection,
+) -> tuple[dict[str, list[IPAddress]], list[IPAddress]]:
+    """
+    Pick the providers to ask about each of ip_addresses.
+
+    Args:
+        api_names: the providers to choose from. Ties go to the earlier one.
+        sources: how many providers should have a result for each ip
+
+    Returns:
+        (api_name -> ip addresses to ask it about, the ip addresses that
+        can't get sources results within the current quotas)
+    """
+    unique = list(dict.fromkeys(ip_addresses))
+
+    answered: Counter[IPAddress] = Counter()
+    stale: dict[str, set[IPAddress]] = {}
+    capacity: dict[str, int | None] = {}
+    for api_name in api_names:
+        answered.update(_answered_ip_addresses(api_name, unique, db_conn))
+        stale[api_name] = set(_filter_stale_ip_addresses(api_name, unique, db_conn))
+        capacity[api_name] = _ip_capacity(api_name, db_conn)
+
+    rank = {api_name: index for index, api_name in enumerate(api_names)}
+
+    def _cost(api_name: str) -> float:
+        left = capacity[api_name]
+        return 0.0 if left is None else 1 / left
+
+    assignment: dict[str, list[IPAddress]] = {api_name: [] for api_name in api_names}
+    short = []
+
+    for ip_address in unique:
+        needed = sources - answered[ip_address]
+        if needed <= 0:
+            continue
+
+        candidates = sorted(
+            (
+                api_name for api_name in api_names
+                if ip_address in stale[api_name] and capacity[api_name] != 0
+            ),
+            key=lambda api_name: (_cost(api_name), rank[api_name]),
+        )
+        for api_name in candidates[:needed]:
+            assignment[api_name].append(ip_address)
+            if capacity[api_name] is not None:
+                capacity[api_name] -= 1
+
+        if len(candidates) < needed:
+            short.append(ip_address)
+
+    return {api_name: ips for api_name, ips in assignment.items() if ips}, short
@@ -0,0 +1,90 @@
+"""
+Single-flight provider queries for concurrent lookups. (ip_info serve)
+
+Lookups that need the same (api_name, ip) at the same time share one
+provider query. IPs for bulk providers are held for a short window, so
+IPs from every caller in that window go out in one batch request.
+"""
+from collections.abc import Callable
+from concurrent.futures import Executor, Future, wait
+import ipaddress
+import threading
+
+from ip_info.config import API_METADATA, COALESCE_WINDOW
+
+IPAddress = ipaddress.IPv4Address | ipaddress.IPv6Address
+
+
+class LookupCoalescer:
+    """
+    Args:
+        executor: runs the provider queries
+        run: called as run(api_name, ip_addresses) to query one provider
+            and store the results
+        window: seconds to collect IPs for a bulk provider before querying
+    """
+
+    def __init__(
+        self,
+        executor: Executor,
+        run: Callable[[str, list[IPAddress]], None],
+        window: float = COALESCE_WINDOW,
+    ):
+        self._executor = executor
+        self._run = run
+        self._window = window
+        self._lock = threading.Lock()
+        # (api_name, ip) -> future finished once that pair has been queried
+        self._in_flight: dict[tuple[str, IPAddress], Future] = {}
+        # api_name -> (ip, future) pairs waiting for the next batch
+        self._pending: dict[str, list[tuple[IPAddress, Future]]] = {}
+
+    def lookup(self, ip_addresses_by_api: dict[str, list[IPAddress]]) -> None:
+        """Query each api for its ips, joining queries already in flight. Blocks until done."""
+        futures = []
+        flush_now = []
+
+        with self._lock:
+            for api_name, ip_addresses in ip_addresses_by_api.items():
+                for ip_address in ip_addresses:
+                    future = self._in_flight.get((api_name, ip_address))
+                    if future is None:
+                        future = Future()
+                        self._in_flight[(api_name, ip_address)] = future
+                        self._add_pending(api_name, ip_address, future, flush_now)
+                    futures.append(future)
+
+        for api_name in flush_now:
+            self._flush(api_name)
+
+        wait(futures)
+
+    def _add_pending(self, api_name: str, ip_address: IPAddress, future: Future, flush_now: list[str]) -> None:
+        pending = self._pending.setdefault(api_name, [])
+        pending.append((ip_address, future))
+        if len(pending) > 1:
+            return
+
+        # first ip of a new batch
+        if API_METADATA[api_name]["allows_bulk"] and self._window > 0:
+            timer = threading.Timer(self._window, self._flush, args=(api_name,))
+            timer.daemon = True
+            timer.start()
+        else:
+            flush_now.append(api_name)
+
+    def _flush(self, api_name: str) -> None:
+        with self._lock:
+            batch = self._pending.pop(api_name, [])
+        if batch:
+            self._executor.submit(self._run_batch, api_name, batch)
+
+    def _run_batch(self, api_name: str, batch: list[tuple[IPAddress, Future]]) -> None:
+        try:
+            self._run(api_name, [ip_address for ip_address, _ in batch])
+        finally:
+            with self._lock:
+                for ip_address, _ in batch:
+                    self._in_flight.pop((api_name, ip_address), None)
+            for _, future in batch:
+                future.set_result(None)
@@ -0,0 +1,32 @@
+import hashlib
+import json
+import zlib
+from typing import Any
+
+COMPRESSION_LEVEL = 6
+
+
+def _compress_json(value: Any) -> tuple[bytes, bytes]:
+    """
+    Serialize and compress a JSON payload for storage.
+
+    Accepts either a decoded JSON value, or a string that's already JSON.
+
+    Returns:
+        (digest, compressed) - digest is the sha256 of the serialized JSON,
+        used to store identical payloads only once.
+    """
+    if isinstance(value, str):
+        text = value
+    else:
+        text = json.dumps(value)
+
+    data = text.encode("utf-8")
+    digest = hashlib.sha256(data).digest()
+
+    return digest, zlib.compress(data, COMPRESSION_LEVEL)
+
+
+def _decompress_json(compressed: bytes) -> str:
+    """Reverse of _compress_json. Returns the JSON text."""
+    return zlib.decompress(compressed).decode("utf-8")
@@ -3,7 +3,8 @@ import json
 import sqlite3
 import tabulate
 
-from ip_info.db._query_db import _fetch_ip_info
+from ip_info.config import API_METADATA
+from ip_info.db._query_db import _fetch_ip_info, _filter_stale_ip_addresses
 from ip_info._format_timestamp import _format_timestamp
 from ip_info._format_ownership import _format_ownership
 
@@ -21,6 +22,7 @@ def display_ip_info(
     ip_addresses: list[ipaddress.IPv4Address | ipaddress.IPv6Address],
     output_format: str,
     db_conn: sqlite3.Connection,
+    unanswered: dict[str, list] | None = None,
 ) -> None:
     """
     print the stored api results for each ip in *ip_addresses*.
@@ -32,54 +34,85 @@ def display_ip_info(
             - "json"  → pretty-print raw JSON for every api row
             - "table" → compact tabular summary (default)
             - "none"  → do nothing
+        unanswered:  api_name → ips this run didn't get to, shown as
+                     missing for ips without a recent result from that api
     """
+    # a stored row the run meant to refresh doesn't count as an answer
+    missing_by_api = {
+        api_name: set(_filter_stale_ip_addresses(api_name, api_ips, db_conn))
+        for api_name, api_ips in (unanswered or {}).items()
+    }
 
     for ip_address in ip_addresses:
-        print(f"Results for {ip_address}")
         rows = _fetch_ip_info(
             api_names=["all"],
             ip_address=ip_address, 
-            db_conn=db_conn
+            db_conn=db_conn,
+            include_raw_json=(output_format == "json"),
         )
+        missing = [
+            API_METADATA[api_name]["api_display_name"]
+            for api_name, missing_ips in missing_by_api.items()
+            if ip_address in missing_ips
+        ]
+        print_ip_info(ip_address=ip_address, rows=rows, output_format=output_format, missing=missing)
 
-        if not rows:
-            print(f"No data for {ip_address}.")
-            continue
 
-        if output_format == "json":
-            for row in rows:
-                ts   = _format_timestamp(row["timestamp"])
-                disp = row["api_display_name"]
-                print(f"Showing raw JSON return for {ip_address} from {disp} on {ts}")
-                print(json.dumps(json.loads(row.get("raw_json", {})), indent=4))
+def print_ip_info(
+    *,
+    ip_address: ipaddress.IPv4Address | ipaddress.IPv6Address,
+    rows: list[dict],
+    output_format: str,
+    missing: list[str] | None = None,
+) -> None:
+    """
+    print the api results in *rows* for one ip, as fetched by _fetch_ip_info.
+    (with raw_json included for the "json" output_format) *missing* names
+    the providers that haven't answered yet.
+    """
+    print(f"Results for {ip_address}")
 
-        elif output_format == "table":
+    if missing:
+        print(f"No result yet from {', '.join(sorted(missing))}. (queued for ipi --drain)")
 
-            for row in rows:
-                # format timestamps for display
-                row["timestamp"] = _format_timestamp(row["timestamp"])
-                # condense company/isp/asn/hostname
-                row["ownership"] = _format_ownership(row)
+    if not rows:
+        print(f"No data for {ip_address}.")
+        return
 
-            # sort rows by api_display_name
-            rows.sort(key=lambda row: row.get("api_display_name", "").lower())
+    if output_format == "json":
+        for row in rows:
+            ts   = _format_timestamp(row["timestamp"])
+            disp = row["api_display_name"]
+            print(f"Showing raw JSON return for {ip_address} from {disp} on {ts}")
+            print(json.dumps(json.loads(row.get("raw_json", {})), indent=4))
 
-            # build table from database rows
-            table = []
-            for row in rows:
-                formatted_row = []
-                for column_name in DISPLAY_COLUMNS:
-                    value = row.get(column_name, "")
-                    formatted_row.append(value)
-                table.append(formatted_row)
+    elif output_format == "table":
 
-            # display table with tabulate
-            tabulate.MIN_PADDING = 0
-            print(
-                tabulate.tabulate(
-                    table,
-                    headers=DISPLAY_COLUMNS,
-                    tablefmt="simple_outline",
-                    stralign="left",
-                )
-            )
\ No newline at end of file
+        for row in rows:
+            # format timestamps for display
+            row["timestamp"] = _format_timestamp(row["timestamp"])
+            # condense company/isp/asn/hostname
+            row["ownership"] = _format_ownership(row)
+
+        # sort rows by api_display_name
+        rows.sort(key=lambda row: row.get("api_display_name", "").lower())
+
+        # build table from database rows
+        table = []
+        for row in rows:
+            formatted_row = []
+            for column_name in DISPLAY_COLUMNS:
+                value = row.get(column_name, "")
+                formatted_row.append(value)
+            table.append(formatted_row)
+
+        # display table with tabulate
+        tabulate.MIN_PADDING = 0
+        print(
+            tabulate.tabulate(
+                table,
+                headers=DISPLAY_COLUMNS,
+                tablefmt="simple_outline",
+                stralign="left",
+            )
+        )
@@ -0,0 +1,48 @@
+import sqlite3
+import tabulate
+
+from ip_info.db._query_db import _fetch_provider_stats
+
+
+def _format_ms(value: float | None) -> str:
+    return f"{value:.0f}" if value is not None else "-"
+
+
+def display_provider_stats(*, db_conn: sqlite3.Connection, days: int) -> None:
+    """
+    print call counts, latency and failure rates for each provider over the
+    last *days* days.
+    """
+    stats = _fetch_provider_stats(db_conn=db_conn, days=days)
+    if not stats:
+        print(f"No provider queries in the last {days} days.")
+        return
+
+    table = [
+        [
+            row["api_display_name"],
+            row["queries"],
+            f"{row['rate_limited'] / row['queries']:.1%}",
+            f"{row['errors'] / row['queries']:.1%}",
+            _format_ms(row["avg_duration_ms"]),
+            _format_ms(row["p50_duration_ms"]),
+            _format_ms(row["p95_duration_ms"]),
+            f"{row['avg_response_bytes'] / 1024:.1f}",
+            f"{row['avg_batch_size']:.1f}",
+            row["retries"],
+        ]
+        for row in stats
+    ]
+
+    print(f"Provider stats, last {days} days")
+    tabulate.MIN_PADDING = 0
+    print(
+        tabulate.tabulate(
+            table,
+            headers=[
+                "provider", "queries", "rate limited", "errors", "avg ms",
+                "p50 ms", "p95 ms", "avg KiB", "avg batch", "retries",
+            ],
+            tablefmt="simple_outline",
+        )
+    )
@@ -0,0 +1,54 @@
+"""
+Escalation rules for ipi --tiered: which IPs are worth sending on to the
+quota limited providers, going by the results stored for them so far.
+"""
+import ipaddress
+import sqlite3
+
+from ip_info.config import ESCALATE_FLAGS, ESCALATE_MIN_RISK
+from ip_info.db._query_db import _fetch_ip_info
+
+
+def _flag_words(flags: str | None) -> set[str]:
+    """
+    The words in a flags string, e.g. "proxy:vpn, usage:isp, risk:12" gives
+    proxy, vpn, usage, isp, risk and 12.
+    """
+    words = set()
+    for flag in (flags or "").split(","):
+        words.update(word.strip().lower() for word in flag.split(":") if word.strip())
+    return words
+
+
+def _should_escalate(rows: list[dict]) -> bool:
+    """
+    Whether an ip with these stored results (as from _fetch_ip_info) should
+    go to the next tier: no results at all, one with a flag in
+    ESCALATE_FLAGS, or a risk of at least ESCALATE_MIN_RISK.
+    """
+    if not rows:
+        return True
+
+    escalate_flags = {flag.lower() for flag in ESCALATE_FLAGS}
+    for row in rows:
+        if _flag_words(row.get("flags")) & escalate_flags:
+            return True
+        try:
+            if int(row.get("risk") or 0) >= ESCALATE_MIN_RISK:
+                return True
+        except (TypeError, ValueError):
+            pass
+
+    return False
+
+
+def _escalated_ip_addresses(
+    ip_addresses: list[ipaddress.IPv4Address | ipaddress.IPv6Address],
+    db_conn: sqlite3.Connection,
+) -> list[ipaddress.IPv4Address | ipaddress.IPv6Address]:
+    """The ip_addresses whose stored results match the escalation rules, in order."""
+    return [
+        ip_address
+        for ip_address in ip_addresses
+        if _should_escalate(_fetch_ip_info(api_names=["all"], ip_address=ip_address, db_conn=db_conn))
+    ]
@@ -0,0 +1,194 @@
+"""
+OpenMetrics (Prometheus) exporter, fed by the spans and counters in _timing.
+
+start_metrics_server() serves the current values on http://host:port/metrics
+until stop_metrics_server() is called. The lookup service collects them with
+enable_metrics() and serves render_metrics() itself.
+"""
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import threading
+
+from ip_info import _timing
+
+# seconds
+HISTOGRAM_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+# metric family -> (type, help)
+METRICS = {
+    "ip_info_provider_requests": ("counter", "Requests made to each provider."),
+    "ip_info_provider_errors": ("counter", "Provider requests that failed or didn't return 200."),
+    "ip_info_provider_retries": ("counter", "Provider requests retried after a 429, server error or network error."),
+    "ip_info_circuit_breaker_opens": ("counter", "Times a provider was paused after repeated failures."),
+    "ip_info_provider_request_duration_seconds": ("histogram", "Provider request latency."),
+    "ip_info_cache_lookups": ("counter", "Checks for a recent stored result, by result. (hit, negative or miss)"),
+    "ip_info_memory_cache_lookups": ("counter", "Lookups in the in-process cache of stored results, by result."),
+    "ip_info_rate_limit_blocks": ("counter", "Queries held back by a rate limit."),
+    "ip_info_rate_limit_wait_seconds": ("counter", "Time spent sleeping for per second rate limits."),
+    "ip_info_db_write_duration_seconds": ("histogram", "Database write latency, by operation."),
+    "ip_info_db_commits": ("counter", "Database commits."),
+}
+
+# _timing spans reported as database writes, with the span name as the operation
+DB_WRITE_SPANS = ("insert_ip_info", "insert_query_info")
+
+_lock = threading.Lock()
+_counters: dict[tuple[str, tuple], float] = defaultdict(float)
+# (family, labels) -> [bucket counts..., count, sum]
+_histograms: dict[tuple[str, tuple], list[float]] = {}
+_server: ThreadingHTTPServer | None = None
+
+
+def _labels(**labels) -> tuple:
+    return tuple(sorted((key, value) for key, value in labels.items() if value is not None))
+
+
+def _increment(family: str, labels: tuple, amount: float = 1) -> None:
+    with _lock:
+        _counters[(family, labels)] += amount
+
+
+def _observe(family: str, labels: tuple, seconds: float) -> None:
+    with _lock:
+        histogram = _histograms.setdefault(
+            (family, labels), [0.0] * (len(HISTOGRAM_BUCKETS) + 2)
+        )
+        for index, bound in enumerate(HISTOGRAM_BUCKETS):
+            if seconds <= bound:
+                histogram[index] += 1
+        histogram[-2] += 1
+        histogram[-1] += seconds
+
+
+def _on_timing_event(kind: str, name: str, api_name: str | None, value: float) -> None:
+    """_timing listener, mapping spans and counts onto metric families."""
+    if kind == "span":
+        if name == "http":
+            _increment("ip_info_provider_requests", _labels(api_name=api_name))
+            _observe("ip_info_provider_request_duration_seconds", _labels(api_name=api_name), value)
+        elif name == "rate_limit_wait":
+            _increment("ip_info_rate_limit_wait_seconds", _labels(api_name=api_name), value)
+        elif name in DB_WRITE_SPANS:
+            _observe("ip_info_db_write_duration_seconds", _labels(operation=name), value)
+
+    elif kind == "count":
+        if name == "provider_errors":
+            _increment("ip_info_provider_errors", _labels(api_name=api_name), value)
+        elif name == "provider_retries":
+            _increment("ip_info_provider_retries", _labels(api_name=api_name), value)
+        elif name == "circuit_opened":
+            _increment("ip_info_circuit_breaker_opens", _labels(api_name=api_name), value)
+        elif name in ("cache_hit", "cache_negative_hit", "cache_miss"):
+            result = {"cache_hit": "hit", "cache_negative_hit": "negative", "cache_miss": "miss"}[name]
+            _increment("ip_info_cache_lookups", _labels(api_name=api_name, result=result), value)
+        elif name in ("ip_cache_hit", "ip_cache_miss"):
+            result = "hit" if name == "ip_cache_hit" else "miss"
+            _increment("ip_info_memory_cache_lookups", _labels(result=result), value)
+        elif name == "rate_limit_blocked":
+            _increment("ip_info_rate_limit_blocks", _labels(api_name=api_name), value)
+        elif name == "commits":
+            _increment("ip_info_db_commits", _labels(), value)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: tuple, extra: tuple = ()) -> str:
+    pairs = labels + extra
+    if not pairs:
+        return ""
+    escaped = (f'{key}="{_escape(value)}"' for key, value in pairs)
+    return "{" + ",".join(escaped) + "}"
+
+
+def _format_number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(value)
+
+
+def render_metrics() -> str:
+    """Every metric, in the OpenMetrics text format."""
+    with _lock:
+        counters = dict(_counters)
+        histograms = {key: list(values) for key, values in _histograms.items()}
+
+    lines = []
+    for family, (metric_type, help_text) in METRICS.items():
+        lines.append(f"# TYPE {family} {metric_type}")
+        lines.append(f"# HELP {family} {help_text}")
+
+        if metric_type == "counter":
+            for (counter_family, labels), value in sorted(counters.items()):
+                if counter_family == family:
+                    lines.append(f"{family}_total{_format_labels(labels)} {_format_number(value)}")
+
+        else:
+            for (histogram_family, labels), values in sorted(histograms.items()):
+                if histogram_family != family:
+                    continue
+                for bound, bucket_count in zip(HISTOGRAM_BUCKETS, values):
+                    lines.append(
+                        f"{family}_bucket{_format_labels(labels, (('le', bound),))} {_format_number(bucket_count)}"
+                    )
+                lines.append(f"{family}_bucket{_format_labels(labels, (('le', '+Inf'),))} {_format_number(values[-2])}")
+                lines.append(f"{family}_count{_format_labels(labels)} {_format_number(values[-2])}")
+                lines.append(f"{family}_sum{_format_labels(labels)} {_format_number(values[-1])}")
+
+    lines.append("# EOF")
+    return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+
+        body = render_metrics().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def enable_metrics() -> None:
+    """Start collecting metrics, without serving them. (see render_metrics)"""
+    _timing.add_listener(_on_timing_event)
+
+
+def disable_metrics() -> None:
+    _timing.remove_listener(_on_timing_event)
+
+
+def start_metrics_server(port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """
+    Start collecting metrics, and serve them on http://host:port/metrics from
+    a background thread. Metrics collected before a restart are kept.
+    """
+    global _server
+    if _server is not None:
+        return _server
+
+    _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    _server.daemon_threads = True
+    threading.Thread(target=_server.serve_forever, daemon=True).start()
+
+    enable_metrics()
+
+    return _server
+
+
+def stop_metrics_server() -> None:
+    global _server
+    disable_metrics()
+    if _server is not None:
+        _server.shutdown()
+        _server.server_close()
+        _server = None
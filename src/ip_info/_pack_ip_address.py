@@ -0,0 +1,61 @@
+import ipaddress
+
+
+def _canonical_ip_address(
+    ip_address: str | ipaddress.IPv4Address | ipaddress.IPv6Address
+) -> ipaddress.IPv4Address | ipaddress.IPv6Address:
+    """
+    Parse an IP address and fold IPv4-mapped IPv6 addresses back to IPv4.
+
+    "::ffff:1.2.3.4" and "1.2.3.4" are the same host, so both return
+    IPv4Address("1.2.3.4").
+    """
+    if not isinstance(ip_address, (ipaddress.IPv4Address, ipaddress.IPv6Address)):
+        ip_address = ipaddress.ip_address(str(ip_address).strip())
+
+    if isinstance(ip_address, ipaddress.IPv6Address) and ip_address.ipv4_mapped:
+        return ip_address.ipv4_mapped
+
+    return ip_address
+
+
+def _pack_ip_address(
+    ip_address: str | ipaddress.IPv4Address | ipaddress.IPv6Address
+) -> bytes:
+    """
+    Convert an IP address into the 16 byte key used by the database.
+
+    IPv4 addresses are stored in IPv4-mapped form (::ffff:a.b.c.d), so IPv4
+    and IPv6 share one key space, and byte order matches numeric order. That
+    lets sqlite compare, index and range scan the column directly.
+
+    Raises:
+        ValueError: if ip_address isn't a valid IP address.
+    """
+    ip_address = _canonical_ip_address(ip_address)
+
+    if isinstance(ip_address, ipaddress.IPv4Address):
+        return ipaddress.IPv6Address(f"::ffff:{ip_address}").packed
+
+    return ip_address.packed
+
+
+def _unpack_ip_address(packed: bytes) -> ipaddress.IPv4Address | ipaddress.IPv6Address:
+    """Reverse of _pack_ip_address."""
+    return _canonical_ip_address(ipaddress.IPv6Address(packed))
+
+
+def _pack_ip_network(
+    network: str | ipaddress.IPv4Network | ipaddress.IPv6Network
+) -> tuple[bytes, bytes]:
+    """
+    Return the (first, last) packed addresses of a network, for use in
+    "ip_bytes BETWEEN ? AND ?" range scans.
+    """
+    if not isinstance(network, (ipaddress.IPv4Network, ipaddress.IPv6Network)):
+        network = ipaddress.ip_network(str(network).strip(), strict=False)
+
+    return (
+        _pack_ip_address(network.network_address),
+        _pack_ip_address(network.broadcast_address),
+    )
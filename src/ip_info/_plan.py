@@ -0,0 +1,171 @@
+"""
+ipi --plan: what a run would take, from stored results, the quota ledger
+and the query log alone. No requests are made.
+"""
+from datetime import datetime, timedelta
+import ipaddress
+import math
+import sqlite3
+
+import tabulate
+
+from ip_info.config import API_METADATA, LOCAL_TIMEZONE, QUERY_LOG_RETENTION_DAYS, TIMEFRAME_LENGTHS
+from ip_info.db._query_db import _fetch_provider_stats, _filter_stale_ip_addresses
+from ip_info.db._quota_ledger import _remaining_quota
+
+# assumed request time for providers with nothing in the query log
+DEFAULT_LATENCY_MS = 500
+
+
+def _estimate_duration(
+    api_name: str,
+    requests: int,
+    quotas: list[dict],
+    latency_ms: float | None,
+    now: datetime,
+) -> timedelta:
+    """
+    How long requests requests to api_name would take, one at a time: the
+    latency of each, or the wait for its rolling limits to allow them, or
+    for its quotas to reset enough times, whichever is longest.
+    """
+    if requests == 0:
+        return timedelta(0)
+
+    seconds = requests * (latency_ms or DEFAULT_LATENCY_MS) / 1000
+
+    for rate_limit in API_METADATA[api_name]["rate_limits"]:
+        if rate_limit.get("type", "rolling") != "rolling":
+            continue
+        windows = math.ceil(requests / rate_limit["query_limit"])
+        seconds = max(seconds, (windows - 1) * TIMEFRAME_LENGTHS[rate_limit["timeframe"]].total_seconds())
+
+    for quota in quotas:
+        if requests <= quota["remaining"]:
+            continue
+        windows = math.ceil((requests - quota["remaining"]) / quota["query_limit"])
+        finish = quota["resets"] + (windows - 1) * TIMEFRAME_LENGTHS[quota["timeframe"]]
+        seconds = max(seconds, (finish - now).total_seconds())
+
+    return timedelta(seconds=seconds)
+
+
+def _build_plan(
+    *,
+    ip_addresses: list[ipaddress.IPv4Address | ipaddress.IPv6Address],
+    api_names: list[str],
+    db_conn: sqlite3.Connection,
+    ip_addresses_by_api: dict[str, list] | None = None,
+    now: datetime | None = None,
+) -> list[dict]:
+    """
+    Args:
+        ip_addresses_by_api: which ips to ask each api about, if not all of
+            them. (see _assign.py)
+
+    Returns:
+        one dict per api, with keys api_name, api_display_name, stored (ips
+        with a recent result), to_query, requests, quota_left (requests,
+        None without a quota), covered (ips the current quota is enough
+        for) and duration.
+    """
+    if now is None:
+        now = datetime.now(LOCAL_TIMEZONE)
+
+    latency = {
+        stats["api_name"]: stats["p50_duration_ms"] or stats["avg_duration_ms"]
+        for stats in _fetch_provider_stats(db_conn=db_conn, days=QUERY_LOG_RETENTION_DAYS)
+    }
+
+    plan = []
+    for api_name in api_names:
+        api_metadata = API_METADATA[api_name]
+        batch_size = api_metadata.get("batch_size", 1)
+
+        stale = _filter_stale_ip_addresses(api_name, ip_addresses, db_conn)
+        to_query = stale
+        if ip_addresses_by_api is not None:
+            to_query = _filter_stale_ip_addresses(api_name, ip_addresses_by_api.get(api_name, []), db_conn)
+        requests = math.ceil(len(to_query) / batch_size)
+
+        quotas = _remaining_quota(api_name, db_conn, now=now)
+        quota_left = min((quota["remaining"] for quota in quotas), default=None)
+        covered = len(to_query) if quota_left is None else min(len(to_query), quota_left * batch_size)
+
+        plan.append({
+            "api_name": api_name,
+            "api_display_name": api_metadata["api_display_name"],
+            "stored": len(ip_addresses) - len(stale),
+            "to_query": len(to_query),
+            "requests": requests,
+            "quota_left": quota_left,
+            "covered": covered,
+            "duration": _estimate_duration(api_name, requests, quotas, latency.get(api_name), now),
+        })
+
+    return plan
+
+
+def _format_duration(duration: timedelta) -> str:
+    seconds = int(duration.total_seconds())
+    if seconds < 1:
+        return "<1s"
+    if seconds < 60:
+        return f"{seconds}s"
+    if seconds < 3600:
+        return f"{seconds // 60}m {seconds % 60}s"
+    if seconds < 86400:
+        return f"{seconds // 3600}h {seconds % 3600 // 60}m"
+    return f"{seconds // 86400}d {seconds % 86400 // 3600}h"
+
+
+def display_plan(
+    *,
+    ip_addresses: list[ipaddress.IPv4Address | ipaddress.IPv6Address],
+    api_names: list[str],
+    db_conn: sqlite3.Connection,
+    ip_addresses_by_api: dict[str, list] | None = None,
+) -> None:
+    """
+    print what looking up *ip_addresses* with *api_names* would take, or
+    just the ips in *ip_addresses_by_api* for each api, when given.
+    """
+    plan = _build_plan(
+        ip_addresses=ip_addresses,
+        api_names=api_names,
+        db_conn=db_conn,
+        ip_addresses_by_api=ip_addresses_by_api,
+    )
+    if not plan:
+        print("No APIs to query.")
+        return
+
+    table = [
+        [
+            row["api_display_name"],
+            row["stored"],
+            row["to_query"],
+            row["requests"],
+            "-" if row["quota_left"] is None else row["quota_left"],
+            row["covered"],
+            _format_duration(row["duration"]),
+        ]
+        for row in plan
+    ]
+
+    print(f"Plan for {len(ip_addresses)} IPs")
+    tabulate.MIN_PADDING = 0
+    print(
+        tabulate.tabulate(
+            table,
+            headers=["provider", "stored", "to query", "requests", "quota left", "covered now", "est. time"],
+            tablefmt="simple_outline",
+        )
+    )
+
+    # providers run in parallel, so the slowest sets the pace
+    print(f"Estimated time: {_format_duration(max(row['duration'] for row in plan))}")
+    for row in plan:
+        short = row["to_query"] - row["covered"]
+        if short:
+            print(f"{row['api_display_name']}: quota left covers {row['covered']} of {row['to_query']} IPs. The rest wait for it to reset.")
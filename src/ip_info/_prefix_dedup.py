@@ -0,0 +1,135 @@
+"""
+Prefix level deduplication for geolocation providers. (ipi --by_prefix)
+
+Providers marked "geo_only" in API_METADATA give the same location and
+network data for every IP in a /24 or /48, so they're only asked about one
+IP per network of PREFIX_LENGTHS. Their answer is then copied to the other
+IPs in the network, with "inferred from <ip>" in the flags and the original
+response wrapped in {"inferred_from", "prefix", "response"} as raw_json.
+Copies keep the original result's timestamp, so they go stale with it.
+"""
+from collections import defaultdict
+import ipaddress
+import json
+import sqlite3
+
+from ip_info.config import API_METADATA, PREFIX_LENGTHS
+from ip_info.db._add_to_db import _insert_ip_info
+from ip_info.db._query_db import _answered_ip_addresses, _fetch_ip_info, _filter_stale_ip_addresses
+
+IPAddress = ipaddress.IPv4Address | ipaddress.IPv6Address
+IPNetwork = ipaddress.IPv4Network | ipaddress.IPv6Network
+
+
+def _prefix(ip_address: IPAddress, prefix_lengths: tuple[int, int] = PREFIX_LENGTHS) -> IPNetwork:
+    """The network of prefix_lengths (IPv4, IPv6) that ip_address is in."""
+    prefix_length = prefix_lengths[0] if ip_address.version == 4 else prefix_lengths[1]
+    return ipaddress.ip_network(f"{ip_address}/{prefix_length}", strict=False)
+
+
+def _group_by_prefix(
+    ip_addresses: list[IPAddress],
+    prefix_lengths: tuple[int, int] = PREFIX_LENGTHS,
+) -> dict[IPNetwork, list[IPAddress]]:
+    """network -> the ip_addresses in it, both in their original order, without repeats."""
+    groups: dict[IPNetwork, list[IPAddress]] = defaultdict(list)
+    for ip_address in dict.fromkeys(ip_addresses):
+        groups[_prefix(ip_address, prefix_lengths)].append(ip_address)
+    return dict(groups)
+
+
+def _representatives(
+    api_name: str,
+    ip_addresses: list[IPAddress],
+    db_conn: sqlite3.Connection,
+    prefix_lengths: tuple[int, int] = PREFIX_LENGTHS,
+) -> list[IPAddress]:
+    """
+    The ip_addresses to ask api_name about: the first one without a recent
+    result in each network that has no recent answer from it yet.
+    """
+    answered = set(_answered_ip_addresses(api_name, ip_addresses, db_conn))
+    stale = set(_filter_stale_ip_addresses(api_name, ip_addresses, db_conn))
+
+    representatives = []
+    for group in _group_by_prefix(ip_addresses, prefix_lengths).values():
+        if any(ip_address in answered for ip_address in group):
+            continue
+        first = next((ip_address for ip_address in group if ip_address in stale), None)
+        if first is not None:
+            representatives.append(first)
+
+    return representatives
+
+
+def _dedup_by_prefix(
+    ip_addresses_by_api: dict[str, list[IPAddress]],
+    db_conn: sqlite3.Connection,
+    prefix_lengths: tuple[int, int] = PREFIX_LENGTHS,
+) -> dict[str, list[IPAddress]]:
+    """ip_addresses_by_api, with just the representatives for "geo_only" apis."""
+    return {
+        api_name: (
+            _representatives(api_name, ip_addresses, db_conn, prefix_lengths)
+            if API_METADATA[api_name].get("geo_only") else ip_addresses
+        )
+        for api_name, ip_addresses in ip_addresses_by_api.items()
+    }
+
+
+def _fan_out_results(
+    api_name: str,
+    ip_addresses: list[IPAddress],
+    db_conn: sqlite3.Connection,
+    prefix_lengths: tuple[int, int] = PREFIX_LENGTHS,
+) -> int:
+    """
+    Copy api_name's recent result for an ip in each network to the
+    ip_addresses in the same network without one. Copies of copies point
+    back to the original ip.
+
+    Returns:
+        the number of results inferred
+    """
+    answered = set(_answered_ip_addresses(api_name, ip_addresses, db_conn))
+    stale = set(_filter_stale_ip_addresses(api_name, ip_addresses, db_conn))
+
+    entries = []
+    for network, group in _group_by_prefix(ip_addresses, prefix_lengths).items():
+        targets = [ip_address for ip_address in group if ip_address in stale]
+        source = next((ip_address for ip_address in group if ip_address in answered), None)
+        if source is None or not targets:
+            continue
+
+        row = _fetch_ip_info(api_names=[api_name], ip_address=source, db_conn=db_conn, include_raw_json=True)[0]
+        raw_json = json.loads(row["raw_json"])
+        if isinstance(raw_json, dict) and "inferred_from" in raw_json:
+            # already marked
+            inferred_from, response, flags = raw_json["inferred_from"], raw_json["response"], row["flags"]
+        else:
+            inferred_from, response = str(source), raw_json
+            flags = f"inferred from {source}, {row['flags'] or '-'}"
+
+        for ip_address in targets:
+            entries.append({
+                "timestamp": row["timestamp"],
+                "ip_address": str(ip_address),
+                "api_name": api_name,
+                "api_display_name": row["api_display_name"],
+                "risk": row["risk"],
+                "city": row["city"],
+                "state": row["state"],
+                "cc": row["cc"],
+                "company": row["company"],
+                "isp": row["isp"],
+                "as_name": row["as_name"],
+                # reverse dns is per ip
+                "hostname": "",
+                "flags": flags,
+                "raw_json": {"inferred_from": inferred_from, "prefix": str(network), "response": response},
+            })
+
+    if entries:
+        _insert_ip_info(entries=entries, db_conn=db_conn)
+
+    return len(entries)
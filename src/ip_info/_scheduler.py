@@ -0,0 +1,242 @@
+"""
+Runs provider queries from one queue, across every provider and IP.
+
+Work is split into (api_name, batch of IPs) jobs: one IP per job for single
+IP providers, up to "batch_size" IPs for bulk ones. Providers wait in a
+priority queue ordered by when their rate limits next allow a query, and
+their jobs are handed to a shared worker pool as they come due, one at a
+time per provider. Worker threads never sleep on a rate limit; the
+dispatcher waits for the earliest provider instead.
+
+A provider whose limits won't allow a query within max_wait seconds, or
+whose circuit breaker is open for longer than that, has the rest of its IPs
+queued for ipi --drain. (see db/_pending_queries.py)
+
+With a deadline (ipi --deadline) the scheduler also stops there. Jobs that
+haven't started are queued, and jobs still running are left to their
+workers, whose requests stop at the deadline too.
+
+With a quorum (ipi --quorum) an IP is only handed to a provider while
+fewer than quorum providers have answered for it or are asking about it.
+Providers ready at the same time go in the order given, so the fastest are
+asked first. Whatever the rest haven't asked once every IP has its quorum
+is dropped.
+"""
+from collections import Counter, defaultdict, deque
+from collections.abc import Callable
+from concurrent.futures import Executor
+from datetime import datetime
+import heapq
+import ipaddress
+import itertools
+import queue
+import sqlite3
+import time
+
+from ip_info.apis._circuit_breaker import _retry_at
+from ip_info.apis._request_api import _defer_rate_limited
+from ip_info.config import API_METADATA, LOCAL_TIMEZONE, SCHEDULER_MAX_WAIT
+from ip_info.db._pending_queries import _defer_queries
+from ip_info.db._query_db import _answered_ip_addresses, _filter_stale_ip_addresses, _next_query_time
+
+IPAddress = ipaddress.IPv4Address | ipaddress.IPv6Address
+
+
+def _take_batch(
+    api_name: str,
+    ip_addresses: deque[IPAddress],
+    wanted: Callable[[IPAddress], bool],
+) -> list[IPAddress]:
+    """
+    Take the next batch api_name can query in one request off the front of
+    ip_addresses, of the ips wanted accepts. The rest stay queued in order.
+    """
+    batch_size = API_METADATA[api_name].get("batch_size", 1)
+    batch: list[IPAddress] = []
+    skipped: list[IPAddress] = []
+
+    while ip_addresses and len(batch) < batch_size:
+        ip_address = ip_addresses.popleft()
+        if wanted(ip_address):
+            batch.append(ip_address)
+        else:
+            skipped.append(ip_address)
+
+    ip_addresses.extendleft(reversed(skipped))
+    return batch
+
+
+def run_scheduled(
+    *,
+    executor: Executor,
+    ip_addresses_by_api: dict[str, list[IPAddress]],
+    run: Callable[[str, list[IPAddress]], None],
+    db_conn: sqlite3.Connection,
+    max_wait: float = SCHEDULER_MAX_WAIT,
+    deadline: float | None = None,
+    quorum: int | None = None,
+) -> dict[str, list[IPAddress]]:
+    """
+    Query each api for its ip addresses without a recent result, and wait
+    until every job has finished or been queued, or the deadline passes.
+
+    Args:
+        executor: the shared worker pool
+        ip_addresses_by_api: api_name -> ip addresses. Apis ready at the
+            same time are asked in this order.
+        run: called as run(api_name, ip_addresses) on a worker to query one
+            batch and store the results. Shouldn't raise.
+        db_conn: the dispatcher's connection, for freshness and rate limit checks
+        max_wait: seconds to wait for a provider's next slot before queuing
+            its remaining IPs instead
+        deadline: time.monotonic() value to stop at, if any
+        quorum: how many providers need to answer for each ip, if not all
+
+    Returns:
+        api_name -> the ip addresses it wasn't asked about, because they
+        were queued or were still running at the deadline.
+    """
+    jobs: dict[str, deque[IPAddress]] = {}
+    for api_name, ip_addresses in ip_addresses_by_api.items():
+        stale = _filter_stale_ip_addresses(api_name, ip_addresses, db_conn)
+        if stale:
+            jobs[api_name] = deque(stale)
+
+    # providers that have answered for, and are asking about, each ip
+    answered: Counter[IPAddress] = Counter()
+    asking: Counter[IPAddress] = Counter()
+    if quorum is not None:
+        for api_name, ip_addresses in ip_addresses_by_api.items():
+            answered.update(set(_answered_ip_addresses(api_name, ip_addresses, db_conn)))
+
+    def _wanted(ip_address: IPAddress) -> bool:
+        return quorum is None or answered[ip_address] + asking[ip_address] < quorum
+
+    def _still_needed(ip_addresses) -> list[IPAddress]:
+        return [ip_address for ip_address in ip_addresses if quorum is None or answered[ip_address] < quorum]
+
+    # (ready at, rank, tiebreak, api_name) for providers with jobs and nothing in flight
+    rank = {api_name: index for index, api_name in enumerate(ip_addresses_by_api)}
+    ready: list[tuple[float, int, int, str]] = []
+    order = itertools.count()
+
+    def _push(api_name: str, ready_at: float) -> None:
+        heapq.heappush(ready, (ready_at, rank[api_name], next(order), api_name))
+
+    start = time.monotonic()
+    for api_name in jobs:
+        _push(api_name, start)
+
+    # providers whose remaining ips all have enough providers asking about
+    # them. they're ready again whenever a job finishes, in case it didn't answer.
+    parked: set[str] = set()
+
+    finished: queue.Queue[str] = queue.Queue()
+    running: dict[str, list[IPAddress]] = {}
+    unanswered: dict[str, list[IPAddress]] = defaultdict(list)
+
+    while ready or running:
+
+        if deadline is not None and time.monotonic() >= deadline:
+            break
+        # a provider whose next slot is after the deadline is queued now
+        wait_limit = max_wait if deadline is None else min(max_wait, deadline - time.monotonic())
+
+        # hand out every provider whose next slot has come
+        while ready and ready[0][0] <= time.monotonic():
+            _, _, _, api_name = heapq.heappop(ready)
+
+            # every ip it has left has its quorum
+            if not _still_needed(jobs[api_name]):
+                del jobs[api_name]
+                continue
+
+            rate_limits = API_METADATA[api_name]["rate_limits"]
+
+            wait = 0.0
+            if rate_limits:
+                next_time = _next_query_time(api_name, rate_limits, db_conn)
+                wait = (next_time - datetime.now(LOCAL_TIMEZONE)).total_seconds()
+
+            # a paused provider gets its probe once the cool down is over
+            retry_at = _retry_at(api_name)
+            if retry_at is not None and retry_at - time.monotonic() > wait_limit:
+                remaining = _still_needed(jobs.pop(api_name))
+                unanswered[api_name].extend(remaining)
+                print(f"{api_name} is paused after repeated failures. Queuing {len(remaining)} IPs for ipi --drain.")
+                _defer_queries(
+                    api_name,
+                    _filter_stale_ip_addresses(api_name, remaining, db_conn),
+                    db_conn,
+                    error="paused after repeated failures",
+                )
+                continue
+            if retry_at is not None:
+                wait = max(wait, retry_at - time.monotonic())
+
+            if wait > wait_limit:
+                remaining = _still_needed(jobs.pop(api_name))
+                unanswered[api_name].extend(remaining)
+                print(f"{api_name} rate limit reached. Queuing {len(remaining)} IPs for ipi --drain.")
+                _defer_rate_limited(api_name, remaining, rate_limits, db_conn)
+                continue
+            if wait > 0:
+                _push(api_name, time.monotonic() + wait)
+                continue
+
+            batch = _take_batch(api_name, jobs[api_name], _wanted)
+            if not batch:
+                parked.add(api_name)
+                continue
+
+            asking.update(batch)
+            future = executor.submit(run, api_name, batch)
+            future.add_done_callback(lambda _, api_name=api_name: finished.put(api_name))
+            running[api_name] = batch
+
+        if not ready and not running:
+            break
+
+        # wait for a job to finish, the next provider's slot or the deadline
+        timeout = ready[0][0] - time.monotonic() if ready else None
+        if deadline is not None:
+            until_deadline = deadline - time.monotonic()
+            timeout = until_deadline if timeout is None else min(timeout, until_deadline)
+        if timeout is not None:
+            timeout = max(timeout, 0)
+        try:
+            api_name = finished.get(timeout=timeout)
+        except queue.Empty:
+            continue
+
+        batch = running.pop(api_name)
+        if quorum is not None:
+            asking.subtract(batch)
+            answered.update(_answered_ip_addresses(api_name, batch, db_conn))
+            # same ready time, so they're asked in rank order
+            now = time.monotonic()
+            for parked_api_name in parked:
+                _push(parked_api_name, now)
+            parked.clear()
+
+        if jobs.get(api_name):
+            _push(api_name, time.monotonic())
+        else:
+            jobs.pop(api_name, None)
+
+    # stopped at the deadline
+    for api_name, batch in running.items():
+        unanswered[api_name].extend(batch)
+    for api_name, ip_addresses in jobs.items():
+        remaining = _still_needed(ip_addresses)
+        if not remaining:
+            continue
+        unanswered[api_name].extend(remaining)
+        _defer_queries(
+            api_name,
+            _filter_stale_ip_addresses(api_name, remaining, db_conn),
+            db_conn,
+            error="deadline reached",
+        )
+
+    return dict(unanswered)
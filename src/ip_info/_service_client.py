@@ -0,0 +1,55 @@
+import ipaddress
+import json
+import sys
+from datetime import datetime
+
+import requests
+
+from ip_info._display_ip_info import print_ip_info
+
+# provider lookups can take a while on a cold cache
+SERVER_TIMEOUT = 300
+
+
+def _deserialize_row(row: dict) -> dict:
+    """Undo the service's JSON encoding of a _fetch_ip_info row."""
+    row = dict(row)
+    if row.get("timestamp"):
+        row["timestamp"] = datetime.fromisoformat(row["timestamp"])
+    if "raw_json" in row:
+        row["raw_json"] = json.dumps(row["raw_json"])
+    return row
+
+
+def lookup_via_server(
+    *,
+    server_url: str,
+    ip_addresses: list[ipaddress.IPv4Address | ipaddress.IPv6Address],
+    query_apis: list[str],
+    output_format: str,
+) -> None:
+    """
+    Look ip_addresses up through a running `ip_info serve`, and print the
+    results the same way a local lookup would.
+    """
+    url = f"{server_url.rstrip('/')}/lookup"
+    payload = {
+        "ips": [str(ip) for ip in ip_addresses],
+        "apis": query_apis,
+        "raw_json": output_format == "json",
+    }
+
+    try:
+        response = requests.post(url, json=payload, timeout=SERVER_TIMEOUT)
+    except requests.exceptions.RequestException as error:
+        sys.exit(f"Couldn't reach ip_info server at {server_url}: {error}")
+
+    if response.status_code != 200:
+        sys.exit(f"ip_info server returned {response.status_code}: {response.text}")
+
+    results = response.json()["results"]
+
+    print("")
+    for ip_address in ip_addresses:
+        rows = [_deserialize_row(row) for row in results.get(str(ip_address), [])]
+        print_ip_info(ip_address=ip_address, rows=rows, output_format=output_format)
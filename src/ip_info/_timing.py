@@ -0,0 +1,206 @@
+"""
+Timing spans and counters for a run.
+
+Spans are recorded by name and api_name from any thread. They're kept in
+memory for the end of run report when enable() is called (ipi --profile),
+and passed to any listeners added with add_listener(). (the /metrics
+exporter) When neither is on, timed() and count() return straight away.
+"""
+from collections import defaultdict
+from collections.abc import Callable
+from contextlib import contextmanager
+import functools
+import math
+import sqlite3
+import sys
+import threading
+import time
+
+import tabulate
+
+_enabled = False
+_lock = threading.Lock()
+_spans: dict[tuple[str, str | None], list[float]] = defaultdict(list)
+_counters: dict[str, int] = defaultdict(int)
+_started: float | None = None
+
+# called with (kind, name, api_name, value). kind is "span" (value in
+# seconds) or "count"
+_listeners: list[Callable[[str, str, str | None, float], None]] = []
+
+
+def enable() -> None:
+    """Start recording for report(), discarding anything recorded so far."""
+    global _enabled, _started
+    with _lock:
+        _spans.clear()
+        _counters.clear()
+        _started = time.perf_counter()
+        _enabled = True
+
+
+def disable() -> None:
+    global _enabled
+    _enabled = False
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def add_listener(listener: Callable[[str, str, str | None, float], None]) -> None:
+    with _lock:
+        if listener not in _listeners:
+            _listeners.append(listener)
+
+
+def remove_listener(listener: Callable[[str, str, str | None, float], None]) -> None:
+    with _lock:
+        if listener in _listeners:
+            _listeners.remove(listener)
+
+
+def _is_active() -> bool:
+    return _enabled or bool(_listeners)
+
+
+def _record(kind: str, name: str, api_name: str | None, value: float) -> None:
+    with _lock:
+        if _enabled:
+            if kind == "span":
+                _spans[(name, api_name)].append(value)
+            else:
+                _counters[name] += int(value)
+        listeners = list(_listeners)
+
+    for listener in listeners:
+        listener(kind, name, api_name, value)
+
+
+@contextmanager
+def timed(name: str, api_name: str | None = None):
+    """Record how long the with block takes, as a name span for api_name."""
+    if not _is_active():
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _record("span", name, api_name, time.perf_counter() - start)
+
+
+def _first_argument(*args, **kwargs) -> str | None:
+    return kwargs.get("api_name", args[0] if args else None)
+
+
+def timed_function(name: str, get_api_name=_first_argument):
+    """
+    Decorator version of timed(). get_api_name is called with the function's
+    arguments, and returns the api_name to record the span for.
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _is_active():
+                return function(*args, **kwargs)
+            with timed(name, get_api_name(*args, **kwargs)):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def count(name: str, amount: int = 1, api_name: str | None = None) -> None:
+    if not _is_active():
+        return
+    _record("count", name, api_name, amount)
+
+
+def watch_connection(db_conn: sqlite3.Connection) -> None:
+    """Count the commits issued on db_conn."""
+    if not _is_active():
+        return
+
+    def _trace(statement: str):
+        if statement.startswith("COMMIT"):
+            count("commits")
+
+    db_conn.set_trace_callback(_trace)
+
+
+def _percentile(values: list[float], percent: float) -> float:
+    """Nearest rank percentile of values."""
+    ordered = sorted(values)
+    rank = max(math.ceil(percent / 100 * len(ordered)), 1)
+    return ordered[rank - 1]
+
+
+def _ms(seconds: float) -> str:
+    return f"{seconds * 1000:.1f}"
+
+
+def report(file=sys.stderr) -> None:
+    """Print a summary of everything recorded since enable()."""
+    with _lock:
+        spans = {key: list(values) for key, values in _spans.items()}
+        counters = dict(_counters)
+        started = _started
+
+    def _total(name: str, api_name: str | None) -> float:
+        return sum(spans.get((name, api_name), []))
+
+    api_names = sorted({api_name for (_, api_name) in spans if api_name is not None})
+
+    table = []
+    for api_name in api_names:
+        http = spans.get(("http", api_name), [])
+        blocked = _total("rate_limit_wait", api_name)
+        # check_rate_limits spans include the time it spent asleep
+        db_time = (
+            _total("is_db_entry_recent", api_name)
+            + _total("check_rate_limits", api_name)
+            + _total("insert_ip_info", api_name)
+            + _total("insert_query_info", api_name)
+            - blocked
+        )
+        provider_total = _total("provider", api_name)
+
+        # whatever the provider's thread spent outside the other spans is response parsing
+        parsing = provider_total - sum(http) - db_time - blocked
+
+        table.append([
+            api_name,
+            len(http),
+            _ms(_percentile(http, 50)) if http else "-",
+            _ms(_percentile(http, 95)) if http else "-",
+            _ms(sum(http)),
+            _ms(blocked),
+            _ms(db_time),
+            _ms(max(parsing, 0.0)),
+            _ms(provider_total),
+        ])
+
+    print("\nProfile", file=file)
+    if table:
+        print(
+            tabulate.tabulate(
+                table,
+                headers=[
+                    "api_name", "requests", "http p50 ms", "http p95 ms", "http ms",
+                    "rate limit wait ms", "db ms", "parsing ms", "total ms",
+                ],
+                tablefmt="simple_outline",
+            ),
+            file=file,
+        )
+
+    overall = [
+        ["api key lookup", _ms(_total("api_key", None))],
+        ["database setup", _ms(_total("db_setup", None))],
+        ["display", _ms(_total("display", None))],
+        ["commits", counters.get("commits", 0)],
+    ]
+    if started is not None:
+        overall.append(["wall time", _ms(time.perf_counter() - started)])
+    print(tabulate.tabulate(overall, tablefmt="simple_outline"), file=file)
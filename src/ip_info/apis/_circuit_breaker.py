@@ -0,0 +1,100 @@
+"""
+Circuit breaker per provider, so one that's down (or whose api key was
+revoked) can't take up a run's time.
+
+After CIRCUIT_FAILURE_THRESHOLD failed requests in a row the provider's
+circuit opens: requests to it are refused straight away for
+CIRCUIT_COOL_DOWN seconds. Then one probe request is let through. If it
+works the circuit closes, otherwise it opens for another cool down.
+
+Failures are network errors, timeouts, server errors and auth errors.
+Rate limits and errors about one IP show the provider is up.
+"""
+import threading
+import time
+
+import requests
+
+from ip_info import _timing
+from ip_info.config import CIRCUIT_COOL_DOWN, CIRCUIT_FAILURE_THRESHOLD
+
+# status codes that count as a failure, besides server errors
+FAILURE_STATUS_CODES = (401, 403)
+
+# api_name -> {"failures": in a row, "opened_at": monotonic time the circuit
+# opened or None, "probe_at": monotonic time a probe was let through or None}
+_circuits: dict[str, dict] = {}
+_lock = threading.Lock()
+
+
+class CircuitOpenError(requests.exceptions.RequestException):
+    """Raised instead of making a request to a provider whose circuit is open."""
+
+
+def _circuit(api_name: str) -> dict:
+    return _circuits.setdefault(api_name, {"failures": 0, "opened_at": None, "probe_at": None})
+
+
+def _allow_request(api_name: str) -> bool:
+    """
+    Whether a request to api_name can be made now. Once the cool down is
+    over, the first caller gets to make the probe.
+    """
+    now = time.monotonic()
+    with _lock:
+        circuit = _circuit(api_name)
+        if circuit["opened_at"] is None:
+            return True
+        if now < circuit["opened_at"] + CIRCUIT_COOL_DOWN:
+            return False
+        # half open. a probe that never reported back doesn't hold it forever
+        if circuit["probe_at"] is not None and now < circuit["probe_at"] + CIRCUIT_COOL_DOWN:
+            return False
+        circuit["probe_at"] = now
+        return True
+
+
+def _retry_at(api_name: str) -> float | None:
+    """Monotonic time api_name's circuit lets a probe through, or None if it's closed."""
+    with _lock:
+        circuit = _circuits.get(api_name)
+        if circuit is None or circuit["opened_at"] is None:
+            return None
+        retry_at = circuit["opened_at"] + CIRCUIT_COOL_DOWN
+        if circuit["probe_at"] is not None:
+            retry_at = max(retry_at, circuit["probe_at"] + CIRCUIT_COOL_DOWN)
+        return retry_at
+
+
+def _is_failure(response: requests.Response | None) -> bool:
+    """Whether a response, or None for a request that raised, counts against the circuit."""
+    if response is None:
+        return True
+    return response.status_code >= 500 or response.status_code in FAILURE_STATUS_CODES
+
+
+def _record_result(api_name: str, failed: bool) -> None:
+    """Count a finished request to api_name, opening or closing its circuit."""
+    with _lock:
+        circuit = _circuit(api_name)
+        circuit["probe_at"] = None
+        if not failed:
+            circuit["failures"] = 0
+            circuit["opened_at"] = None
+            return
+
+        circuit["failures"] += 1
+        # a failed probe opens it again straight away
+        if circuit["opened_at"] is None and circuit["failures"] < CIRCUIT_FAILURE_THRESHOLD:
+            return
+        opened = circuit["opened_at"] is None
+        circuit["opened_at"] = time.monotonic()
+
+    if opened:
+        print(f"{api_name} failed {CIRCUIT_FAILURE_THRESHOLD} times in a row. Pausing it for {CIRCUIT_COOL_DOWN}s.")
+        _timing.count("circuit_opened", api_name=api_name)
+
+
+def _reset_circuits() -> None:
+    with _lock:
+        _circuits.clear()
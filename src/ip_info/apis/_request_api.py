@@ -0,0 +1,363 @@
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from email.utils import parsedate_to_datetime
+import ipaddress
+import random
+import sqlite3
+import threading
+import time
+
+import requests
+
+from ip_info import _timing
+from ip_info.apis._circuit_breaker import CircuitOpenError, _allow_request, _is_failure, _record_result, _retry_at
+from ip_info.config import (
+    API_METADATA,
+    LOCAL_TIMEZONE,
+    REQUEST_TIMEOUT,
+    RETRY_BASE_DELAY,
+    RETRY_MAX_ATTEMPTS,
+    RETRY_MAX_DELAY,
+    TIMEFRAME_LENGTHS,
+)
+from ip_info.db._add_to_db import _insert_negative_results, _insert_query_info
+from ip_info.db._pending_queries import _defer_queries
+from ip_info.db._query_db import _filter_stale_ip_addresses
+
+# responses that say the provider can't answer for the IP it was asked
+# about. Auth failures, rate limits and server errors aren't about the IP,
+# so they're left to be retried on the next run.
+NEGATIVE_STATUS_CODES = (400, 404, 410, 422)
+
+# server errors worth retrying. (see RETRY_MAX_ATTEMPTS)
+RETRY_STATUS_CODES = (500, 502, 503, 504)
+
+# one session per thread, so connections to a provider are kept alive
+# between requests. (requests.Session isn't safe to share between threads)
+_thread_local = threading.local()
+
+
+def _get_session() -> requests.Session:
+    session = getattr(_thread_local, "session", None)
+    if session is None:
+        session = _thread_local.session = requests.Session()
+    return session
+
+
+class DeadlineExceededError(requests.exceptions.RequestException):
+    """Raised instead of making a request once this thread's deadline has passed."""
+
+
+@contextmanager
+def _request_deadline(deadline: float | None):
+    """
+    Make provider requests in this thread stop at deadline, a time.monotonic()
+    value. (ipi --deadline) Timeouts are cut to the time left, retries that
+    wouldn't start in time are skipped, and requests after it raise
+    DeadlineExceededError.
+    """
+    previous = getattr(_thread_local, "deadline", None)
+    _thread_local.deadline = deadline
+    try:
+        yield
+    finally:
+        _thread_local.deadline = previous
+
+
+def _cap_timeout(timeout, seconds: float):
+    """timeout, a number, (connect, read) pair or None, cut to at most seconds."""
+    if timeout is None:
+        return seconds
+    if isinstance(timeout, tuple):
+        return tuple(seconds if part is None else min(part, seconds) for part in timeout)
+    return min(timeout, seconds)
+
+
+def _parse_retry_after(response: requests.Response | None) -> float | None:
+    """Seconds a response's Retry-After header asks for, or None without one."""
+    if response is None:
+        return None
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+
+    # either a number of seconds or an http date
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max((retry_at - datetime.now(retry_at.tzinfo)).total_seconds(), 0.0)
+
+
+def _retry_delay(
+    api_name: str,
+    response: requests.Response | None,
+    attempt: int,
+) -> float | None:
+    """
+    Seconds to wait before retrying a failed request to api_name, or None
+    if it shouldn't be retried, or not within RETRY_MAX_DELAY.
+
+    A response's Retry-After is used when it has one. Otherwise a status
+    code that matches one of the provider's rolling rate limits waits out
+    that limit's timeframe, and one that matches an absolute limit (the
+    quota is used up) isn't retried. Other 429s, server errors, connection
+    errors and timeouts back off exponentially, with jitter.
+
+    Args:
+        response: the failed response, or None for a connection error or timeout
+        attempt: requests made so far, from 1
+    """
+    backoff = min(RETRY_BASE_DELAY * 2 ** (attempt - 1), RETRY_MAX_DELAY)
+    # half the backoff, plus up to the other half at random, so threads
+    # that failed together don't retry together
+    backoff = backoff / 2 + random.uniform(0, backoff / 2)
+
+    if response is None:
+        return backoff
+
+    status_code = response.status_code
+    matching_limits = [
+        rate_limit
+        for rate_limit in API_METADATA.get(api_name, {}).get("rate_limits", [])
+        if rate_limit.get("status_code") == status_code
+    ]
+    retry_after = _parse_retry_after(response)
+
+    if status_code == 429 or matching_limits:
+        if retry_after is not None:
+            delay = retry_after + random.uniform(0, RETRY_BASE_DELAY)
+        elif any(rate_limit.get("type", "rolling") == "absolute" for rate_limit in matching_limits):
+            return None
+        elif matching_limits:
+            delay = min(
+                TIMEFRAME_LENGTHS[rate_limit["timeframe"]].total_seconds()
+                for rate_limit in matching_limits
+            )
+        else:
+            delay = backoff
+    elif status_code in RETRY_STATUS_CODES:
+        delay = retry_after if retry_after is not None else backoff
+    else:
+        return None
+
+    return delay if delay <= RETRY_MAX_DELAY else None
+
+
+def _give_up(
+    api_name: str,
+    delay: float | None,
+    attempts: int,
+    max_attempts: int,
+    deadline: float | None,
+) -> bool:
+    """Whether to stop retrying after attempts requests, rather than wait delay seconds."""
+    if delay is None or attempts >= max_attempts:
+        return True
+    # the circuit breaker opened
+    if _retry_at(api_name) is not None:
+        return True
+    return deadline is not None and time.monotonic() + delay >= deadline
+
+
+def _request_api(
+    method: str,
+    url: str,
+    *,
+    api_name: str,
+    db_conn: sqlite3.Connection,
+    batch_size: int = 1,
+    **kwargs,
+) -> requests.Response:
+    """
+    Make a request to a provider and log it in the query-log table, with
+    its duration, response size and the number of IPs it asked about.
+
+    429s, server errors, connection errors and timeouts are retried, up to
+    the provider's "max_attempts" (RETRY_MAX_ATTEMPTS) requests in all,
+    when _retry_delay allows. Each attempt is logged with its retry_count.
+    Raises CircuitOpenError without a request while the provider's circuit
+    is open. (see _circuit_breaker.py) Stops at the thread's deadline, if
+    one is set. (see _request_deadline)
+
+    kwargs are passed on to requests.Session.request, with the provider's
+    "timeout" (REQUEST_TIMEOUT) unless one is given. Returns the last
+    response. Exceptions from requests are logged without a status code,
+    then raised as usual once retries run out.
+    """
+    metadata = API_METADATA.get(api_name, {})
+    # always make at least one request
+    max_attempts = max(1, metadata.get("max_attempts", RETRY_MAX_ATTEMPTS))
+    timeout = kwargs.pop("timeout", metadata.get("timeout", REQUEST_TIMEOUT))
+    deadline = getattr(_thread_local, "deadline", None)
+
+    if not _allow_request(api_name):
+        raise CircuitOpenError(f"{api_name} is paused after repeated failures")
+
+    for attempt in range(max_attempts):
+        kwargs["timeout"] = timeout
+        if deadline is not None:
+            time_left = deadline - time.monotonic()
+            if time_left <= 0:
+                raise DeadlineExceededError("deadline reached")
+            kwargs["timeout"] = _cap_timeout(timeout, time_left)
+
+        start = time.perf_counter()
+        try:
+            with _timing.timed("http", api_name):
+                response = _get_session().request(method, url, **kwargs)
+        except requests.exceptions.RequestException as error:
+            _timing.count("provider_errors", api_name=api_name)
+            _insert_query_info(
+                api_name,
+                None,
+                db_conn,
+                duration=time.perf_counter() - start,
+                batch_size=batch_size,
+                retry_count=attempt,
+                error=error,
+            )
+            _record_result(api_name, failed=True)
+            transient = isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout))
+            delay = _retry_delay(api_name, None, attempt + 1) if transient else None
+            if _give_up(api_name, delay, attempt + 1, max_attempts, deadline):
+                raise
+            reason = type(error).__name__
+        else:
+            if response.status_code != 200:
+                _timing.count("provider_errors", api_name=api_name)
+
+            _insert_query_info(
+                api_name,
+                response,
+                db_conn,
+                duration=time.perf_counter() - start,
+                batch_size=batch_size,
+                retry_count=attempt,
+            )
+            _record_result(api_name, failed=_is_failure(response))
+
+            if response.status_code == 200:
+                return response
+            delay = _retry_delay(api_name, response, attempt + 1)
+            if _give_up(api_name, delay, attempt + 1, max_attempts, deadline):
+                return response
+            reason = f"status code {response.status_code}"
+
+        print(f"{api_name}: {reason}, retrying in {delay:.1f}s")
+        _timing.count("provider_retries", api_name=api_name)
+        with _timing.timed("retry_wait", api_name):
+            time.sleep(delay)
+
+
+def _record_negative_response(
+    api_name: str,
+    ip_addresses: list,
+    response: requests.Response,
+    db_conn: sqlite3.Connection,
+) -> None:
+    """
+    Remember ip_addresses as unanswerable by api_name when a single IP
+    request's response says so, rather than hitting a limit or failing.
+    """
+    rate_limit_codes = {
+        rate_limit.get("status_code")
+        for rate_limit in API_METADATA.get(api_name, {}).get("rate_limits", [])
+    }
+    status_code = response.status_code
+    if status_code not in NEGATIVE_STATUS_CODES or status_code in rate_limit_codes:
+        return
+
+    _insert_negative_results(
+        api_name,
+        ip_addresses,
+        db_conn,
+        reason=f"{status_code} {response.reason}",
+        status_code=status_code,
+    )
+
+
+def _defer_rate_limited(
+    api_name: str,
+    ip_addresses: list,
+    rate_limits: list[dict],
+    db_conn: sqlite3.Connection,
+) -> None:
+    """
+    Queue the ips in ip_addresses without a recent result, once a rate
+    limit stops a handler. They're due when the limit allows queries again.
+    """
+    _defer_queries(
+        api_name,
+        _filter_stale_ip_addresses(api_name, ip_addresses, db_conn),
+        db_conn,
+        rate_limits=rate_limits,
+    )
+
+
+def _handle_failed_response(
+    api_name: str,
+    ip_addresses: list,
+    response: requests.Response,
+    rate_limits: list[dict],
+    db_conn: sqlite3.Connection,
+) -> None:
+    """
+    Deal with a non-200 response for ip_addresses: queue them again for
+    rate limits and server errors, no sooner than any Retry-After (see
+    db/_pending_queries.py), or remember them as unanswerable. (see _record_negative_response) Anything else,
+    like a bad api key, is left for the next run.
+    """
+    rate_limit_codes = {
+        rate_limit.get("status_code")
+        for rate_limit in rate_limits
+    } | {429}
+    status_code = response.status_code
+
+    not_before = None
+    retry_after = _parse_retry_after(response)
+    if retry_after is not None:
+        not_before = datetime.now(LOCAL_TIMEZONE) + timedelta(seconds=retry_after)
+
+    if status_code in rate_limit_codes:
+        _defer_queries(api_name, ip_addresses, db_conn, rate_limits=rate_limits, not_before=not_before)
+    elif status_code >= 500:
+        _defer_queries(
+            api_name,
+            ip_addresses,
+            db_conn,
+            error=f"{status_code} {response.reason}",
+            not_before=not_before,
+        )
+    elif len(ip_addresses) == 1:
+        _record_negative_response(api_name, ip_addresses, response, db_conn)
+
+
+def _record_missing_results(
+    api_name: str,
+    requested: list[str],
+    answered,
+    db_conn: sqlite3.Connection,
+) -> None:
+    """
+    Remember the IPs a bulk response left out, or only returned an error
+    for, as unanswerable by api_name.
+
+    Args:
+        requested: the IPs sent in the request
+        answered: the IPs the provider returned a result for
+    """
+    def _parse(ip_string):
+        try:
+            return ipaddress.ip_address(str(ip_string).strip())
+        except ValueError:
+            return None
+
+    answered = {_parse(ip_string) for ip_string in answered}
+    missing = [ip_string for ip_string in requested if _parse(ip_string) not in answered]
+
+    _insert_negative_results(api_name, missing, db_conn, reason="not in response")
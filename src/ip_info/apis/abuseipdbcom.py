@@ -4,8 +4,10 @@ import sqlite3
 from datetime import datetime
 from typing import Dict
 
+from ip_info.apis._request_api import _defer_rate_limited, _handle_failed_response, _request_api
 from ip_info.config import LOCAL_TIMEZONE
-from ip_info.db._add_to_db import _insert_ip_info, _insert_query_info
+from ip_info.db._add_to_db import _insert_ip_info
+from ip_info.db._pending_queries import _defer_queries
 from ip_info.db._query_db import _check_rate_limits, _is_db_entry_recent
 
 
@@ -22,7 +24,7 @@ def abuseipdbcom(
     url = "https://api.abuseipdb.com/api/v2/check"
     headers = {"Accept": "application/json", "Key": api_key}
 
-    for ip_address in ip_addresses:
+    for index, ip_address in enumerate(ip_addresses):
 
         # skip if a recent entry exists
         if _is_db_entry_recent(api_name, ip_address, db_conn):
@@ -30,8 +32,9 @@ def abuseipdbcom(
 
         # check rate limits
         if _check_rate_limits(api_name, rate_limits, db_conn):
-            print("Rate limit reached. Skipping query.")
-            continue
+            print("Rate limit reached. Queuing the remaining IPs for ipi --drain.")
+            _defer_rate_limited(api_name, ip_addresses[index:], rate_limits, db_conn)
+            break
 
         params = {
             "ipAddress": str(ip_address),
@@ -40,18 +43,19 @@ def abuseipdbcom(
 
         try:
             print(f"Querying {api_display_name} for {ip_address}")
-            response = requests.get(url, headers=headers, params=params)
-            _insert_query_info(api_name, response, db_conn)
+            response = _request_api("GET", url, headers=headers, params=params, api_name=api_name, db_conn=db_conn)
 
             # rate limit response
             if response.status_code != 200:
                 print(f"Received status code {response.status_code}, message {response.text}. Skipping query")
+                _handle_failed_response(api_name, [ip_address], response, rate_limits, db_conn)
                 continue
 
             response.raise_for_status()
             result = response.json()
         except requests.exceptions.RequestException as e:
             print(f"Error querying {api_display_name} for {ip_address}: {e}")
+            _defer_queries(api_name, [ip_address], db_conn, error=str(e))
             continue
 
         # save query time for ip database timestamp
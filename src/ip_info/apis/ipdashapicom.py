@@ -4,9 +4,11 @@ import sqlite3
 from datetime import datetime
 from typing import Dict
 
-from ip_info.config import LOCAL_TIMEZONE
-from ip_info.db._add_to_db import _insert_ip_info, _insert_query_info
-from ip_info.db._query_db import _check_rate_limits, _is_db_entry_recent
+from ip_info.apis._request_api import _defer_rate_limited, _handle_failed_response, _record_missing_results, _request_api
+from ip_info.config import API_METADATA, LOCAL_TIMEZONE
+from ip_info.db._add_to_db import _insert_ip_info
+from ip_info.db._pending_queries import _defer_queries
+from ip_info.db._query_db import _check_rate_limits, _filter_stale_ip_addresses
 
 
 def ipdashapicom(
@@ -23,10 +25,10 @@ def ipdashapicom(
     params = {
         "fields": "66842623"
     }
-    max_chunk_size = 100
+    max_chunk_size = API_METADATA[api_name]["batch_size"]
 
     # filter out ips with recent entries in database
-    ips_to_query = [ip for ip in ip_addresses if not _is_db_entry_recent(api_name, ip, db_conn)]
+    ips_to_query = _filter_stale_ip_addresses(api_name, ip_addresses, db_conn)
     if not ips_to_query:
         return
 
@@ -35,8 +37,9 @@ def ipdashapicom(
 
         # check rate limits
         if _check_rate_limits(api_name, rate_limits, db_conn):
-            print("Rate limit reached. Skipping query.")
-            continue
+            print("Rate limit reached. Queuing the remaining IPs for ipi --drain.")
+            _defer_rate_limited(api_name, ips_to_query[i:], rate_limits, db_conn)
+            break
 
         # build request params
         chunk = [str(ip) for ip in ips_to_query[i : i + max_chunk_size]]
@@ -47,20 +50,24 @@ def ipdashapicom(
                 print(f"Querying {api_display_name} for {chunk[0]}")
             else:
                 print(f"Querying {api_display_name} for {len(chunk)} IPs")
-            response = requests.post(url, params=params, json=chunk)
-            _insert_query_info(api_name, response, db_conn)
+            response = _request_api("POST", url, params=params, json=chunk, api_name=api_name, db_conn=db_conn, batch_size=len(chunk))
 
             # rate limit response
             if response.status_code != 200:
                 print(f"Received status code {response.status_code}, message {response.text}. Skipping query")
+                _handle_failed_response(api_name, chunk, response, rate_limits, db_conn)
                 continue
 
             response.raise_for_status()
             results = response.json()
         except requests.exceptions.RequestException as e:
             print(f"Error querying {api_display_name}: {e}")
+            _defer_queries(api_name, ips_to_query[i:], db_conn, error=str(e))
             return None
         
+        # remember ips the provider didn't return a result for
+        _record_missing_results(api_name, chunk, [result.get("query") for result in results], db_conn)
+
         # process each result in the batch
         for result in results:
             query_ip = result.get("query")
@@ -1,12 +1,17 @@
 import ipaddress
 import ipinfo
+from ipinfo.exceptions import RequestQuotaExceededError
 import sqlite3
 from datetime import datetime
 from typing import Dict
 
+from ip_info import _timing
+from ip_info.apis._circuit_breaker import _allow_request, _record_result
+from ip_info.apis._request_api import _record_missing_results
 from ip_info.config import LOCAL_TIMEZONE
 from ip_info.db._add_to_db import _insert_ip_info
-from ip_info.db._query_db import _is_db_entry_recent
+from ip_info.db._pending_queries import _defer_queries
+from ip_info.db._query_db import _filter_stale_ip_addresses
 
 
 def ipinfoio(
@@ -20,12 +25,18 @@ def ipinfoio(
 ) -> None:
     
     # filter out ips with recent entries in database
-    ips_to_query = [ip for ip in ip_addresses if not _is_db_entry_recent(api_name, ip, db_conn)]
+    ips_to_query = _filter_stale_ip_addresses(api_name, ip_addresses, db_conn)
     if not ips_to_query:
         return
     
     ip_strings = [str(ip) for ip in ips_to_query]
 
+    # the ipinfo package makes its own requests, so check the circuit breaker here
+    if not _allow_request(api_name):
+        print(f"{api_display_name} is paused after repeated failures. Queuing {len(ips_to_query)} IPs for ipi --drain.")
+        _defer_queries(api_name, ips_to_query, db_conn, error="paused after repeated failures")
+        return
+
     
     # build request params
     handler = ipinfo.getHandler(
@@ -38,16 +49,24 @@ def ipinfoio(
             print(f"Querying {api_display_name} for {ips_to_query[0]}")
         else:
             print(f"Querying {api_display_name} for {len(ips_to_query)} IPs")
-        results = handler.getBatchDetails(ip_strings)
+        with _timing.timed("http", api_name):
+            results = handler.getBatchDetails(ip_strings)
 
     except Exception as error:
         # includes RequestQuotaExceededError, TimeoutExceededError, etc.
         print(f"Error querying {api_display_name}: {error}")
+        _record_result(api_name, failed=not isinstance(error, RequestQuotaExceededError))
+        _defer_queries(api_name, ips_to_query, db_conn, error=str(error))
         return
 
+    _record_result(api_name, failed=False)
+
     # save query time for ip database timestamp
     last_request_time = datetime.now(LOCAL_TIMEZONE)
 
+    # remember ips the provider didn't return a result for
+    _record_missing_results(api_name, ip_strings, results.keys(), db_conn)
+
     for query_ip, result in results.items():
 
             # split as and company
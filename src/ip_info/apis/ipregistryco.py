@@ -4,9 +4,11 @@ import sqlite3
 from datetime import datetime
 from typing import Dict
 
-from ip_info.config import LOCAL_TIMEZONE
-from ip_info.db._add_to_db import _insert_ip_info, _insert_query_info
-from ip_info.db._query_db import _check_rate_limits, _is_db_entry_recent
+from ip_info.apis._request_api import _defer_rate_limited, _handle_failed_response, _record_missing_results, _request_api
+from ip_info.config import API_METADATA, LOCAL_TIMEZONE
+from ip_info.db._add_to_db import _insert_ip_info
+from ip_info.db._pending_queries import _defer_queries
+from ip_info.db._query_db import _check_rate_limits, _filter_stale_ip_addresses
 
 
 def ipregistryco(
@@ -19,13 +21,13 @@ def ipregistryco(
     db_conn: sqlite3.Connection
 ) -> None:
     
-    max_chunk_size = 1024
+    max_chunk_size = API_METADATA[api_name]["batch_size"]
     params = {
         "key": api_key
     }
 
     # filter out ips that already have a recent db entry
-    ips_to_query = [ip for ip in ip_addresses if not _is_db_entry_recent(api_name, ip, db_conn)]
+    ips_to_query = _filter_stale_ip_addresses(api_name, ip_addresses, db_conn)
     if not ips_to_query:
         return
     
@@ -33,8 +35,9 @@ def ipregistryco(
 
         # check rate limits
         if _check_rate_limits(api_name, rate_limits, db_conn):
-            print("Rate limit reached. Skipping query.")
-            continue
+            print("Rate limit reached. Queuing the remaining IPs for ipi --drain.")
+            _defer_rate_limited(api_name, ips_to_query[i:], rate_limits, db_conn)
+            break
 
         # build request params
         chunk = [str(ip) for ip in ips_to_query[i : i + max_chunk_size]]
@@ -45,18 +48,19 @@ def ipregistryco(
                 print(f"Querying {api_display_name} for {chunk[0]}")
             else:
                 print(f"Querying {api_display_name} for {len(chunk)} IPs")
-            response = requests.get(url, params=params)
-            _insert_query_info(api_name, response, db_conn)
+            response = _request_api("GET", url, params=params, api_name=api_name, db_conn=db_conn, batch_size=len(chunk))
 
             # rate limit response
             if response.status_code != 200:
                 print(f"Received status code {response.status_code}, message {response.text}. Skipping query")
+                _handle_failed_response(api_name, chunk, response, rate_limits, db_conn)
                 continue
 
             response.raise_for_status()
             results = response.json()
         except requests.exceptions.RequestException as error:
             print(f"Error querying {api_display_name}: {error}")
+            _defer_queries(api_name, ips_to_query[i:], db_conn, error=str(error))
             return
 
         ### normalize to list
@@ -73,6 +77,9 @@ def ipregistryco(
         # save query time for ip database timestamp
         last_request_time = datetime.now(LOCAL_TIMEZONE)
 
+        # remember ips the provider didn't return a result for
+        _record_missing_results(api_name, chunk, [result.get("ip") for result in results], db_conn)
+
         for result in results:
 
             query_ip = result.get("ip")
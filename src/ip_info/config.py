@@ -1,4 +1,5 @@
 import os
+from datetime import timedelta
 from zoneinfo import ZoneInfo
 from typing import Any, Dict, Final
 
@@ -29,6 +30,8 @@ API_METADATA: Dict[str, Dict[str, Any]] = {
         "api_display_name": "AbuseIPDB.com",
         "requires_key": True,
         "allows_bulk": False,
+        # abuse reports change daily
+        "max_age": 7,
         "rate_limits": [
             # no documented short term rate limit
             {
@@ -44,6 +47,10 @@ API_METADATA: Dict[str, Dict[str, Any]] = {
         "api_display_name": "CriminalIP.io",
         "requires_key": True,
         "allows_bulk": False,
+        # small monthly quota, don't spend it on retries
+        "max_attempts": 2,
+        # threat scores go stale quickly
+        "max_age": 14,
         "rate_limits": [
             # short term rate limit: doesn't allow parallel queries
             {
@@ -74,6 +81,8 @@ API_METADATA: Dict[str, Dict[str, Any]] = {
         "api_display_name": "IPAPI.co",
         "requires_key": False,
         "allows_bulk": False,
+        # same answer for every IP in a network (ipi --by_prefix)
+        "geo_only": True,
         "rate_limits": [
             # no documented short term rate limit
             # adding per-minute limit due to excessive 429 failures
@@ -94,6 +103,8 @@ API_METADATA: Dict[str, Dict[str, Any]] = {
         "api_display_name": "IPAPI.com",
         "requires_key": True,
         "allows_bulk": False,
+        # small monthly quota, don't spend it on retries
+        "max_attempts": 2,
         "rate_limits": [
             # no documented short term rate limit
             {
@@ -109,6 +120,9 @@ API_METADATA: Dict[str, Dict[str, Any]] = {
         "api_display_name": "IPAPI.is",
         "requires_key": True,
         "allows_bulk": True,
+        "batch_size": 100,
+        # abuser scores go stale quickly
+        "max_age": 14,
         "rate_limits": [
             # no documented short term rate limit
             {
@@ -123,6 +137,7 @@ API_METADATA: Dict[str, Dict[str, Any]] = {
         "api_display_name": "IPAPI.org",
         "requires_key": True,
         "allows_bulk": True,
+        "batch_size": 100,
         "rate_limits": [
             # no documented short term rate limit
             {
@@ -136,6 +151,9 @@ API_METADATA: Dict[str, Dict[str, Any]] = {
         "api_display_name": "IP-API.com",
         "requires_key": False,
         "allows_bulk": True,
+        "batch_size": 100,
+        # same answer for every IP in a network (ipi --by_prefix)
+        "geo_only": True,
         "rate_limits": [
             {
                 "query_limit":   15,
@@ -150,6 +168,8 @@ API_METADATA: Dict[str, Dict[str, Any]] = {
         "api_display_name": "IPGeolocation.io",
         "requires_key": True,
         "allows_bulk": False,
+        # same answer for every IP in a network (ipi --by_prefix)
+        "geo_only": True,
         "rate_limits": [
             # no documented short term rate limit
             {
@@ -165,6 +185,7 @@ API_METADATA: Dict[str, Dict[str, Any]] = {
         "api_display_name": "IPInfo.io",
         "requires_key": True,
         "allows_bulk": True,
+        "batch_size": 1000,
         "rate_limits": [
             # no documented rate limits
             # adding this to wait for a minute if 429 returned
@@ -181,6 +202,7 @@ API_METADATA: Dict[str, Dict[str, Any]] = {
         "api_display_name": "IPQuery.io",
         "requires_key": False,
         "allows_bulk": True,
+        "batch_size": 10000,
         "rate_limits": [
             # no documented rate limits
         ],
@@ -189,6 +211,7 @@ API_METADATA: Dict[str, Dict[str, Any]] = {
         "api_display_name": "IPRegistry.co",
         "requires_key": True,
         "allows_bulk": True,
+        "batch_size": 1024,
         "rate_limits": [
             # no documented rate limits, other than 100k per free account
             # adding this to wait for a minute if 429 returned
@@ -205,6 +228,8 @@ API_METADATA: Dict[str, Dict[str, Any]] = {
         "api_display_name": "VirusTotal.com",
         "requires_key": True,
         "allows_bulk": False,
+        # malware verdicts change daily
+        "max_age": 7,
         "rate_limits": [
             {
                 "query_limit":   4,
@@ -225,18 +250,115 @@ API_METADATA: Dict[str, Dict[str, Any]] = {
  
 TIMEZONE_STRING = "America/New_York"
 LOCAL_TIMEZONE = ZoneInfo(TIMEZONE_STRING)
+# stored results newer than this many days are used instead of querying
+# again. set "max_age" in a provider's API_METADATA entry to override.
 MAX_AGE = 90
 
+# longest span each rate limit timeframe can cover
+TIMEFRAME_LENGTHS = {
+    "second": timedelta(seconds=1),
+    "minute": timedelta(minutes=1),
+    "hour":   timedelta(hours=1),
+    "day":    timedelta(days=1),
+    "month":  timedelta(days=31),
+}
+# ip_data rows older than this many days are deleted by ip_info_maintain.
+# set "expire_age" in a provider's API_METADATA entry to override.
+EXPIRE_AGE = 365
+
+# api_queries rows are kept for the longest rate limit window of their
+# provider, but at least this many days, then rolled up into daily counts
+QUERY_LOG_RETENTION_DAYS = 7
+
+# when a provider can't answer for an IP (it's refused as invalid, not found,
+# or missing from a bulk response) that's remembered for this many days, so
+# runs in between don't ask again. set "negative_max_age" in a provider's
+# API_METADATA entry to override.
+NEGATIVE_MAX_AGE = 1
+
+# queries held back by a rate limit, or that failed with a network or server
+# error, are queued for ipi --drain. held back queries become due once the
+# provider's limits allow them, failed ones after PENDING_RETRY_DELAY seconds,
+# giving up after PENDING_MAX_ATTEMPTS tries.
+PENDING_RETRY_DELAY = 300
+PENDING_MAX_ATTEMPTS = 5
+# seconds ipi --drain waits for the next queued query to become due before
+# leaving the rest for a later run
+DRAIN_MAX_WAIT = 3600
+
+# provider requests that fail with a 429, a 5xx, a connection error or a
+# timeout are retried, up to RETRY_MAX_ATTEMPTS requests in all, after the
+# response's Retry-After or an exponential backoff from RETRY_BASE_DELAY
+# seconds with jitter. set "max_attempts" in a provider's API_METADATA entry
+# to override. a wait longer than RETRY_MAX_DELAY seconds isn't retried, the
+# IPs are queued for ipi --drain instead.
+RETRY_MAX_ATTEMPTS = 3
+RETRY_BASE_DELAY = 0.5
+RETRY_MAX_DELAY = 10
+
+# (connect, read) timeout in seconds for provider requests. set "timeout" in
+# a provider's API_METADATA entry to override.
+REQUEST_TIMEOUT = (5, 30)
+
+# a provider whose requests fail CIRCUIT_FAILURE_THRESHOLD times in a row
+# (network errors, timeouts, server and auth errors) gets no more requests
+# for CIRCUIT_COOL_DOWN seconds, then one probe request to see if it's back.
+CIRCUIT_FAILURE_THRESHOLD = 5
+CIRCUIT_COOL_DOWN = 60
+
+# longest the scheduler waits for a provider's rate limits to allow its next
+# query before queuing the rest of its IPs for ipi --drain instead. (seconds)
+SCHEDULER_MAX_WAIT = 10
+
+# ipi --tiered asks these providers (cheap, bulk, no real quota) about every
+# IP first. the rest, including the small quota ones, only get the IPs whose
+# stored results so far (offline ip2proxy data included) have one of
+# ESCALATE_FLAGS, or a risk of at least ESCALATE_MIN_RISK, or no results at all.
+TIERED_FIRST_APIS = ["ipqueryio", "ipdashapicom"]
+ESCALATE_FLAGS = ["proxy", "vpn", "tor", "hosting", "datacenter", "threat", "abuse", "malicious"]
+ESCALATE_MIN_RISK = 50
+
+# ipi --sources K hands each IP to just enough providers for K results,
+# preferring unlimited providers, then those with the most quota left. this
+# share of each quota is kept back for later lookups.
+QUOTA_RESERVE = 0.1
+
+# ipi --by_prefix asks "geo_only" providers about one IP per network of these
+# prefix lengths (IPv4, IPv6), and copies the answer to the other IPs in it,
+# marked as inferred.
+PREFIX_LENGTHS = (24, 48)
+
+# where `ip_info serve` listens by default. (local only)
+SERVICE_HOST = "127.0.0.1"
+SERVICE_PORT = 8321
+# seconds the service waits to merge IPs from concurrent lookups into one
+# request to a bulk provider
+COALESCE_WINDOW = 0.05
+
+# in-process cache of each IP's stored results, in front of the database.
+# entries expire after IP_CACHE_TTL seconds (which bounds how long writes
+# from other processes go unseen), or once their oldest row is older than its
+# provider's max age, whichever comes first.
+IP_CACHE_SIZE = 10000
+IP_CACHE_TTL = 300
+
 BASE_DIR: Final[str] = os.path.dirname(os.path.abspath(__file__))
 DB_PATH : Final[str] = os.path.join(BASE_DIR, "ip_info.db")
 
+PROVIDER_TABLE_NAME = "providers"
+PROVIDER_TABLE_COLUMNS = {
+    "id": "INTEGER PRIMARY KEY AUTOINCREMENT",
+    "api_name": "TEXT NOT NULL",
+    "api_display_name": "TEXT",
+}
+
 IP_TABLE_NAME = 'ip_data'
 IP_TABLE_COLUMNS = {
     "id": "INTEGER PRIMARY KEY AUTOINCREMENT",
     "timestamp": "TIMESTAMP",
     "ip_address": "TEXT",
-    "api_name": "TEXT",
-    "api_display_name": "TEXT",
+    "ip_bytes": "BLOB",
+    "provider_id": "INTEGER",
     "risk": "INTEGER",
     "city": "TEXT",
     "state": "TEXT",
@@ -246,7 +368,7 @@ IP_TABLE_COLUMNS = {
     "as_name": "TEXT",
     "hostname": "TEXT",
     "flags": "TEXT",
-    "raw_json": "TEXT"
+    "raw_json_id": "INTEGER"
 }
 IP_INSERT_ORDER = [
     column
@@ -254,13 +376,25 @@ IP_INSERT_ORDER = [
     if column != "id"
 ]
 
+# raw api responses, zlib compressed and stored once per distinct payload
+RAW_JSON_TABLE_NAME = "raw_json"
+RAW_JSON_TABLE_COLUMNS = {
+    "id": "INTEGER PRIMARY KEY AUTOINCREMENT",
+    "digest": "BLOB NOT NULL",
+    "payload": "BLOB",
+}
+
 QUERY_TABLE_NAME = "api_queries"
 QUERY_TABLE_COLUMNS = {
     "id":        "INTEGER PRIMARY KEY AUTOINCREMENT",
-    "api_name":  "TEXT",
+    "provider_id": "INTEGER",
     "timestamp": "TIMESTAMP",
     "status_code": "INTEGER",
     "error_text": "TEXT",
+    "duration_ms": "REAL",
+    "response_bytes": "INTEGER",
+    "batch_size": "INTEGER",
+    "retry_count": "INTEGER",
 }
 QUERY_INSERT_ORDER = [
     column
@@ -268,19 +402,142 @@ QUERY_INSERT_ORDER = [
     if column != "id"
 ]
 
+QUERY_ROLLUP_TABLE_NAME = "api_query_rollups"
+QUERY_ROLLUP_TABLE_COLUMNS = {
+    "id":          "INTEGER PRIMARY KEY AUTOINCREMENT",
+    "provider_id": "INTEGER",
+    "day":         "TEXT",
+    "status_code": "INTEGER",
+    "query_count": "INTEGER",
+    # rolled up rows with a duration_ms, which it averages over
+    "timed_count": "INTEGER",
+    # sums over the rolled up rows, for averages
+    "duration_ms": "REAL",
+    "response_bytes": "INTEGER",
+    "batch_size": "INTEGER",
+    "retry_count": "INTEGER",
+}
+
+# provider/IP pairs the provider couldn't answer for. (see NEGATIVE_MAX_AGE)
+NEGATIVE_TABLE_NAME = "negative_results"
+NEGATIVE_TABLE_COLUMNS = {
+    "id":          "INTEGER PRIMARY KEY AUTOINCREMENT",
+    "provider_id": "INTEGER",
+    "ip_bytes":    "BLOB",
+    "timestamp":   "TIMESTAMP",
+    "status_code": "INTEGER",
+    "reason":      "TEXT",
+}
+
+# queued provider/IP queries. (see PENDING_RETRY_DELAY)
+PENDING_TABLE_NAME = "pending_queries"
+PENDING_TABLE_COLUMNS = {
+    "id":           "INTEGER PRIMARY KEY AUTOINCREMENT",
+    "provider_id":  "INTEGER",
+    "ip_bytes":     "BLOB",
+    "ip_address":   "TEXT",
+    "queued":       "TIMESTAMP",
+    "next_attempt": "TIMESTAMP",
+    "attempts":     "INTEGER",
+    "last_error":   "TEXT",
+}
+
+# queries made in the current window of each provider's absolute rate
+# limits, kept up to date as queries are logged. (see db/_quota_ledger.py)
+QUOTA_TABLE_NAME = "quota_ledger"
+QUOTA_TABLE_COLUMNS = {
+    "id":           "INTEGER PRIMARY KEY AUTOINCREMENT",
+    "provider_id":  "INTEGER",
+    "timeframe":    "TEXT",
+    "window_start": "TIMESTAMP",
+    "used":         "INTEGER",
+}
+
 TABLES = [
+    {
+        "name": PROVIDER_TABLE_NAME,
+        "columns": PROVIDER_TABLE_COLUMNS,
+        "unique_indexes": [
+            (f"idx_{PROVIDER_TABLE_NAME}_api_name", "(api_name)")
+        ],
+    },
     {
         "name": IP_TABLE_NAME,
         "columns": IP_TABLE_COLUMNS,
+        "unique_indexes": [
+            (f"idx_{IP_TABLE_NAME}_ip_bytes", "(ip_bytes, provider_id)")
+        ],
         "indexes": [
-            (f"idx_{IP_TABLE_NAME}", "(api_name, ip_address)")
+            (f"idx_{IP_TABLE_NAME}_raw_json", "(raw_json_id)")
+        ],
+    },
+    {
+        "name": RAW_JSON_TABLE_NAME,
+        "columns": RAW_JSON_TABLE_COLUMNS,
+        "unique_indexes": [
+            (f"idx_{RAW_JSON_TABLE_NAME}_digest", "(digest)")
         ],
     },
     {
         "name": QUERY_TABLE_NAME,
         "columns": QUERY_TABLE_COLUMNS,
         "indexes": [
-            (f"idx_{QUERY_TABLE_NAME}", "(api_name, timestamp)")
+            (f"idx_{QUERY_TABLE_NAME}_provider", "(provider_id, timestamp)")
+        ],
+    },
+    {
+        "name": QUERY_ROLLUP_TABLE_NAME,
+        "columns": QUERY_ROLLUP_TABLE_COLUMNS,
+        "unique_indexes": [
+            (f"idx_{QUERY_ROLLUP_TABLE_NAME}", "(provider_id, day, status_code)")
+        ],
+    },
+    {
+        "name": NEGATIVE_TABLE_NAME,
+        "columns": NEGATIVE_TABLE_COLUMNS,
+        "unique_indexes": [
+            (f"idx_{NEGATIVE_TABLE_NAME}_ip_bytes", "(ip_bytes, provider_id)")
         ],
     },
+    {
+        "name": PENDING_TABLE_NAME,
+        "columns": PENDING_TABLE_COLUMNS,
+        "unique_indexes": [
+            (f"idx_{PENDING_TABLE_NAME}_ip_bytes", "(ip_bytes, provider_id)")
+        ],
+        "indexes": [
+            (f"idx_{PENDING_TABLE_NAME}_next_attempt", "(next_attempt)")
+        ],
+    },
+    {
+        "name": QUOTA_TABLE_NAME,
+        "columns": QUOTA_TABLE_COLUMNS,
+        "unique_indexes": [
+            (f"idx_{QUOTA_TABLE_NAME}_window", "(provider_id, timeframe)")
+        ],
+    },
+]
+
+# read-only views that put api_name and api_display_name back next to the data,
+# so queries and display code can keep using the original column names
+IP_VIEW_NAME = "ip_data_view"
+QUERY_VIEW_NAME = "api_queries_view"
+VIEWS = [
+    {
+        "name": IP_VIEW_NAME,
+        "select": (
+            f"SELECT {IP_TABLE_NAME}.*, "
+            f"{PROVIDER_TABLE_NAME}.api_name, {PROVIDER_TABLE_NAME}.api_display_name "
+            f"FROM {IP_TABLE_NAME} "
+            f"JOIN {PROVIDER_TABLE_NAME} ON {PROVIDER_TABLE_NAME}.id = {IP_TABLE_NAME}.provider_id"
+        ),
+    },
+    {
+        "name": QUERY_VIEW_NAME,
+        "select": (
+            f"SELECT {QUERY_TABLE_NAME}.*, {PROVIDER_TABLE_NAME}.api_name "
+            f"FROM {QUERY_TABLE_NAME} "
+            f"JOIN {PROVIDER_TABLE_NAME} ON {PROVIDER_TABLE_NAME}.id = {QUERY_TABLE_NAME}.provider_id"
+        ),
+    },
 ]
\ No newline at end of file
@@ -1,12 +1,96 @@
 from collections.abc import Iterable, Mapping
 from datetime import datetime
-import json
 import sqlite3
 import sys
 
-from ip_info.config import IP_INSERT_ORDER, IP_TABLE_NAME, LOCAL_TIMEZONE, QUERY_TABLE_NAME
+from ip_info import _timing
+from ip_info._compress_json import _compress_json
+from ip_info._pack_ip_address import _canonical_ip_address, _pack_ip_address
+from ip_info.config import (
+    API_METADATA,
+    IP_INSERT_ORDER,
+    IP_TABLE_NAME,
+    LOCAL_TIMEZONE,
+    NEGATIVE_TABLE_NAME,
+    PROVIDER_TABLE_NAME,
+    QUERY_TABLE_NAME,
+    RAW_JSON_TABLE_NAME,
+)
+from ip_info.db._ip_cache import _cache_invalidate
+from ip_info.db._quota_ledger import _record_quota_use
 
 
+def _get_provider_id(
+    api_name: str,
+    db_conn: sqlite3.Connection,
+    api_display_name: str | None = None,
+) -> int:
+    """
+    Return the providers.id for api_name, adding the provider if it's new.
+
+    api_display_name defaults to the name in API_METADATA. When given, it
+    replaces whatever display name is stored.
+    """
+    if db_conn is None:
+        sys.exit("ERROR: no database connection provided.")
+
+    if api_display_name is None:
+        api_display_name = API_METADATA.get(api_name, {}).get("api_display_name", api_name)
+
+    cursor = db_conn.cursor()
+    cursor.row_factory = None
+    cursor.execute(
+        f"INSERT INTO {PROVIDER_TABLE_NAME} (api_name, api_display_name) VALUES (?, ?) "
+        "ON CONFLICT(api_name) DO UPDATE SET api_display_name = excluded.api_display_name "
+        "WHERE api_display_name IS NOT excluded.api_display_name",
+        (api_name, api_display_name)
+    )
+    cursor.execute(
+        f"SELECT id FROM {PROVIDER_TABLE_NAME} WHERE api_name = ?",
+        (api_name,)
+    )
+    return cursor.fetchone()[0]
+
+
+def _store_raw_json(values: list, db_conn: sqlite3.Connection) -> list[int]:
+    """
+    Compress and store raw api responses, reusing rows for identical payloads.
+
+    Args:
+        values: decoded JSON values, or JSON strings
+        db_conn: an open sqlite3.Connection
+
+    Returns:
+        The raw_json.id for each value, in the same order. Doesn't commit.
+    """
+    if db_conn is None:
+        sys.exit("ERROR: no database connection provided.")
+
+    compressed = [_compress_json(value) for value in values]
+
+    cursor = db_conn.cursor()
+    cursor.row_factory = None
+    cursor.executemany(
+        f"INSERT OR IGNORE INTO {RAW_JSON_TABLE_NAME} (digest, payload) VALUES (?, ?)",
+        compressed
+    )
+
+    ids = {}
+    for digest, _ in compressed:
+        if digest not in ids:
+            cursor.execute(
+                f"SELECT id FROM {RAW_JSON_TABLE_NAME} WHERE digest = ?",
+                (digest,)
+            )
+            ids[digest] = cursor.fetchone()[0]
+
+    return [ids[digest] for digest, _ in compressed]
+
+
+@_timing.timed_function(
+    "insert_ip_info",
+    lambda *, entries, **kwargs: entries[0]["api_name"] if entries else None,
+)
 def _insert_ip_info(*, entries: list[dict], db_conn: sqlite3.Connection):
     """
     Upsert a batch of API-response rows in one go.
@@ -19,23 +103,32 @@ def _insert_ip_info(*, entries: list[dict], db_conn: sqlite3.Connection):
       db_conn: an open sqlite3.Connection
 
     Behavior:
+      - Stores ip_address in canonical form, and fills ip_bytes from it.
+      - Replaces api_name/api_display_name with the row's provider_id.
+      - Moves raw_json into the compressed raw_json table. (see _store_raw_json)
       - Builds a single INSERT ... ON CONFLICT(...) DO UPDATE statement.
       - Executes it via cursor.executemany() over all entries.
       - Commits once at the end.
+      - Drops the changed IPs from the in-process cache.
     """
-    def _record_to_tuple(entry: dict) -> tuple:
+    def _record_to_tuple(index: int, entry: dict) -> tuple:
         """
         Convert a record dict into a tuple that follows IP_INSERT_ORDER.
-        The raw_json column is serialised to a JSON string.
         """
         values = []
+        ip_address = _canonical_ip_address(entry["ip_address"])
 
         for column in IP_INSERT_ORDER:
-            value = entry[column]
-
-            # Serialize the raw JSON payload so it can be stored as text.
-            if column == "raw_json":
-                value = json.dumps(value)
+            if column == "ip_address":
+                value = str(ip_address)
+            elif column == "ip_bytes":
+                value = _pack_ip_address(ip_address)
+            elif column == "provider_id":
+                value = provider_ids[entry["api_name"]]
+            elif column == "raw_json_id":
+                value = raw_json_ids[index]
+            else:
+                value = entry[column]
 
             values.append(value)
 
@@ -59,12 +152,12 @@ def _insert_ip_info(*, entries: list[dict], db_conn: sqlite3.Connection):
         sys.exit("Every item in entries must be a dict.")
 
     # on conflict key:
-    key = "(api_name, ip_address)"
+    key = "(ip_bytes, provider_id)"
     
     # update all columns except the key columns
     columns_to_update = []
     for column_name in IP_INSERT_ORDER:
-        if column_name not in ("api_name", "ip_address"):
+        if column_name not in ("provider_id", "ip_address", "ip_bytes"):
             columns_to_update.append(column_name)
 
     assignment_statements = []
@@ -81,21 +174,51 @@ def _insert_ip_info(*, entries: list[dict], db_conn: sqlite3.Connection):
         f"ON CONFLICT{key} DO UPDATE SET {update_clause}"
     )
 
+    # look up each provider once per batch, not once per row
+    provider_ids = {}
+    for entry in entries:
+        if entry["api_name"] not in provider_ids:
+            provider_ids[entry["api_name"]] = _get_provider_id(
+                entry["api_name"],
+                db_conn,
+                api_display_name=entry.get("api_display_name"),
+            )
+
+    raw_json_ids = _store_raw_json([entry["raw_json"] for entry in entries], db_conn)
+
     cursor = db_conn.cursor()
-    params = [_record_to_tuple(entry) for entry in entries]
+    params = [_record_to_tuple(index, entry) for index, entry in enumerate(entries)]
+    ip_bytes_index = IP_INSERT_ORDER.index("ip_bytes")
 
     cursor.executemany(sql, params)
     db_conn.commit()
 
+    _cache_invalidate(db_conn, list({param[ip_bytes_index] for param in params}))
+
 
-def _insert_query_info(api_name: str, response, db_conn: sqlite3.Connection):
+@_timing.timed_function("insert_query_info")
+def _insert_query_info(
+    api_name: str,
+    response,
+    db_conn: sqlite3.Connection,
+    *,
+    duration: float | None = None,
+    batch_size: int | None = None,
+    retry_count: int = 0,
+    error: Exception | None = None,
+):
     """
-    Log each API call into the query-log table.
+    Log each API call into the query-log table, and count it against the
+    provider's quotas. (see db/_quota_ledger.py)
 
     Args:
         api_name:  the api_name string
-        response:  the `requests.get(...)` Response
+        response:  the `requests.get(...)` Response, or None if the request failed
         db_conn:   an open sqlite3.Connection
+        duration:  seconds the request took
+        batch_size: number of IPs in the request
+        retry_count: attempts made before this one
+        error:     the exception raised instead of a response
     """
     if db_conn is None:
         sys.exit("ERROR: no database connection provided.")
@@ -104,14 +227,68 @@ def _insert_query_info(api_name: str, response, db_conn: sqlite3.Connection):
     timestamp = datetime.now(LOCAL_TIMEZONE)
 
     # status and any error body
-    status = response.status_code
-    error_text = response.reason
+    if response is not None:
+        status = response.status_code
+        error_text = response.reason
+        response_bytes = len(response.content)
+    else:
+        status = None
+        error_text = f"{type(error).__name__}: {error}" if error else None
+        response_bytes = None
+
+    duration_ms = duration * 1000 if duration is not None else None
+
+    provider_id = _get_provider_id(api_name, db_conn)
 
     cursor = db_conn.cursor()
     cursor.execute(
         f"INSERT INTO {QUERY_TABLE_NAME}"
-        " (api_name, timestamp, status_code, error_text) "
-        "VALUES (?, ?, ?, ?)",
-        (api_name, timestamp, status, error_text)
+        " (provider_id, timestamp, status_code, error_text,"
+        " duration_ms, response_bytes, batch_size, retry_count) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        (provider_id, timestamp, status, error_text,
+         duration_ms, response_bytes, batch_size, retry_count)
     )
-    db_conn.commit()
\ No newline at end of file
+    _record_quota_use(api_name, provider_id, status, error_text, db_conn, now=timestamp)
+    db_conn.commit()
+
+
+def _insert_negative_results(
+    api_name: str,
+    ip_addresses: list,
+    db_conn: sqlite3.Connection,
+    *,
+    reason: str,
+    status_code: int | None = None,
+):
+    """
+    Remember that api_name couldn't answer for ip_addresses, so the
+    freshness check skips them until NEGATIVE_MAX_AGE passes.
+
+    Args:
+        ip_addresses: ipaddress objects or strings
+        reason: short description, e.g. "404 Not Found" or "not in response"
+        status_code: the provider's status code, if there was one
+    """
+    if db_conn is None:
+        sys.exit("ERROR: no database connection provided.")
+
+    if not ip_addresses:
+        return
+
+    timestamp = datetime.now(LOCAL_TIMEZONE)
+    provider_id = _get_provider_id(api_name, db_conn)
+
+    cursor = db_conn.cursor()
+    cursor.executemany(
+        f"INSERT INTO {NEGATIVE_TABLE_NAME}"
+        " (provider_id, ip_bytes, timestamp, status_code, reason) "
+        "VALUES (?, ?, ?, ?, ?) "
+        "ON CONFLICT(ip_bytes, provider_id) DO UPDATE SET "
+        "timestamp = excluded.timestamp, status_code = excluded.status_code, reason = excluded.reason",
+        [
+            (provider_id, _pack_ip_address(ip_address), timestamp, status_code, reason)
+            for ip_address in ip_addresses
+        ]
+    )
+    db_conn.commit()
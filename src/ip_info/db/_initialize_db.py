@@ -2,7 +2,8 @@ from datetime import datetime
 import sqlite3
 import sys
 
-from ip_info.config import IP_TABLE_NAME, TABLES
+from ip_info.config import IP_TABLE_NAME, TABLES, VIEWS
+from ip_info.db._migrate_db import SCHEMA_VERSION, migrate_db
 
 # register adapter: Convert aware datetime objects to ISO formatted strings.
 def adapt_datetime(dt):
@@ -45,16 +46,30 @@ def ensure_columns_exist(db_conn: sqlite3.Connection):
 
 
 def initialize_db(db_conn: sqlite3.Connection):
-    """Creates all tables and their indexes if they don't exist."""
+    """
+    Creates all tables and their indexes if they don't exist, and brings
+    older databases up to the current schema.
+    """
     if db_conn is None:
         sys.exit("ERROR: no database connection provided.")
 
     cursor = db_conn.cursor()
 
+    # a database without the ip table is new, and needs no migrations
+    cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+        (IP_TABLE_NAME,)
+    )
+    is_new_db = cursor.fetchone() is None
+
+    # lets ip_info_maintain hand freed pages back to the OS without a full VACUUM.
+    # only takes effect before the first table is created.
+    if is_new_db:
+        cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+
     for table in TABLES:
         table_name    = table["name"]
         columns_dict   = table["columns"]
-        indexes        = table.get("indexes", [])
 
         # create table
         columns_sql = ",\n".join(f"{column} {definition}"
@@ -63,15 +78,55 @@ def initialize_db(db_conn: sqlite3.Connection):
             f"CREATE TABLE IF NOT EXISTS {table_name} (\n{columns_sql}\n)"
         )
 
+    # older databases need new columns and migrations before indexes can use them
+    ensure_columns_exist(db_conn=db_conn)
+    if is_new_db:
+        cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+    else:
+        migrate_db(db_conn=db_conn)
+
+    for table in TABLES:
+        table_name    = table["name"]
+        indexes        = table.get("indexes", [])
+        unique_indexes = table.get("unique_indexes", [])
+
         # create indexes
-        for index_name, index_columns in indexes:
-            statement = (
-                f"CREATE UNIQUE INDEX IF NOT EXISTS {index_name}"
-                if table_name == IP_TABLE_NAME
-                else f"CREATE INDEX IF NOT EXISTS {index_name}"
+        for index_name, index_columns in unique_indexes:
+            cursor.execute(
+                f"CREATE UNIQUE INDEX IF NOT EXISTS {index_name} ON {table_name} {index_columns}"
             )
+        for index_name, index_columns in indexes:
             cursor.execute(
-                f"{statement} ON {table_name} {index_columns}"
+                f"CREATE INDEX IF NOT EXISTS {index_name} ON {table_name} {index_columns}"
             )
 
+    ensure_views_exist(db_conn=db_conn)
+
+    db_conn.commit()
+
+
+def ensure_views_exist(db_conn: sqlite3.Connection):
+    """
+    Creates the views defined in VIEWS, replacing any whose definition changed.
+    """
+    if db_conn is None:
+        sys.exit("ERROR: no database connection provided.")
+
+    cursor = db_conn.cursor()
+
+    for view in VIEWS:
+        view_name = view["name"]
+        view_sql = f"CREATE VIEW {view_name} AS {view['select']}"
+
+        cursor.execute(
+            "SELECT sql FROM sqlite_master WHERE type = 'view' AND name = ?",
+            (view_name,)
+        )
+        existing = cursor.fetchone()
+        if existing and existing[0] == view_sql:
+            continue
+
+        cursor.execute(f"DROP VIEW IF EXISTS {view_name}")
+        cursor.execute(view_sql)
+
     db_conn.commit()
\ No newline at end of file
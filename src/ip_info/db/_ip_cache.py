@@ -0,0 +1,145 @@
+from collections import OrderedDict
+from datetime import datetime, timedelta
+import sqlite3
+import threading
+import time
+import weakref
+
+from ip_info import _timing
+from ip_info.config import IP_CACHE_SIZE, IP_CACHE_TTL
+from ip_info.db._max_age import _provider_max_age
+
+# (database path, ip_bytes) -> (expires at, rows), least recently used first
+_cache: OrderedDict[tuple[str, bytes], tuple[float, list[dict]]] = OrderedDict()
+_lock = threading.Lock()
+
+# times each key was invalidated, so a read that raced a write isn't cached.
+# cleared (moving to the next epoch) once it holds more than IP_CACHE_SIZE keys.
+_invalidations: dict[tuple[str, bytes], int] = {}
+_epoch = 0
+
+# database path of each _Connection, looked up once
+_paths: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+
+
+class _Connection(sqlite3.Connection):
+    """
+    sqlite3.Connection that remembers its database path, so cache hits
+    don't run any SQL. (plain connections can't be weakly referenced)
+    Pass as sqlite3.connect(..., factory=_Connection).
+    """
+
+
+def _database_path(db_conn: sqlite3.Connection) -> str:
+    """The file behind db_conn. Empty for in-memory databases."""
+    try:
+        return _paths[db_conn]
+    except (KeyError, TypeError):
+        pass
+
+    path = ""
+    cursor = db_conn.cursor()
+    cursor.row_factory = None
+    for _, name, database_path in cursor.execute("PRAGMA database_list"):
+        if name == "main":
+            path = database_path or ""
+
+    if isinstance(db_conn, _Connection):
+        _paths[db_conn] = path
+    return path
+
+
+def _cache_key(db_conn: sqlite3.Connection, ip_bytes: bytes) -> tuple[str, bytes] | None:
+    """Cache key for ip_bytes in db_conn's database. None if it can't be cached."""
+    path = _database_path(db_conn)
+    if not path:
+        return None
+    return (path, ip_bytes)
+
+
+def _cache_get(key: tuple[str, bytes] | None) -> list[dict] | None:
+    """
+    Cached ip_data_view rows for key, or None on a miss.
+    Returns copies, so callers can change them.
+    """
+    if key is None:
+        return None
+
+    with _lock:
+        entry = _cache.get(key)
+        if entry is not None and entry[0] <= time.monotonic():
+            del _cache[key]
+            entry = None
+        if entry is not None:
+            _cache.move_to_end(key)
+
+    _timing.count("ip_cache_hit" if entry is not None else "ip_cache_miss")
+    if entry is None:
+        return None
+
+    return [dict(row) for row in entry[1]]
+
+
+def _cache_generation(key: tuple[str, bytes] | None) -> tuple[int, int]:
+    """Take before reading key's rows from the database, and pass to _cache_put."""
+    with _lock:
+        return (_epoch, _invalidations.get(key, 0))
+
+
+def _cache_put(key: tuple[str, bytes] | None, rows: list[dict], generation: tuple[int, int]) -> None:
+    """
+    Cache every ip_data_view row stored for key's ip, unless the ip was
+    invalidated since generation was taken. (the rows may predate a write)
+    """
+    if key is None:
+        return
+
+    expires_at = time.monotonic() + IP_CACHE_TTL
+
+    # tie the entry's lifetime to each provider's max age: it expires when its
+    # first fresh row goes stale, so an ip due for a new query is read from
+    # the database again
+    dated_rows = [row for row in rows if isinstance(row.get("timestamp"), datetime)]
+    if dated_rows:
+        now = datetime.now(dated_rows[0]["timestamp"].tzinfo)
+        stale_ins = [
+            (row["timestamp"] + timedelta(days=_provider_max_age(row["api_name"])) - now).total_seconds()
+            for row in dated_rows
+        ]
+        fresh = [stale_in for stale_in in stale_ins if stale_in > 0]
+        if fresh:
+            expires_at = min(expires_at, time.monotonic() + min(fresh))
+
+    with _lock:
+        if generation != (_epoch, _invalidations.get(key, 0)):
+            return
+        _cache[key] = (expires_at, [dict(row) for row in rows])
+        _cache.move_to_end(key)
+        while len(_cache) > IP_CACHE_SIZE:
+            _cache.popitem(last=False)
+
+
+def _cache_invalidate(db_conn: sqlite3.Connection, ip_bytes_list: list[bytes]) -> None:
+    """Drop the cached rows for each of ip_bytes_list, after they've changed."""
+    path = _database_path(db_conn)
+    if not path:
+        return
+
+    global _epoch
+    with _lock:
+        for ip_bytes in ip_bytes_list:
+            key = (path, ip_bytes)
+            _cache.pop(key, None)
+            _invalidations[key] = _invalidations.get(key, 0) + 1
+        if len(_invalidations) > IP_CACHE_SIZE:
+            _invalidations.clear()
+            _epoch += 1
+
+
+def _cache_clear() -> None:
+    """Drop everything, e.g. after rows were deleted in bulk."""
+    global _epoch
+    with _lock:
+        _cache.clear()
+        _invalidations.clear()
+        _epoch += 1
@@ -0,0 +1,290 @@
+from datetime import datetime, timedelta
+import sqlite3
+import sys
+
+from ip_info.config import (
+    API_METADATA,
+    IP_TABLE_NAME,
+    IP_VIEW_NAME,
+    LOCAL_TIMEZONE,
+    NEGATIVE_MAX_AGE,
+    NEGATIVE_TABLE_NAME,
+    PROVIDER_TABLE_NAME,
+    QUERY_LOG_RETENTION_DAYS,
+    QUERY_ROLLUP_TABLE_NAME,
+    QUERY_TABLE_NAME,
+    RAW_JSON_TABLE_NAME,
+    TABLES,
+    TIMEFRAME_LENGTHS,
+)
+from ip_info.db._ip_cache import _cache_clear
+
+
+def _query_log_retention(api_name: str) -> timedelta:
+    """
+    How long raw api_queries rows for api_name must be kept.
+
+    That's the longest window of any of the provider's rate limits, since
+    _check_rate_limits needs every row inside it, but never less than
+    QUERY_LOG_RETENTION_DAYS.
+    """
+    retention = timedelta(days=QUERY_LOG_RETENTION_DAYS)
+
+    rate_limits = API_METADATA.get(api_name, {}).get("rate_limits", [])
+    for rate_limit in rate_limits:
+        retention = max(retention, TIMEFRAME_LENGTHS[rate_limit["timeframe"]])
+
+    return retention
+
+
+def prune_query_log(db_conn: sqlite3.Connection, now: datetime | None = None) -> int:
+    """
+    Roll api_queries rows that are past their retention up into per-provider
+    per-day counts (and duration, size, batch size and retry totals) in the
+    rollup table, then delete them.
+
+    Each run only touches rows that aged out since the last run, through the
+    (provider_id, timestamp) index, so it's cheap enough to run at startup.
+
+    Returns:
+        The number of rows rolled up.
+    """
+    if db_conn is None:
+        sys.exit("ERROR: no database connection provided.")
+
+    if now is None:
+        now = datetime.now(LOCAL_TIMEZONE)
+
+    cursor = db_conn.cursor()
+    cursor.row_factory = None
+    cursor.execute(f"SELECT id, api_name FROM {PROVIDER_TABLE_NAME}")
+    providers = cursor.fetchall()
+
+    pruned = 0
+    for provider_id, api_name in providers:
+        # text comparison is off by up to an hour around DST, which retention absorbs
+        cutoff = (now - _query_log_retention(api_name)).astimezone(LOCAL_TIMEZONE)
+
+        cursor.execute(
+            f"""
+            INSERT INTO {QUERY_ROLLUP_TABLE_NAME} (
+                provider_id, day, status_code, query_count, timed_count,
+                duration_ms, response_bytes, batch_size, retry_count
+            )
+            SELECT
+                provider_id, substr(timestamp, 1, 10), IFNULL(status_code, 0), COUNT(*), COUNT(duration_ms),
+                TOTAL(duration_ms), TOTAL(response_bytes), TOTAL(batch_size), TOTAL(retry_count)
+            FROM {QUERY_TABLE_NAME}
+            WHERE provider_id = ? AND timestamp < ?
+            GROUP BY provider_id, substr(timestamp, 1, 10), IFNULL(status_code, 0)
+            ON CONFLICT (provider_id, day, status_code)
+            DO UPDATE SET
+                query_count = query_count + excluded.query_count,
+                timed_count = IFNULL(timed_count, 0) + excluded.timed_count,
+                duration_ms = IFNULL(duration_ms, 0) + excluded.duration_ms,
+                response_bytes = IFNULL(response_bytes, 0) + excluded.response_bytes,
+                batch_size = IFNULL(batch_size, 0) + excluded.batch_size,
+                retry_count = IFNULL(retry_count, 0) + excluded.retry_count
+            """,
+            (provider_id, cutoff)
+        )
+        cursor.execute(
+            f"DELETE FROM {QUERY_TABLE_NAME} WHERE provider_id = ? AND timestamp < ?",
+            (provider_id, cutoff)
+        )
+        pruned += cursor.rowcount
+
+    db_conn.commit()
+
+    return pruned
+
+
+def expire_ip_data(
+    db_conn: sqlite3.Connection,
+    expire_ages: dict[str, int],
+    default_age: int,
+    now: datetime | None = None,
+) -> int:
+    """
+    Delete ip_data rows older than their provider's expire age.
+
+    Args:
+        expire_ages: days to keep rows for, by api_name
+        default_age: days to keep rows for providers not in expire_ages
+
+    Returns:
+        The number of rows deleted.
+    """
+    if db_conn is None:
+        sys.exit("ERROR: no database connection provided.")
+
+    if now is None:
+        now = datetime.now(LOCAL_TIMEZONE)
+
+    cursor = db_conn.cursor()
+    cursor.row_factory = None
+    cursor.execute(f"SELECT id, api_name FROM {PROVIDER_TABLE_NAME}")
+    providers = cursor.fetchall()
+
+    # one CASE expression, so the table is scanned once rather than once per provider
+    cases = []
+    params: list = []
+    for provider_id, api_name in providers:
+        if api_name in expire_ages:
+            cases.append("WHEN ? THEN ?")
+            params += [provider_id, now - timedelta(days=expire_ages[api_name])]
+    params.append(now - timedelta(days=default_age))
+
+    if cases:
+        cutoff_sql = f"CASE provider_id {' '.join(cases)} ELSE ? END"
+    else:
+        cutoff_sql = "?"
+
+    cursor.execute(
+        f"DELETE FROM {IP_TABLE_NAME} WHERE timestamp < {cutoff_sql}",
+        params
+    )
+    deleted = cursor.rowcount
+    db_conn.commit()
+    _cache_clear()
+
+    return deleted
+
+
+def expire_negative_results(db_conn: sqlite3.Connection, now: datetime | None = None) -> int:
+    """
+    Delete negative results older than their provider's "negative_max_age",
+    or NEGATIVE_MAX_AGE days. They no longer stop queries by then.
+
+    Returns:
+        The number of rows deleted.
+    """
+    if db_conn is None:
+        sys.exit("ERROR: no database connection provided.")
+
+    if now is None:
+        now = datetime.now(LOCAL_TIMEZONE)
+
+    cursor = db_conn.cursor()
+    cursor.row_factory = None
+    cursor.execute(f"SELECT id, api_name FROM {PROVIDER_TABLE_NAME}")
+    providers = cursor.fetchall()
+
+    deleted = 0
+    for provider_id, api_name in providers:
+        max_age = API_METADATA.get(api_name, {}).get("negative_max_age", NEGATIVE_MAX_AGE)
+        cursor.execute(
+            f"DELETE FROM {NEGATIVE_TABLE_NAME} WHERE provider_id = ? AND timestamp < ?",
+            (provider_id, (now - timedelta(days=max_age)).astimezone(LOCAL_TIMEZONE))
+        )
+        deleted += cursor.rowcount
+
+    db_conn.commit()
+
+    return deleted
+
+
+def delete_orphaned_raw_json(db_conn: sqlite3.Connection) -> int:
+    """
+    Delete raw_json payloads no ip_data row points at anymore.
+    (left behind by expired rows and by upserts that replaced a payload)
+
+    Returns:
+        The number of payloads deleted.
+    """
+    if db_conn is None:
+        sys.exit("ERROR: no database connection provided.")
+
+    cursor = db_conn.cursor()
+    cursor.execute(
+        f"""
+        DELETE FROM {RAW_JSON_TABLE_NAME}
+        WHERE NOT EXISTS (
+            SELECT 1 FROM {IP_TABLE_NAME}
+            WHERE {IP_TABLE_NAME}.raw_json_id = {RAW_JSON_TABLE_NAME}.id
+        )
+        """
+    )
+    deleted = cursor.rowcount
+    db_conn.commit()
+
+    return deleted
+
+
+def vacuum_db(db_conn: sqlite3.Connection, full: bool = False) -> None:
+    """
+    Return free pages to the OS.
+
+    Uses incremental vacuum when the database was created with
+    auto_vacuum = INCREMENTAL. Older databases need one full VACUUM to switch
+    modes, which rewrites the whole file, so that only happens when full=True.
+    """
+    if db_conn is None:
+        sys.exit("ERROR: no database connection provided.")
+
+    db_conn.commit()
+    cursor = db_conn.cursor()
+    cursor.row_factory = None
+    auto_vacuum = cursor.execute("PRAGMA auto_vacuum").fetchone()[0]
+
+    # 2 = INCREMENTAL
+    if auto_vacuum == 2 and not full:
+        cursor.execute("PRAGMA incremental_vacuum")
+        cursor.fetchall()
+    elif full:
+        cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        cursor.execute("VACUUM")
+    else:
+        print("Database doesn't support incremental vacuum. Run with --full_vacuum once to enable it.")
+
+    db_conn.commit()
+
+
+def optimize_db(db_conn: sqlite3.Connection) -> None:
+    """Refresh the query planner's statistics."""
+    if db_conn is None:
+        sys.exit("ERROR: no database connection provided.")
+
+    db_conn.commit()
+    cursor = db_conn.cursor()
+    cursor.execute("ANALYZE")
+    cursor.execute("PRAGMA optimize")
+    db_conn.commit()
+
+
+def db_stats(db_conn: sqlite3.Connection) -> dict:
+    """
+    Size and row counts for the database.
+
+    Returns:
+        dict with keys:
+          size_bytes, free_bytes - from page_count and freelist_count
+          tables - row count by table name
+          providers - ip_data row count by api_name
+    """
+    if db_conn is None:
+        sys.exit("ERROR: no database connection provided.")
+
+    cursor = db_conn.cursor()
+    cursor.row_factory = None
+
+    page_size = cursor.execute("PRAGMA page_size").fetchone()[0]
+    page_count = cursor.execute("PRAGMA page_count").fetchone()[0]
+    freelist_count = cursor.execute("PRAGMA freelist_count").fetchone()[0]
+
+    tables = {}
+    for table in TABLES:
+        table_name = table["name"]
+        tables[table_name] = cursor.execute(f"SELECT COUNT(*) FROM {table_name}").fetchone()[0]
+
+    cursor.execute(
+        f"SELECT api_name, COUNT(*) FROM {IP_VIEW_NAME} GROUP BY api_name ORDER BY api_name"
+    )
+    providers = dict(cursor.fetchall())
+
+    return {
+        "size_bytes": page_size * page_count,
+        "free_bytes": page_size * freelist_count,
+        "tables": tables,
+        "providers": providers,
+    }
@@ -0,0 +1,40 @@
+"""
+How many days each provider's stored results count as recent.
+
+Reputation data (abuse reports, malware verdicts) goes stale much faster
+than geolocation, so providers can set "max_age" in API_METADATA. ipi's
+--max_age and --api_max_age override those for a run.
+"""
+from ip_info.config import API_METADATA, MAX_AGE
+
+# set from the command line. (see _set_max_age_overrides)
+_max_age_override: int | None = None
+_api_max_age_overrides: dict[str, int] = {}
+
+
+def _set_max_age_overrides(
+    max_age: int | None = None,
+    api_max_ages: dict[str, int] | None = None,
+) -> None:
+    """
+    Override max ages for the rest of the process.
+
+    Args:
+        max_age: days for every provider
+        api_max_ages: days by api_name, taking precedence over max_age
+    """
+    global _max_age_override, _api_max_age_overrides
+    _max_age_override = max_age
+    _api_max_age_overrides = dict(api_max_ages or {})
+
+
+def _provider_max_age(api_name: str) -> int:
+    """
+    Days api_name's results count as recent: the --api_max_age override,
+    then --max_age, then "max_age" in API_METADATA, then MAX_AGE.
+    """
+    if api_name in _api_max_age_overrides:
+        return _api_max_age_overrides[api_name]
+    if _max_age_override is not None:
+        return _max_age_override
+    return API_METADATA.get(api_name, {}).get("max_age", MAX_AGE)
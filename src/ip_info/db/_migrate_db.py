@@ -0,0 +1,231 @@
+import sqlite3
+import sys
+
+from ip_info._compress_json import _compress_json
+from ip_info._pack_ip_address import _canonical_ip_address, _pack_ip_address
+from ip_info.config import (
+    API_METADATA,
+    IP_TABLE_NAME,
+    PROVIDER_TABLE_NAME,
+    QUERY_TABLE_NAME,
+    RAW_JSON_TABLE_NAME,
+)
+
+MIGRATION_BATCH_SIZE = 10000
+
+
+def _migrate_ip_bytes(db_conn: sqlite3.Connection):
+    """
+    Backfill ip_bytes for rows written before the column existed.
+
+    - Drops the old unique index on (api_name, ip_address).
+    - Fills ip_bytes and rewrites ip_address in canonical form.
+    - Deletes rows whose ip_address can't be parsed, listing them. (they
+      could never be looked up)
+    - Removes duplicates that only differed textually, keeping the newest row.
+    """
+    cursor = db_conn.cursor()
+
+    cursor.execute(f"DROP INDEX IF EXISTS idx_{IP_TABLE_NAME}")
+
+    # walk the table by id so each batch is an index range, not a full scan
+    last_id = 0
+    dropped = []
+    while True:
+        cursor.execute(
+            f"SELECT id, ip_address FROM {IP_TABLE_NAME} "
+            "WHERE id > ? AND ip_bytes IS NULL "
+            "ORDER BY id LIMIT ?",
+            (last_id, MIGRATION_BATCH_SIZE)
+        )
+        rows = cursor.fetchall()
+        if not rows:
+            break
+
+        updates = []
+        invalid = []
+        for row_id, ip_string in rows:
+            try:
+                ip_address = _canonical_ip_address(ip_string)
+            except ValueError:
+                invalid.append((row_id,))
+                dropped.append((row_id, ip_string))
+                continue
+            updates.append((str(ip_address), _pack_ip_address(ip_address), row_id))
+
+        cursor.executemany(
+            f"UPDATE {IP_TABLE_NAME} SET ip_address = ?, ip_bytes = ? WHERE id = ?",
+            updates
+        )
+        cursor.executemany(f"DELETE FROM {IP_TABLE_NAME} WHERE id = ?", invalid)
+        last_id = rows[-1][0]
+
+    if dropped:
+        print(f"Dropped {len(dropped)} rows whose ip_address isn't a valid IP address:")
+        for row_id, ip_string in dropped:
+            print(f"  {IP_TABLE_NAME} id {row_id}: {ip_string!r}")
+
+    # keep only the newest row for each (ip_bytes, api_name)
+    cursor.execute(
+        f"""
+        DELETE FROM {IP_TABLE_NAME}
+        WHERE id IN (
+            SELECT id FROM (
+                SELECT id, ROW_NUMBER() OVER (
+                    PARTITION BY ip_bytes, api_name
+                    ORDER BY timestamp DESC, id DESC
+                ) AS row_number
+                FROM {IP_TABLE_NAME}
+            )
+            WHERE row_number > 1
+        )
+        """
+    )
+
+
+def _migrate_providers(db_conn: sqlite3.Connection):
+    """
+    Move api_name/api_display_name out of ip_data and api_queries.
+
+    - Fills the providers table from the names already in use.
+    - Points every row at its provider with provider_id.
+    - Drops the old text columns and the indexes built on them.
+
+    Dropping columns needs sqlite 3.35 or newer.
+    """
+    cursor = db_conn.cursor()
+
+    # only tables that still have the old columns need migrating
+    old_columns = {}
+    for table_name, columns in (
+        (IP_TABLE_NAME, ("api_name", "api_display_name")),
+        (QUERY_TABLE_NAME, ("api_name",)),
+    ):
+        cursor.execute(f"PRAGMA table_info({table_name})")
+        if "api_name" in {row[1] for row in cursor.fetchall()}:
+            old_columns[table_name] = columns
+
+    # INSERT OR IGNORE relies on the api_name index, which is normally created after migrations
+    cursor.execute(
+        f"CREATE UNIQUE INDEX IF NOT EXISTS idx_{PROVIDER_TABLE_NAME}_api_name "
+        f"ON {PROVIDER_TABLE_NAME} (api_name)"
+    )
+
+    if IP_TABLE_NAME in old_columns:
+        cursor.execute(
+            f"""
+            INSERT OR IGNORE INTO {PROVIDER_TABLE_NAME} (api_name, api_display_name)
+            SELECT api_name, MAX(api_display_name)
+            FROM {IP_TABLE_NAME}
+            WHERE api_name IS NOT NULL
+            GROUP BY api_name
+            """
+        )
+    if QUERY_TABLE_NAME in old_columns:
+        cursor.execute(f"SELECT DISTINCT api_name FROM {QUERY_TABLE_NAME} WHERE api_name IS NOT NULL")
+        cursor.executemany(
+            f"INSERT OR IGNORE INTO {PROVIDER_TABLE_NAME} (api_name, api_display_name) VALUES (?, ?)",
+            [
+                (api_name, API_METADATA.get(api_name, {}).get("api_display_name", api_name))
+                for (api_name,) in cursor.fetchall()
+            ]
+        )
+
+    for table_name in old_columns:
+        cursor.execute(
+            f"""
+            UPDATE {table_name}
+            SET provider_id = (
+                SELECT id FROM {PROVIDER_TABLE_NAME}
+                WHERE {PROVIDER_TABLE_NAME}.api_name = {table_name}.api_name
+            )
+            """
+        )
+        cursor.execute(f"DELETE FROM {table_name} WHERE provider_id IS NULL")
+
+    # indexes on the old columns have to go before the columns can
+    cursor.execute(f"DROP INDEX IF EXISTS idx_{IP_TABLE_NAME}_ip_bytes")
+    cursor.execute(f"DROP INDEX IF EXISTS idx_{QUERY_TABLE_NAME}")
+    db_conn.commit()
+
+    for table_name, columns in old_columns.items():
+        for column in columns:
+            cursor.execute(f"ALTER TABLE {table_name} DROP COLUMN {column}")
+
+
+def _migrate_raw_json(db_conn: sqlite3.Connection):
+    """
+    Move the raw_json text column into the compressed raw_json table.
+
+    Identical payloads (like the empty ones from ip2proxy) end up sharing a
+    single row. Run VACUUM afterwards to give the freed space back to the OS.
+    """
+    cursor = db_conn.cursor()
+
+    cursor.execute(f"PRAGMA table_info({IP_TABLE_NAME})")
+    if "raw_json" not in {row[1] for row in cursor.fetchall()}:
+        return
+
+    # deduplication relies on the digest index, which is normally created after migrations
+    cursor.execute(
+        f"CREATE UNIQUE INDEX IF NOT EXISTS idx_{RAW_JSON_TABLE_NAME}_digest "
+        f"ON {RAW_JSON_TABLE_NAME} (digest)"
+    )
+
+    last_id = 0
+    while True:
+        cursor.execute(
+            f"SELECT id, raw_json FROM {IP_TABLE_NAME} "
+            "WHERE id > ? AND raw_json_id IS NULL "
+            "ORDER BY id LIMIT ?",
+            (last_id, MIGRATION_BATCH_SIZE)
+        )
+        rows = cursor.fetchall()
+        if not rows:
+            break
+
+        compressed = [_compress_json(raw_json or "{}") for _, raw_json in rows]
+        cursor.executemany(
+            f"INSERT OR IGNORE INTO {RAW_JSON_TABLE_NAME} (digest, payload) VALUES (?, ?)",
+            compressed
+        )
+        cursor.executemany(
+            f"UPDATE {IP_TABLE_NAME} SET raw_json_id = "
+            f"(SELECT id FROM {RAW_JSON_TABLE_NAME} WHERE digest = ?) "
+            "WHERE id = ?",
+            [(digest, row_id) for (digest, _), (row_id, _) in zip(compressed, rows)]
+        )
+        last_id = rows[-1][0]
+
+    db_conn.commit()
+    cursor.execute(f"ALTER TABLE {IP_TABLE_NAME} DROP COLUMN raw_json")
+
+
+# Applied in order. A database's PRAGMA user_version records how many have run.
+MIGRATIONS = [
+    _migrate_ip_bytes,
+    _migrate_providers,
+    _migrate_raw_json,
+]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def migrate_db(db_conn: sqlite3.Connection):
+    """
+    Applies any migrations the database hasn't seen yet.
+
+    Expects all columns in TABLES to exist. (run ensure_columns_exist first)
+    """
+    if db_conn is None:
+        sys.exit("ERROR: no database connection provided.")
+
+    cursor = db_conn.cursor()
+    user_version = cursor.execute("PRAGMA user_version").fetchone()[0]
+
+    for version, migration in enumerate(MIGRATIONS, 1):
+        if version <= user_version:
+            continue
+        print(f"Migrating database to schema version {version}...")
+        migration(db_conn)
+        cursor.execute(f"PRAGMA user_version = {version}")
+        db_conn.commit()
@@ -0,0 +1,192 @@
+"""
+Queue of provider queries that couldn't run yet. (ipi --drain)
+
+Handlers queue the IPs a rate limit held back, or whose request failed,
+instead of dropping them. Each job keeps the time it's next allowed to run.
+"""
+from collections import defaultdict
+from datetime import datetime, timedelta
+import ipaddress
+import sqlite3
+import sys
+
+from ip_info._pack_ip_address import _pack_ip_address
+from ip_info.config import (
+    LOCAL_TIMEZONE,
+    PENDING_MAX_ATTEMPTS,
+    PENDING_RETRY_DELAY,
+    PENDING_TABLE_NAME,
+    PROVIDER_TABLE_NAME,
+)
+from ip_info.db._add_to_db import _get_provider_id
+from ip_info.db._query_db import _filter_stale_ip_addresses, _next_query_time
+
+
+def _defer_queries(
+    api_name: str,
+    ip_addresses: list,
+    db_conn: sqlite3.Connection,
+    *,
+    rate_limits: list[dict] | None = None,
+    error: str | None = None,
+    not_before: datetime | None = None,
+) -> None:
+    """
+    Queue api_name queries for ip_addresses.
+
+    With rate_limits, they're due once the limits allow a query again.
+    Otherwise, or if no limit is currently hit, after PENDING_RETRY_DELAY
+    seconds. IPs already queued keep their attempt count, unless a rate
+    limit held them back: those weren't sent, so only network and server
+    errors count towards PENDING_MAX_ATTEMPTS.
+
+    Args:
+        ip_addresses: ipaddress objects or strings
+        error: why the query didn't run, shown by ipi --drain
+        not_before: earliest they can be due, like a response's Retry-After
+    """
+    if db_conn is None:
+        sys.exit("ERROR: no database connection provided.")
+
+    if not ip_addresses:
+        return
+
+    now = datetime.now(LOCAL_TIMEZONE)
+    next_attempt = now + timedelta(seconds=PENDING_RETRY_DELAY)
+    if rate_limits is not None:
+        next_query_time = _next_query_time(api_name, rate_limits, db_conn)
+        if next_query_time > now:
+            next_attempt = next_query_time
+        if error is None:
+            error = "rate limit reached"
+    if not_before is not None and not_before > next_attempt:
+        next_attempt = not_before
+
+    provider_id = _get_provider_id(api_name, db_conn)
+
+    # a query claimed by ipi --drain and held back again wasn't attempted
+    reset_attempts = ", attempts = 0" if rate_limits is not None else ""
+
+    cursor = db_conn.cursor()
+    cursor.executemany(
+        f"INSERT INTO {PENDING_TABLE_NAME}"
+        " (provider_id, ip_bytes, ip_address, queued, next_attempt, attempts, last_error) "
+        "VALUES (?, ?, ?, ?, ?, 0, ?) "
+        "ON CONFLICT(ip_bytes, provider_id) DO UPDATE SET "
+        f"next_attempt = excluded.next_attempt, last_error = excluded.last_error{reset_attempts}",
+        [
+            (provider_id, _pack_ip_address(ip_address), str(ip_address), now, next_attempt, error)
+            for ip_address in ip_addresses
+        ]
+    )
+    db_conn.commit()
+
+
+def _claim_due_queries(
+    db_conn: sqlite3.Connection,
+    api_names: list[str],
+    now: datetime | None = None,
+) -> dict[str, list[ipaddress.IPv4Address | ipaddress.IPv6Address]]:
+    """
+    Queued queries for api_names that are due, marking each one attempted.
+
+    Claimed queries are pushed back by PENDING_RETRY_DELAY, so one its
+    handler neither answers nor queues again is retried later. Queries
+    already tried PENDING_MAX_ATTEMPTS times are dropped instead.
+
+    Returns:
+        api_name -> ip addresses, for apis with due queries.
+    """
+    if db_conn is None:
+        sys.exit("ERROR: no database connection provided.")
+
+    if now is None:
+        now = datetime.now(LOCAL_TIMEZONE)
+
+    placeholders = ", ".join("?" for _ in api_names)
+    provider_filter = f"provider_id IN (SELECT id FROM {PROVIDER_TABLE_NAME} WHERE api_name IN ({placeholders}))"
+
+    cursor = db_conn.cursor()
+    cursor.row_factory = None
+
+    cursor.execute(
+        f"DELETE FROM {PENDING_TABLE_NAME} "
+        f"WHERE {provider_filter} AND next_attempt <= ? AND attempts >= ?",
+        [*api_names, now, PENDING_MAX_ATTEMPTS]
+    )
+    dropped = cursor.rowcount
+    if dropped:
+        print(f"Gave up on {dropped} queued queries after {PENDING_MAX_ATTEMPTS} attempts.")
+
+    cursor.execute(
+        f"""
+        SELECT {PENDING_TABLE_NAME}.id, api_name, ip_address
+        FROM {PENDING_TABLE_NAME}
+        JOIN {PROVIDER_TABLE_NAME} ON {PROVIDER_TABLE_NAME}.id = {PENDING_TABLE_NAME}.provider_id
+        WHERE {provider_filter} AND next_attempt <= ?
+        ORDER BY next_attempt
+        """,
+        [*api_names, now]
+    )
+    rows = cursor.fetchall()
+
+    cursor.executemany(
+        f"UPDATE {PENDING_TABLE_NAME} SET attempts = attempts + 1, next_attempt = ? WHERE id = ?",
+        [(now + timedelta(seconds=PENDING_RETRY_DELAY), row_id) for row_id, _, _ in rows]
+    )
+    db_conn.commit()
+
+    due = defaultdict(list)
+    for _, api_name, ip_address in rows:
+        due[api_name].append(ipaddress.ip_address(ip_address))
+
+    return dict(due)
+
+
+def _clear_answered_queries(
+    api_name: str,
+    ip_addresses: list[ipaddress.IPv4Address | ipaddress.IPv6Address],
+    db_conn: sqlite3.Connection,
+) -> None:
+    """Remove queued api_name queries for any of ip_addresses that now have a recent result."""
+    if db_conn is None:
+        sys.exit("ERROR: no database connection provided.")
+
+    stale = set(_filter_stale_ip_addresses(api_name, ip_addresses, db_conn))
+    answered = [ip_address for ip_address in ip_addresses if ip_address not in stale]
+    if not answered:
+        return
+
+    cursor = db_conn.cursor()
+    cursor.executemany(
+        f"DELETE FROM {PENDING_TABLE_NAME} "
+        f"WHERE ip_bytes = ? AND provider_id = (SELECT id FROM {PROVIDER_TABLE_NAME} WHERE api_name = ?)",
+        [(_pack_ip_address(ip_address), api_name) for ip_address in answered]
+    )
+    db_conn.commit()
+
+
+def _pending_summary(db_conn: sqlite3.Connection) -> dict[str, dict]:
+    """
+    Returns:
+        api_name -> {"count": queued queries, "next_attempt": when the
+        first is due}, for apis with queued queries.
+    """
+    if db_conn is None:
+        sys.exit("ERROR: no database connection provided.")
+
+    cursor = db_conn.cursor()
+    cursor.row_factory = None
+    cursor.execute(
+        f"""
+        SELECT api_name, COUNT(*), MIN(next_attempt)
+        FROM {PENDING_TABLE_NAME}
+        JOIN {PROVIDER_TABLE_NAME} ON {PROVIDER_TABLE_NAME}.id = {PENDING_TABLE_NAME}.provider_id
+        GROUP BY api_name
+        ORDER BY api_name
+        """
+    )
+    return {
+        api_name: {"count": count, "next_attempt": datetime.fromisoformat(next_attempt)}
+        for api_name, count, next_attempt in cursor.fetchall()
+    }
@@ -5,9 +5,130 @@ import time
 from datetime import datetime, timedelta, timezone
 from typing import Any
 
-from ip_info.config import IP_TABLE_NAME, LOCAL_TIMEZONE, MAX_AGE, QUERY_TABLE_NAME
+from ip_info import _timing
+from ip_info._timing import _percentile
+from ip_info._compress_json import _decompress_json
+from ip_info._pack_ip_address import _pack_ip_address, _pack_ip_network
+from ip_info.config import (
+    API_METADATA,
+    IP_TABLE_NAME,
+    IP_VIEW_NAME,
+    LOCAL_TIMEZONE,
+    NEGATIVE_MAX_AGE,
+    NEGATIVE_TABLE_NAME,
+    PROVIDER_TABLE_NAME,
+    QUERY_LOG_RETENTION_DAYS,
+    QUERY_ROLLUP_TABLE_NAME,
+    QUERY_TABLE_NAME,
+    QUERY_VIEW_NAME,
+    RAW_JSON_TABLE_NAME,
+)
+from ip_info.db._ip_cache import _cache_generation, _cache_get, _cache_key, _cache_put
+from ip_info.db._max_age import _provider_max_age
 
+# ips per statement in _recent_ip_bytes. (older sqlite builds
+# allow at most 999 parameters)
+FRESHNESS_CHUNK_SIZE = 500
 
+# timestamps are stored as local time iso strings. every cutoff and window
+# start, here and in the other db modules, is a LOCAL_TIMEZONE datetime, so
+# they compare as text. (off by at most an hour around DST changes)
+
+
+def _rate_limit_window(rate_limit: dict, now: datetime) -> tuple[datetime, datetime | None]:
+    """
+    The (start, end) of the window rate_limit counts queries in at now.
+
+    rolling limits look back one timeframe from now, and have no end.
+    absolute limits run from the start of the current second/minute/day/etc.
+    to the start of the next one.
+    """
+    timeframe = rate_limit["timeframe"]
+    mode = rate_limit.get("type", "rolling")
+
+    # build window starting from current time
+    if mode == "rolling":
+        if timeframe == "second":
+            window = timedelta(seconds=1)
+        elif timeframe == "minute":
+            window = timedelta(minutes=1)
+        elif timeframe == "hour":
+            window = timedelta(hours=1)
+        elif timeframe == "day":
+            window = timedelta(days=1)
+        elif timeframe == "month":
+            window = timedelta(days=30)
+        else:
+            raise ValueError(f"Unknown timeframe: {timeframe!r}")
+
+        return now - window, None
+
+    # build window from start to end of current second/minute/day/etc...
+    elif mode == "absolute":
+        if timeframe == "second":
+            start = now.replace(microsecond=0)
+            end   = start + timedelta(seconds=1)
+        elif timeframe == "minute":
+            start = now.replace(second=0, microsecond=0)
+            end   = start + timedelta(minutes=1)
+        elif timeframe == "hour":
+            start = now.replace(minute=0, second=0, microsecond=0)
+            end   = start + timedelta(hours=1)
+        elif timeframe == "day":
+            start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+            end   = start + timedelta(days=1)
+        elif timeframe == "month":
+            start = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+            if now.month == 12:
+                end = start.replace(year=now.year+1, month=1)
+            else:
+                end = start.replace(month=now.month+1)
+        else:
+            raise ValueError(f"Unknown timeframe: {timeframe!r}")
+
+        return start, end
+
+    else:
+        raise ValueError(f"type must be 'rolling' or 'absolute', got {mode!r}")
+
+
+def _rows_in_window(rows: list[dict], start: datetime, end: datetime | None) -> list[dict]:
+    return [
+        row for row in rows
+        if row["timestamp"] >= start and (end is None or row["timestamp"] < end)
+    ]
+
+
+def _rate_limit_error_rows(rows: list[dict], status_code, error_text) -> list[dict]:
+    """The rows whose status code (and error text, if given) say the limit was hit."""
+    if status_code is None:
+        return []
+    status_code_rows = [row for row in rows if row["status_code"] == status_code]
+    if error_text:
+        return [row for row in status_code_rows if error_text in (row["error_text"] or "")]
+    return status_code_rows
+
+
+def _fetch_query_log(api_name: str, db_conn: sqlite3.Connection) -> list[dict]:
+    """Every query-log row for api_name, oldest first."""
+    def _dict_factory(cursor, row):
+        return {col[0]: row[idx] for idx, col in enumerate(cursor.description)}
+
+    db_conn.row_factory = _dict_factory
+    cursor = db_conn.cursor()
+    cursor.execute(
+        f"""
+        SELECT *
+        FROM {QUERY_VIEW_NAME}
+        WHERE api_name = ?
+        ORDER BY timestamp
+        """,
+        (api_name,)
+    )
+    return cursor.fetchall()
+
+
+@_timing.timed_function("check_rate_limits")
 def _check_rate_limits(
     api_name: str,
     rate_limits: list[dict],
@@ -52,23 +173,9 @@ def _check_rate_limits(
     """
     if db_conn is None:
         sys.exit("ERROR: no database connection provided.")
-    
-    def _dict_factory(cursor, row):
-        return {col[0]: row[idx] for idx, col in enumerate(cursor.description)}
 
     # pull all table entries for this api_name
-    db_conn.row_factory = _dict_factory
-    cursor = db_conn.cursor()
-    cursor.execute(
-        f"""
-        SELECT *
-        FROM {QUERY_TABLE_NAME}
-        WHERE api_name = ?
-        ORDER BY timestamp
-        """,
-        (api_name,)
-    )
-    rows = cursor.fetchall()
+    rows = _fetch_query_log(api_name, db_conn)
 
     now = datetime.now(LOCAL_TIMEZONE)
 
@@ -81,55 +188,14 @@ def _check_rate_limits(
         error_text = rate_limit.get("error_text")
         limit_text = f"{query_limit}/{timeframe}"
 
-        # build window starting from current time
-        if mode == "rolling":
-            if timeframe == "second":
-                window = timedelta(seconds=1)
-            elif timeframe == "minute":
-                window = timedelta(minutes=1)
-            elif timeframe == "hour":
-                window = timedelta(hours=1)
-            elif timeframe == "day":
-                window = timedelta(days=1)
-            elif timeframe == "month":
-                window = timedelta(days=30)
-            else:
-                raise ValueError(f"Unknown timeframe: {timeframe!r}")
-            
-            cutoff = now - window
-            timeframe_rows = [row for row in rows if row["timestamp"] >= cutoff]
-
-        # build window from start to end of current second/minute/day/etc...
-        elif mode == "absolute":
-            if timeframe == "second":
-                start = now.replace(microsecond=0)
-                end   = start + timedelta(seconds=1)
-            elif timeframe == "minute":
-                start = now.replace(second=0, microsecond=0)
-                end   = start + timedelta(minutes=1)
-            elif timeframe == "hour":
-                start = now.replace(minute=0, second=0, microsecond=0)
-                end   = start + timedelta(hours=1)
-            elif timeframe == "day":
-                start = now.replace(hour=0, minute=0, second=0, microsecond=0)
-                end   = start + timedelta(days=1)
-            elif timeframe == "month":
-                start = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-                if now.month == 12:
-                    end = start.replace(year=now.year+1, month=1)
-                else:
-                    end = start.replace(month=now.month+1)
-            else:
-                raise ValueError(f"Unknown timeframe: {timeframe!r}")
-
-            timeframe_rows = [row for row in rows if start <= row["timestamp"] < end] # FIXME
-
-        else:
-            raise ValueError(f"type must be 'rolling' or 'absolute', got {mode!r}")
+        start, end = _rate_limit_window(rate_limit, now)
+        timeframe_rows = _rows_in_window(rows, start, end)
 
         # if query limit exceeded
         if len(timeframe_rows) >= query_limit:
-            # if seconds, wait until next second and return true
+            # if seconds, wait until next second and return true. (the
+            # scheduler waits for these before handing out a query, so this
+            # only sleeps when another process or ip_info serve took the slot)
             if timeframe == "second":
                 # compute sleep duration
                 if mode == "rolling":
@@ -139,7 +205,8 @@ def _check_rate_limits(
                     wake_at = end # type: ignore
                 wait = (wake_at - now).total_seconds()
                 if wait > 0:
-                    time.sleep(wait)
+                    with _timing.timed("rate_limit_wait", api_name):
+                        time.sleep(wait)
                 query_check =  True
             # if anything other than seconds, return false
             else:
@@ -150,55 +217,150 @@ def _check_rate_limits(
             query_check = True
 
         # check if error message found
-        status_code_rows = [row for row in timeframe_rows if row["status_code"] == status_code]
-        if status_code_rows:
-            if error_text:
-                error_check = any(error_text in row["error_text"] for row in status_code_rows)
-                error_check = not error_check
-            else:
-                error_check = False
-        # return true if no queries match
-        else:
-            error_check = True
+        error_check = not _rate_limit_error_rows(timeframe_rows, status_code, error_text)
 
-        # if both tests true, return False to allow query
-        if query_check and error_check:
-            return False
-        # if either test failed, return True to prevent query
-        else:
+        # if either test failed, return True to prevent query. otherwise
+        # go on to the provider's next limit
+        if not (query_check and error_check):
+            _timing.count("rate_limit_blocked", api_name=api_name)
             return True
         
     # if no rate limits passed, allow query
     return False
-        
+
+
+def _next_query_time(
+    api_name: str,
+    rate_limits: list[dict],
+    db_conn: sqlite3.Connection,
+) -> datetime:
+    """
+    When rate_limits will next allow a query to api_name: now, or the
+    earliest time every limit that's currently hit has freed up.
+
+    A rolling limit frees up when enough of its queries (or the last rate
+    limit response) age out of the window, an absolute one at the start of
+    the next window.
+    """
+    if db_conn is None:
+        sys.exit("ERROR: no database connection provided.")
+
+    rows = _fetch_query_log(api_name, db_conn)
+    now = datetime.now(LOCAL_TIMEZONE)
+    next_time = now
+
+    for rate_limit in rate_limits:
+        start, end = _rate_limit_window(rate_limit, now)
+        timeframe_rows = _rows_in_window(rows, start, end)
+        error_rows = _rate_limit_error_rows(
+            timeframe_rows, rate_limit.get("status_code"), rate_limit.get("error_text")
+        )
+
+        frees_at = None
+        if len(timeframe_rows) >= rate_limit["query_limit"]:
+            if end is None:
+                # the query that has to age out for the count to drop below the limit
+                oldest = timeframe_rows[len(timeframe_rows) - rate_limit["query_limit"]]
+                frees_at = oldest["timestamp"] + (now - start)
+            else:
+                frees_at = end
+        if error_rows:
+            error_frees_at = error_rows[-1]["timestamp"] + (now - start) if end is None else end
+            frees_at = max(frees_at or error_frees_at, error_frees_at)
+
+        if frees_at is not None:
+            next_time = max(next_time, frees_at)
+
+    return next_time
+
 
 def _fetch_ip_info(
     *,
     api_names: list[str], 
     ip_address: ipaddress.IPv4Address | ipaddress.IPv6Address, 
-    db_conn: sqlite3.Connection
+    db_conn: sqlite3.Connection,
+    include_raw_json: bool = False,
 ) -> list[dict[str, Any]]:
     """
     Fetches stored responses for given API names and IP address.
     If api_names is 'all', returns all records for that IP_address.
+    If include_raw_json, each record also gets the decompressed JSON text
+    of the api response under 'raw_json'.
     Returns a list of dicts.
+
+    Results without raw_json are served from the in-process cache
+    (db/_ip_cache.py) when possible.
     """
+    if db_conn is None:
+        sys.exit("ERROR: no database connection provided.")
+
+    ip_bytes = _pack_ip_address(ip_address)
+    db_conn.row_factory = sqlite3.Row
+
+    if include_raw_json:
+        # only pull in the large raw payloads when asked for
+        query = (
+            f"SELECT {IP_VIEW_NAME}.*, {RAW_JSON_TABLE_NAME}.payload AS raw_json "
+            f"FROM {IP_VIEW_NAME} "
+            f"LEFT JOIN {RAW_JSON_TABLE_NAME} "
+            f"ON {RAW_JSON_TABLE_NAME}.id = {IP_VIEW_NAME}.raw_json_id "
+            "WHERE ip_bytes = ?"
+        )
+        cursor = db_conn.cursor()
+        cursor.execute(query, [ip_bytes])
+        rows = [dict(row) for row in cursor.fetchall()]
+
+        for row in rows:
+            payload = row["raw_json"]
+            row["raw_json"] = _decompress_json(payload) if payload is not None else "{}"
+
+    else:
+        # every provider's rows are cached together, and filtered below
+        cache_key = _cache_key(db_conn, ip_bytes)
+        rows = _cache_get(cache_key)
+        if rows is None:
+            # a write between here and the put keeps these rows out of the cache
+            generation = _cache_generation(cache_key)
+            cursor = db_conn.cursor()
+            cursor.execute(f"SELECT * FROM {IP_VIEW_NAME} WHERE ip_bytes = ?", [ip_bytes])
+            rows = [dict(row) for row in cursor.fetchall()]
+            _cache_put(cache_key, rows, generation)
+
+    if api_names != ["all"]:
+        rows = [row for row in rows if row["api_name"] in api_names]
+
+    return rows
+
+
+def _fetch_network_info(
+    *,
+    api_names: list[str],
+    network: ipaddress.IPv4Network | ipaddress.IPv6Network,
+    db_conn: sqlite3.Connection
+) -> list[dict[str, Any]]:
+    """
+    Fetches stored responses for every IP address inside network.
+    If api_names is 'all', returns records from every API.
+    Returns a list of dicts, ordered by IP address.
+    """
+    first, last = _pack_ip_network(network)
 
-    # build query
     if api_names == ["all"]:
         query = (
-            f"SELECT * FROM {IP_TABLE_NAME} "
-            "WHERE ip_address = ?"
+            f"SELECT * FROM {IP_VIEW_NAME} "
+            "WHERE ip_bytes BETWEEN ? AND ? "
+            "ORDER BY ip_bytes"
         )
-        params = [str(ip_address)]
+        params = [first, last]
     else:
         placeholders = ", ".join("?" for _ in api_names)
         query = (
-            f"SELECT * FROM {IP_TABLE_NAME} "
-            f"WHERE api_name IN ({placeholders}) "
-            "AND ip_address = ?"
+            f"SELECT * FROM {IP_VIEW_NAME} "
+            "WHERE ip_bytes BETWEEN ? AND ? "
+            f"AND api_name IN ({placeholders}) "
+            "ORDER BY ip_bytes"
         )
-        params = api_names + [str(ip_address)]
+        params = [first, last] + api_names
 
     if db_conn is None:
         sys.exit("ERROR: no database connection provided.")
@@ -211,31 +373,314 @@ def _fetch_ip_info(
     return [dict(row) for row in rows]
 
 
+def _is_negative_result_recent(
+    api_name: str,
+    ip_address: ipaddress.IPv4Address | ipaddress.IPv6Address,
+    db_conn: sqlite3.Connection,
+) -> bool:
+    """
+    Checks if api_name recently couldn't answer for ip_address. (see
+    _insert_negative_results) Entries count for the provider's
+    "negative_max_age", or NEGATIVE_MAX_AGE days.
+    """
+    max_age = API_METADATA.get(api_name, {}).get("negative_max_age", NEGATIVE_MAX_AGE)
+    cutoff = datetime.now(LOCAL_TIMEZONE) - timedelta(days=max_age)
+
+    cursor = db_conn.cursor()
+    cursor.row_factory = None
+    cursor.execute(
+        f"""
+        SELECT 1
+        FROM {NEGATIVE_TABLE_NAME}
+        JOIN {PROVIDER_TABLE_NAME} ON {PROVIDER_TABLE_NAME}.id = {NEGATIVE_TABLE_NAME}.provider_id
+        WHERE ip_bytes = ? AND api_name = ? AND timestamp >= ?
+        """,
+        (_pack_ip_address(ip_address), api_name, cutoff)
+    )
+    return cursor.fetchone() is not None
+
+
+@_timing.timed_function("is_db_entry_recent")
 def _is_db_entry_recent(
     api_name: str,
     ip_address: ipaddress.IPv4Address | ipaddress.IPv6Address,
     db_conn: sqlite3.Connection,
-    max_age=MAX_AGE
+    max_age: int | None = None
 ) -> bool:
     """
     Checks if a database entry for the specified API and IP address is recent.
-    Returns True if at least one entry is within max_age days.
+    Returns True if at least one entry is within max_age days, or if the
+    provider recently couldn't answer for the IP. (negative results)
+
+    max_age defaults to the provider's max age. (see db/_max_age.py)
     """
+    if max_age is None:
+        max_age = _provider_max_age(api_name)
+
     # reuse _fetch_ip_info, passing along db_conn
     entries = _fetch_ip_info(
         api_names=[api_name],
         ip_address=ip_address,
         db_conn=db_conn
     )
-    if not entries:
-        return False
 
-    first_ts = entries[0]["timestamp"]
-    tz = first_ts.tzinfo or timezone.utc 
-    now = datetime.now(tz)
+    recent = False
+    if entries:
+        first_ts = entries[0]["timestamp"]
+        tz = first_ts.tzinfo or timezone.utc 
+        now = datetime.now(tz)
+        cutoff = now - timedelta(days=max_age)
+
+        recent = any(
+            entry.get("timestamp") and entry["timestamp"] >= cutoff
+            for entry in entries
+        )
+
+    if recent:
+        _timing.count("cache_hit", api_name=api_name)
+    elif _is_negative_result_recent(api_name, ip_address, db_conn):
+        _timing.count("cache_negative_hit", api_name=api_name)
+        recent = True
+    else:
+        _timing.count("cache_miss", api_name=api_name)
+
+    return recent
+
+
+def _recent_ip_bytes(
+    api_name: str,
+    packed: list[bytes],
+    db_conn: sqlite3.Connection,
+    max_age: int | None = None,
+) -> tuple[set[bytes], set[bytes]]:
+    """
+    The packed ips api_name has a recent result for, and the ones it has a
+    recent negative result for, with one statement per FRESHNESS_CHUNK_SIZE
+    ips. max_age defaults to the provider's max age.
+    """
+    if max_age is None:
+        max_age = _provider_max_age(api_name)
+    negative_max_age = API_METADATA.get(api_name, {}).get("negative_max_age", NEGATIVE_MAX_AGE)
+
+    now = datetime.now(LOCAL_TIMEZONE)
     cutoff = now - timedelta(days=max_age)
+    negative_cutoff = now - timedelta(days=negative_max_age)
+
+    recent: set[bytes] = set()
+    negative: set[bytes] = set()
+
+    cursor = db_conn.cursor()
+    cursor.row_factory = None
+    provider_sql = f"(SELECT id FROM {PROVIDER_TABLE_NAME} WHERE api_name = ?)"
+
+    for i in range(0, len(packed), FRESHNESS_CHUNK_SIZE):
+        chunk = list(dict.fromkeys(packed[i : i + FRESHNESS_CHUNK_SIZE]))
+        placeholders = ", ".join("?" for _ in chunk)
+
+        cursor.execute(
+            f"""
+            SELECT ip_bytes, 0 FROM {IP_TABLE_NAME}
+            WHERE provider_id = {provider_sql} AND ip_bytes IN ({placeholders}) AND timestamp >= ?
+            UNION ALL
+            SELECT ip_bytes, 1 FROM {NEGATIVE_TABLE_NAME}
+            WHERE provider_id = {provider_sql} AND ip_bytes IN ({placeholders}) AND timestamp >= ?
+            """,
+            [api_name, *chunk, cutoff, api_name, *chunk, negative_cutoff]
+        )
+        for ip_bytes, is_negative in cursor.fetchall():
+            (negative if is_negative else recent).add(ip_bytes)
+
+    return recent, negative
+
+
+@_timing.timed_function("is_db_entry_recent")
+def _filter_stale_ip_addresses(
+    api_name: str,
+    ip_addresses: list[ipaddress.IPv4Address | ipaddress.IPv6Address],
+    db_conn: sqlite3.Connection,
+    max_age: int | None = None,
+) -> list[ipaddress.IPv4Address | ipaddress.IPv6Address]:
+    """
+    The ip_addresses api_name has no recent result for, in their original order.
+
+    Batch version of _is_db_entry_recent, checking stored results and
+    negative results with one statement per FRESHNESS_CHUNK_SIZE ips
+    instead of a lookup per ip.
+
+    max_age defaults to the provider's max age. (see db/_max_age.py)
+    """
+    if db_conn is None:
+        sys.exit("ERROR: no database connection provided.")
+
+    packed = [_pack_ip_address(ip_address) for ip_address in ip_addresses]
+    recent, negative = _recent_ip_bytes(api_name, packed, db_conn, max_age)
+
+    stale = [
+        ip_address for ip_address, ip_bytes in zip(ip_addresses, packed)
+        if ip_bytes not in recent and ip_bytes not in negative
+    ]
 
-    return any(
-        entry.get("timestamp") and entry["timestamp"] >= cutoff
-        for entry in entries
+    _timing.count("cache_hit", len(recent), api_name=api_name)
+    _timing.count("cache_negative_hit", len(negative - recent), api_name=api_name)
+    _timing.count("cache_miss", len(stale), api_name=api_name)
+
+    return stale
+
+
+def _answered_ip_addresses(
+    api_name: str,
+    ip_addresses: list[ipaddress.IPv4Address | ipaddress.IPv6Address],
+    db_conn: sqlite3.Connection,
+) -> list[ipaddress.IPv4Address | ipaddress.IPv6Address]:
+    """
+    The ip_addresses api_name has a recent result for, in their original
+    order. Unlike _filter_stale_ip_addresses, negative results don't count.
+    """
+    if db_conn is None:
+        sys.exit("ERROR: no database connection provided.")
+
+    packed = [_pack_ip_address(ip_address) for ip_address in ip_addresses]
+    recent, _ = _recent_ip_bytes(api_name, packed, db_conn)
+    return [
+        ip_address for ip_address, ip_bytes in zip(ip_addresses, packed)
+        if ip_bytes in recent
+    ]
+
+
+def _fetch_provider_stats(
+    *,
+    db_conn: sqlite3.Connection,
+    days: int,
+) -> list[dict[str, Any]]:
+    """
+    Summarize each provider's calls over the last days days, from the query
+    log and its rollups.
+
+    Returns a list of dicts, one per api_name, with keys:
+      api_name, api_display_name, queries, rate_limited, errors,
+      avg_duration_ms, p50_duration_ms, p95_duration_ms,
+      avg_response_bytes, avg_batch_size, retries
+
+    Averages and percentiles of durations leave out calls logged without
+    one (None if there are none), and percentiles only cover calls still in
+    the query log, since rollups don't keep individual durations. Failed requests (no status code) and
+    4xx/5xx responses other than rate limits count as errors.
+    """
+    if db_conn is None:
+        sys.exit("ERROR: no database connection provided.")
+
+    cutoff = datetime.now(LOCAL_TIMEZONE) - timedelta(days=days)
+
+    cursor = db_conn.cursor()
+    cursor.row_factory = None
+
+    cursor.execute(
+        f"""
+        SELECT api_name, api_display_name, IFNULL(status_code, 0), 1,
+            duration_ms IS NOT NULL, duration_ms, response_bytes, batch_size, retry_count
+        FROM {QUERY_TABLE_NAME}
+        JOIN {PROVIDER_TABLE_NAME} ON {PROVIDER_TABLE_NAME}.id = {QUERY_TABLE_NAME}.provider_id
+        WHERE timestamp >= ?
+        """,
+        (cutoff,)
     )
+    raw_rows = cursor.fetchall()
+
+    cursor.execute(
+        f"""
+        SELECT api_name, api_display_name, status_code, query_count,
+            -- rolled up before timed_count existed: assume every row had a duration
+            IFNULL(timed_count, CASE WHEN {QUERY_ROLLUP_TABLE_NAME}.duration_ms > 0 THEN query_count ELSE 0 END),
+            {QUERY_ROLLUP_TABLE_NAME}.duration_ms,
+            {QUERY_ROLLUP_TABLE_NAME}.response_bytes,
+            {QUERY_ROLLUP_TABLE_NAME}.batch_size,
+            {QUERY_ROLLUP_TABLE_NAME}.retry_count
+        FROM {QUERY_ROLLUP_TABLE_NAME}
+        JOIN {PROVIDER_TABLE_NAME} ON {PROVIDER_TABLE_NAME}.id = {QUERY_ROLLUP_TABLE_NAME}.provider_id
+        WHERE day >= ?
+        """,
+        (cutoff.date().isoformat(),)
+    )
+    rollup_rows = cursor.fetchall()
+
+    providers: dict[str, dict[str, Any]] = {}
+    durations: dict[str, list[float]] = {}
+
+    for index, row in enumerate(raw_rows + rollup_rows):
+        api_name, api_display_name, status_code, count, timed, duration_ms, response_bytes, batch_size, retries = row
+
+        stats = providers.setdefault(api_name, {
+            "api_name": api_name,
+            "api_display_name": api_display_name,
+            "queries": 0,
+            "rate_limited": 0,
+            "errors": 0,
+            "timed": 0,
+            "duration_ms": 0.0,
+            "response_bytes": 0,
+            "batch_size": 0,
+            "retries": 0,
+        })
+
+        rate_limit_codes = {
+            rate_limit.get("status_code", 429)
+            for rate_limit in API_METADATA.get(api_name, {}).get("rate_limits", [])
+        } | {429}
+
+        stats["queries"] += count
+        if status_code in rate_limit_codes:
+            stats["rate_limited"] += count
+        elif status_code == 0 or status_code >= 400:
+            stats["errors"] += count
+
+        stats["timed"] += timed
+        stats["duration_ms"] += duration_ms or 0
+        stats["response_bytes"] += response_bytes or 0
+        stats["batch_size"] += batch_size or 0
+        stats["retries"] += retries or 0
+
+        # individual durations only exist for rows still in the query log
+        if index < len(raw_rows) and duration_ms is not None:
+            durations.setdefault(api_name, []).append(duration_ms)
+
+    results = []
+    for api_name, stats in sorted(providers.items()):
+        queries = stats["queries"]
+        provider_durations = durations.get(api_name, [])
+        results.append({
+            "api_name": api_name,
+            "api_display_name": stats["api_display_name"],
+            "queries": queries,
+            "rate_limited": stats["rate_limited"],
+            "errors": stats["errors"],
+            # rows logged without a duration don't count towards the average
+            "avg_duration_ms": stats["duration_ms"] / stats["timed"] if stats["timed"] else None,
+            "p50_duration_ms": _percentile(provider_durations, 50) if provider_durations else None,
+            "p95_duration_ms": _percentile(provider_durations, 95) if provider_durations else None,
+            "avg_response_bytes": stats["response_bytes"] / queries,
+            "avg_batch_size": stats["batch_size"] / queries,
+            "retries": stats["retries"],
+        })
+
+    return results
+
+
+def _rank_providers_by_latency(
+    api_names: list[str],
+    db_conn: sqlite3.Connection,
+    days: int = QUERY_LOG_RETENTION_DAYS,
+) -> list[str]:
+    """
+    api_names, fastest first by median request time over the last days
+    days. (or the average, once only rollups are left) Providers with no
+    logged queries go last, in their original order.
+    """
+    latency = {}
+    for stats in _fetch_provider_stats(db_conn=db_conn, days=days):
+        duration = stats["p50_duration_ms"]
+        if duration is None:
+            duration = stats["avg_duration_ms"]
+        if duration is not None:
+            latency[stats["api_name"]] = duration
+
+    return sorted(api_names, key=lambda api_name: (api_name not in latency, latency.get(api_name, 0)))
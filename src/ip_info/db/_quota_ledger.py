@@ -0,0 +1,175 @@
+"""
+Remaining quota per provider, for ipi --plan.
+
+For each absolute rate limit (the daily/monthly quotas) the ledger keeps
+the number of queries made in the current window. _insert_query_info
+bumps it with every logged query, so reading it never scans the query
+log. The first time a provider's limit is used or read, it's seeded
+from the queries already logged in the window.
+"""
+from datetime import datetime
+import sqlite3
+import sys
+
+from ip_info.config import (
+    API_METADATA,
+    LOCAL_TIMEZONE,
+    PROVIDER_TABLE_NAME,
+    QUERY_TABLE_NAME,
+    QUOTA_TABLE_NAME,
+)
+from ip_info.db._query_db import _rate_limit_window
+
+
+def _absolute_limits(api_name: str) -> list[dict]:
+    return [
+        rate_limit
+        for rate_limit in API_METADATA.get(api_name, {}).get("rate_limits", [])
+        if rate_limit.get("type", "rolling") == "absolute"
+    ]
+
+
+def _seed_ledger(
+    provider_id: int,
+    rate_limit: dict,
+    db_conn: sqlite3.Connection,
+    now: datetime,
+) -> bool:
+    """
+    Add the ledger row for rate_limit from the query log, unless there is
+    one already. Returns whether it was added. Doesn't commit.
+    """
+    cursor = db_conn.cursor()
+    cursor.row_factory = None
+    cursor.execute(
+        f"SELECT 1 FROM {QUOTA_TABLE_NAME} WHERE provider_id = ? AND timeframe = ?",
+        (provider_id, rate_limit["timeframe"])
+    )
+    if cursor.fetchone() is not None:
+        return False
+
+    window_start, _ = _rate_limit_window(rate_limit, now)
+    cursor.execute(
+        f"SELECT COUNT(*) FROM {QUERY_TABLE_NAME} WHERE provider_id = ? AND timestamp >= ?",
+        (provider_id, window_start)
+    )
+    cursor.execute(
+        f"INSERT INTO {QUOTA_TABLE_NAME} (provider_id, timeframe, window_start, used) "
+        "VALUES (?, ?, ?, ?)",
+        (provider_id, rate_limit["timeframe"], window_start, cursor.fetchone()[0])
+    )
+    return True
+
+
+def _record_quota_use(
+    api_name: str,
+    provider_id: int,
+    status_code: int | None,
+    error_text: str | None,
+    db_conn: sqlite3.Connection,
+    now: datetime | None = None,
+) -> None:
+    """
+    Count one query to api_name against each of its absolute limits. A
+    response that says a limit was hit uses up the rest of that window.
+    Called by _insert_query_info after it logs the query. Doesn't commit.
+    """
+    rate_limits = _absolute_limits(api_name)
+    if not rate_limits:
+        return
+
+    if now is None:
+        now = datetime.now(LOCAL_TIMEZONE)
+
+    cursor = db_conn.cursor()
+    cursor.row_factory = None
+
+    for rate_limit in rate_limits:
+        timeframe = rate_limit["timeframe"]
+        window_start, _ = _rate_limit_window(rate_limit, now)
+
+        # the query log already has this query, so seeding counts it
+        if not _seed_ledger(provider_id, rate_limit, db_conn, now):
+            # a new window starts over
+            cursor.execute(
+                f"UPDATE {QUOTA_TABLE_NAME} SET "
+                "used = CASE WHEN window_start = ? THEN used + 1 ELSE 1 END, "
+                "window_start = ? "
+                "WHERE provider_id = ? AND timeframe = ?",
+                (window_start, window_start, provider_id, timeframe)
+            )
+
+        limit_status_code = rate_limit.get("status_code")
+        limit_error_text = rate_limit.get("error_text")
+        if (
+            limit_status_code is not None
+            and status_code == limit_status_code
+            and (not limit_error_text or limit_error_text in (error_text or ""))
+        ):
+            cursor.execute(
+                f"UPDATE {QUOTA_TABLE_NAME} SET used = MAX(used, ?) "
+                "WHERE provider_id = ? AND timeframe = ?",
+                (rate_limit["query_limit"], provider_id, timeframe)
+            )
+
+
+def _remaining_quota(
+    api_name: str,
+    db_conn: sqlite3.Connection,
+    now: datetime | None = None,
+) -> list[dict]:
+    """
+    Where api_name stands against each of its absolute limits.
+
+    Returns:
+        one dict per absolute limit, with keys timeframe, query_limit,
+        used, remaining and resets (the end of the current window).
+        Empty for providers without one.
+    """
+    if db_conn is None:
+        sys.exit("ERROR: no database connection provided.")
+
+    if now is None:
+        now = datetime.now(LOCAL_TIMEZONE)
+
+    rate_limits = _absolute_limits(api_name)
+    if not rate_limits:
+        return []
+
+    cursor = db_conn.cursor()
+    cursor.row_factory = None
+    cursor.execute(f"SELECT id FROM {PROVIDER_TABLE_NAME} WHERE api_name = ?", (api_name,))
+    row = cursor.fetchone()
+
+    # a provider that was never queried has its whole quota left
+    ledger = {}
+    if row is not None:
+        provider_id = row[0]
+        seeded = [_seed_ledger(provider_id, rate_limit, db_conn, now) for rate_limit in rate_limits]
+        if any(seeded):
+            db_conn.commit()
+
+        cursor.execute(
+            f"SELECT timeframe, window_start, used FROM {QUOTA_TABLE_NAME} WHERE provider_id = ?",
+            (provider_id,)
+        )
+        ledger = {timeframe: (window_start, used) for timeframe, window_start, used in cursor.fetchall()}
+
+    quotas = []
+    for rate_limit in rate_limits:
+        window_start, window_end = _rate_limit_window(rate_limit, now)
+
+        used = 0
+        stored_start, stored_used = ledger.get(rate_limit["timeframe"], (None, 0))
+        if stored_start is not None and datetime.fromisoformat(str(stored_start)) == window_start:
+            used = stored_used
+
+        quotas.append({
+            "timeframe": rate_limit["timeframe"],
+            "query_limit": rate_limit["query_limit"],
+            "used": used,
+            "remaining": max(rate_limit["query_limit"] - used, 0),
+            "resets": window_end,
+        })
+
+    return quotas
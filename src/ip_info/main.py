@@ -1,16 +1,28 @@
 import argparse
 from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 import ipaddress
 import sqlite3
 import sys
+import threading
+import time
 import traceback
 from typing import cast 
 
-from ip_info import __version__
+from ip_info import __version__, _timing
 from ip_info._ask_yn import ask_yn
+from ip_info._assign import _assign_sources
 from ip_info._display_ip_info import display_ip_info
+from ip_info._display_provider_stats import display_provider_stats
+from ip_info._escalation import _escalated_ip_addresses
+from ip_info._metrics import start_metrics_server, stop_metrics_server
 from ip_info._parse_clipboard import parse_clipboard
+from ip_info._plan import display_plan
+from ip_info._prefix_dedup import _dedup_by_prefix, _fan_out_results
+from ip_info._scheduler import run_scheduled
+from ip_info._service_client import lookup_via_server
 from ip_info._validate_ip_addresses import _validate_ip_addresses
+from ip_info.apis._request_api import _request_deadline
 from ip_info.apis.abstractapicom import abstractapicom  # noqa: F401
 from ip_info.apis.abuseipdbcom import abuseipdbcom  # noqa: F401
 from ip_info.apis.criminalipio import criminalipio  # noqa: F401
@@ -25,11 +37,38 @@ from ip_info.apis.ipinfoio import ipinfoio  # noqa: F401
 from ip_info.apis.ipqueryio import ipqueryio  # noqa: F401
 from ip_info.apis.ipregistryco import ipregistryco  # noqa: F401
 from ip_info.apis.virustotalcom import virustotalcom  # noqa: F401
-from ip_info.config import DB_PATH, API_METADATA
+from ip_info.config import DB_PATH, DRAIN_MAX_WAIT, LOCAL_TIMEZONE, PREFIX_LENGTHS, SCHEDULER_MAX_WAIT, TIERED_FIRST_APIS, API_METADATA
 from ip_info.db._initialize_db import initialize_db, ensure_columns_exist
+from ip_info.db._ip_cache import _Connection
+from ip_info.db._maintain_db import prune_query_log
+from ip_info.db._max_age import _set_max_age_overrides
+from ip_info.db._pending_queries import _claim_due_queries, _clear_answered_queries, _pending_summary
+from ip_info.db._query_db import _rank_providers_by_latency
 from ip_info.keys import _get_api_key
 
   
+_thread_local = threading.local()
+
+
+def _connect_db(check_same_thread: bool = True) -> sqlite3.Connection:
+    db_conn = sqlite3.connect(
+        DB_PATH,
+        detect_types=sqlite3.PARSE_DECLTYPES,
+        check_same_thread=check_same_thread,
+        factory=_Connection,
+    )
+    _timing.watch_connection(db_conn)
+    return db_conn
+
+
+def _thread_db_conn() -> sqlite3.Connection:
+    """This thread's long lived connection, opened on first use."""
+    db_conn = getattr(_thread_local, "db_conn", None)
+    if db_conn is None:
+        db_conn = _thread_local.db_conn = _connect_db()
+    return db_conn
+
+
 def run_api_function_threadsafe(
     api_function,
     api_name: str,
@@ -37,118 +76,432 @@ def run_api_function_threadsafe(
     ip_addresses,
     rate_limits,
     api_key,
+    keep_db_conn: bool = False,
 ):
-    db_conn = sqlite3.connect(DB_PATH, detect_types=sqlite3.PARSE_DECLTYPES)
+    # long running callers (ip_info serve) keep one connection per worker thread
+    db_conn = _thread_db_conn() if keep_db_conn else _connect_db()
     try:
-        api_function(
-            api_name=api_name,
-            api_display_name=api_display_name,
-            ip_addresses=ip_addresses,
-            rate_limits=rate_limits,
-            api_key=api_key,
-            db_conn=db_conn,
-        )
+        with _timing.timed("provider", api_name):
+            api_function(
+                api_name=api_name,
+                api_display_name=api_display_name,
+                ip_addresses=ip_addresses,
+                rate_limits=rate_limits,
+                api_key=api_key,
+                db_conn=db_conn,
+            )
     except Exception:
         print(f"[ERROR] Exception in thread for {api_name}")
         traceback.print_exc()
     finally:
-        db_conn.close()
+        if not keep_db_conn:
+            db_conn.close()
+
+
+def _get_api_keys(query_apis: list[str]) -> dict[str, str | None]:
+    """
+    Look up the api key for each api in query_apis.
+
+    Returns:
+        api_name -> api key (None for apis that don't need one), for the
+        apis that can be queried. Unknown apis, apis without an
+        implementation and apis missing a required key are left out.
+    """
+    api_keys = {}
+
+    for api_name in query_apis:
+        api_metadata = API_METADATA.get(api_name)
+        if not api_metadata:
+            print(f"Unknown API '{api_name}' - skipping")
+            continue
+
+        with _timing.timed("api_key"):
+            api_key = _get_api_key(api_name)
+        if not api_key and api_metadata["requires_key"]:
+            continue
+
+        if globals().get(api_name) is None:
+            print(f"No implementation found for {api_name}")
+            continue
+
+        api_keys[api_name] = api_key
+
+    return api_keys
+
+
+def _run_lookups(
+    *,
+    executor: ThreadPoolExecutor,
+    ip_addresses_by_api: dict[str, list[ipaddress.IPv4Address | ipaddress.IPv6Address]],
+    api_keys: dict[str, str | None],
+    db_conn: sqlite3.Connection,
+    max_wait: float = SCHEDULER_MAX_WAIT,
+    deadline: float | None = None,
+    quorum: int | None = None,
+) -> dict[str, list[ipaddress.IPv4Address | ipaddress.IPv6Address]]:
+    """
+    Query each api for its ip addresses through the scheduler (see
+    _scheduler.py), sharing executor's threads between every provider, and
+    wait for them all to finish, or until deadline. (a time.monotonic()
+    value) With a quorum, stop once that many providers have answered for
+    each ip. Results are written to the database.
+
+    Returns:
+        api_name -> the ip addresses that were queued or still running
+        at the deadline, instead of answered.
+    """
+    def _run(api_name: str, ip_addresses: list) -> None:
+        api_metadata = API_METADATA[api_name]
+        with _request_deadline(deadline):
+            run_api_function_threadsafe(
+                globals()[api_name],
+                api_name,
+                api_metadata["api_display_name"],
+                ip_addresses,
+                api_metadata["rate_limits"],
+                api_keys[api_name],
+            )
+
+    return run_scheduled(
+        executor=executor,
+        ip_addresses_by_api={
+            api_name: ip_addresses
+            for api_name, ip_addresses in ip_addresses_by_api.items()
+            if ip_addresses and api_name in api_keys
+        },
+        run=_run,
+        db_conn=db_conn,
+        max_wait=max_wait,
+        deadline=deadline,
+        quorum=quorum,
+    )
+
+
+def _read_ip_addresses(user_input: list[str]) -> list[ipaddress.IPv4Address | ipaddress.IPv6Address]:
+    """Validate the ips given on the command line, or find them in the clipboard."""
+    # if input supplied as cli argument
+    if user_input:
+        return _validate_ip_addresses(
+            user_input=user_input, 
+            verbose=True
+        )
+
+    # if no cli input, check clipboard
+    user_input = parse_clipboard()
+    if not user_input:
+        sys.exit("No IP addresses supplied and none detected in clipboard.")
+
+    ip_addresses = _validate_ip_addresses(
+        user_input=user_input, 
+        verbose=False
+    )
+    ip_addresses_string: list[str] = [str(ip) for ip in ip_addresses]
+    print(f"Found in clipboard: {ip_addresses_string}")
+    if ask_yn("Query these IPs?", true="n"):
+        sys.exit("No IP addresses supplied and none detected in clipboard.")
+
+    return ip_addresses
 
 
 def main(
     *, 
     user_input: list[str], 
     query_apis: list[str], 
-    output_format="table"
+    output_format="table",
+    profile=False,
+    metrics_port=None,
+    server_url=None,
+    max_age=None,
+    api_max_ages=None,
+    deadline=None,
+    quorum=None,
+    tiered=False,
+    sources=None,
+    by_prefix=False,
+    prefix_lengths=PREFIX_LENGTHS,
     ):
 
+    # seconds everything, provider queries included, has to finish in
+    if deadline is not None:
+        deadline = time.monotonic() + deadline
+
     # display package version for user
     print(f"Package version: {__version__}")
 
+    # let a running `ip_info serve` do the work
+    if server_url:
+        lookup_via_server(
+            server_url=server_url,
+            ip_addresses=_read_ip_addresses(user_input),
+            query_apis=query_apis,
+            output_format=output_format,
+        )
+        return
+
+    if profile:
+        _timing.enable()
+
+    # re-query results older than these, instead of each provider's max_age
+    _set_max_age_overrides(max_age, api_max_ages)
+
+    if metrics_port:
+        start_metrics_server(metrics_port)
+        print(f"Serving metrics on http://127.0.0.1:{metrics_port}/metrics")
+
     # open database
-    db_conn = sqlite3.connect(DB_PATH, detect_types=sqlite3.PARSE_DECLTYPES)
+    db_conn = _connect_db()
 
     try:
-        # verify the database schema is correct
-        initialize_db(db_conn=db_conn)
-        ensure_columns_exist(db_conn=db_conn)
+        with _timing.timed("db_setup"):
+            # verify the database schema is correct
+            initialize_db(db_conn=db_conn)
+            ensure_columns_exist(db_conn=db_conn)
 
-        # if input supplied as cli argument
-        if user_input:
-            ip_addresses: list[ipaddress.IPv4Address | ipaddress.IPv6Address] = _validate_ip_addresses(
-                user_input=user_input, 
-                verbose=True
-            )
-        # if no cli input, check clipboard
-        else:
-            user_input = parse_clipboard()
-            if not user_input:
-                sys.exit("No IP addresses supplied and none detected in clipboard.")
-
-            ip_addresses: list[ipaddress.IPv4Address | ipaddress.IPv6Address] = _validate_ip_addresses(
-                user_input=user_input, 
-                verbose=False
-            )
-            ip_addresses_string: list[str] = [str(ip) for ip in ip_addresses]
-            print(f"Found in clipboard: {ip_addresses_string}")
-            if ask_yn("Query these IPs?", true="n"):
-                sys.exit("No IP addresses supplied and none detected in clipboard.")
+            # roll up query log rows older than any rate limit window
+            prune_query_log(db_conn=db_conn)
 
-        with ThreadPoolExecutor(max_workers=15) as executor:
-            futures = []
+        ip_addresses = _read_ip_addresses(user_input)
 
-            # loop through each api and create thread
-            for api_name in query_apis:
-                api_metadata = API_METADATA.get(api_name)
-                if not api_metadata:
-                    print(f"Unknown API '{api_name}' - skipping")
-                    continue
+        api_keys = _get_api_keys(query_apis)
 
-                api_display_name = api_metadata["api_display_name"]
-                rate_limits = api_metadata["rate_limits"]
-                requires_key = api_metadata["requires_key"]
+        # ask the historically fastest providers first
+        api_names = list(api_keys)
+        if quorum is not None or sources is not None:
+            api_names = _rank_providers_by_latency(api_names, db_conn)
 
-                api_key = _get_api_key(api_name)
-                if not api_key and requires_key:
-                    continue
+        # cheap bulk providers first, then the rest only for ips that need them
+        tiers = [api_names]
+        if tiered:
+            tiers = [
+                [api_name for api_name in api_names if api_name in TIERED_FIRST_APIS],
+                [api_name for api_name in api_names if api_name not in TIERED_FIRST_APIS],
+            ]
 
-                api_function = globals().get(api_name)
-                if api_function is None:
-                    print(f"No implementation found for {api_name}")
-                    continue
+        unanswered = {}
+        with ThreadPoolExecutor(max_workers=15) as executor:
+            for index, tier_api_names in enumerate(tiers):
+                tier_ip_addresses = ip_addresses
+                if index > 0:
+                    tier_ip_addresses = _escalated_ip_addresses(ip_addresses, db_conn)
+                    print(f"Escalating {len(tier_ip_addresses)} of {len(ip_addresses)} IPs to {', '.join(tier_api_names) or 'no other APIs'}.")
 
-                futures.append(
-                    executor.submit(
-                        run_api_function_threadsafe,
-                        api_function,
-                        api_name,
-                        api_display_name,
-                        ip_addresses,
-                        rate_limits,
-                        api_key,
+                ip_addresses_by_api = {api_name: tier_ip_addresses for api_name in tier_api_names}
+                if sources is not None:
+                    ip_addresses_by_api, short = _assign_sources(
+                        ip_addresses=tier_ip_addresses,
+                        api_names=tier_api_names,
+                        sources=sources,
+                        db_conn=db_conn,
                     )
-                )
+                    if short:
+                        print(f"{len(short)} IPs can't get {sources} sources within the APIs' remaining quotas.")
+
+                # geolocation providers only get one ip per network
+                assigned = ip_addresses_by_api
+                if by_prefix:
+                    ip_addresses_by_api = _dedup_by_prefix(ip_addresses_by_api, db_conn, prefix_lengths)
 
-            # wait for all threads to finish
-            for future in futures:
-                future.result()  # triggers any exceptions
+                unanswered.update(_run_lookups(
+                    executor=executor,
+                    ip_addresses_by_api=ip_addresses_by_api,
+                    api_keys=api_keys,
+                    db_conn=db_conn,
+                    deadline=deadline,
+                    quorum=quorum,
+                ))
+
+                if by_prefix:
+                    inferred = sum(
+                        _fan_out_results(api_name, ip_addresses, db_conn, prefix_lengths)
+                        for api_name, ip_addresses in assigned.items()
+                        if API_METADATA[api_name].get("geo_only")
+                    )
+                    if inferred:
+                        print(f"Inferred {inferred} results from other IPs in the same network.")
+            if deadline is not None and time.monotonic() >= deadline:
+                print("Deadline reached. Showing the results so far.")
+
+        # anything queued earlier that this run answered is done
+        for api_name in api_keys:
+            _clear_answered_queries(api_name, ip_addresses, db_conn)
+        pending = sum(summary["count"] for summary in _pending_summary(db_conn).values())
+        if pending:
+            print(f"{pending} queries are queued for later. Run ipi --drain to finish them.")
 
         print("")
 
         # retrieve ip info from database and display for user
-        display_ip_info(
+        with _timing.timed("display"):
+            display_ip_info(
+                ip_addresses=ip_addresses,
+                db_conn=db_conn,
+                output_format=output_format,
+                unanswered=unanswered,
+            )
+
+        if profile:
+            _timing.report()
+
+    finally:
+        # Ensure the DB connection is closed even on errors or interrupts
+        db_conn.close()
+        _timing.disable()
+        if metrics_port:
+            stop_metrics_server()
+
+
+def drain(*, max_wait: int = DRAIN_MAX_WAIT):
+    """
+    Run queued queries (see db/_pending_queries.py) as the providers allow
+    them, until the queue is empty or the next one isn't due within max_wait
+    seconds. Whatever's left stays queued for the next run.
+    """
+    print(f"Package version: {__version__}")
+
+    db_conn = _connect_db()
+    try:
+        initialize_db(db_conn=db_conn)
+        ensure_columns_exist(db_conn=db_conn)
+        prune_query_log(db_conn=db_conn)
+
+        api_keys = _get_api_keys(list(_pending_summary(db_conn)))
+
+        with ThreadPoolExecutor(max_workers=15) as executor:
+            while True:
+                due = _claim_due_queries(db_conn, list(api_keys))
+                if due:
+                    print(f"Running {sum(len(ips) for ips in due.values())} queued queries.")
+                    _run_lookups(
+                        executor=executor,
+                        ip_addresses_by_api=due,
+                        api_keys=api_keys,
+                        db_conn=db_conn,
+                        max_wait=max_wait,
+                    )
+                    for api_name, ip_addresses in due.items():
+                        _clear_answered_queries(api_name, ip_addresses, db_conn)
+                    continue
+
+                summary = {
+                    api_name: api_summary
+                    for api_name, api_summary in _pending_summary(db_conn).items()
+                    if api_name in api_keys
+                }
+                if not summary:
+                    print("No queued queries left.")
+                    break
+
+                pending = sum(api_summary["count"] for api_summary in summary.values())
+                next_attempt = min(api_summary["next_attempt"] for api_summary in summary.values())
+                wait = (next_attempt - datetime.now(LOCAL_TIMEZONE)).total_seconds()
+                if wait > max_wait:
+                    print(f"{pending} queued queries left. The next is due {next_attempt:%Y-%m-%d %H:%M}.")
+                    break
+
+                print(f"{pending} queued queries left. Waiting {max(wait, 0):.0f}s for the next...")
+                time.sleep(max(wait, 0))
+
+    except KeyboardInterrupt:
+        print("Stopped. Queued queries are kept for the next --drain.")
+
+    finally:
+        db_conn.close()
+
+
+def provider_stats(*, days: int):
+    """Show how each provider has performed over the last days days."""
+    db_conn = _connect_db()
+    try:
+        initialize_db(db_conn=db_conn)
+        ensure_columns_exist(db_conn=db_conn)
+        display_provider_stats(db_conn=db_conn, days=days)
+    finally:
+        db_conn.close()
+
+
+def plan(
+    *,
+    user_input: list[str],
+    query_apis: list[str],
+    sources: int | None = None,
+    by_prefix: bool = False,
+    prefix_lengths: tuple[int, int] = PREFIX_LENGTHS,
+):
+    """
+    Show how many requests each provider needs for the ips, how much of its
+    quota is left and how long it should take, without querying anything.
+    With sources, for the assignment ipi --sources would use, and with
+    by_prefix, for one ip per network from the geolocation providers.
+    """
+    db_conn = _connect_db()
+    try:
+        initialize_db(db_conn=db_conn)
+        ensure_columns_exist(db_conn=db_conn)
+        prune_query_log(db_conn=db_conn)
+
+        ip_addresses = _read_ip_addresses(user_input)
+        api_keys = _get_api_keys(query_apis)
+
+        ip_addresses_by_api = None
+        if sources is not None:
+            ip_addresses_by_api, short = _assign_sources(
+                ip_addresses=ip_addresses,
+                api_names=_rank_providers_by_latency(list(api_keys), db_conn),
+                sources=sources,
+                db_conn=db_conn,
+            )
+            if short:
+                print(f"{len(short)} IPs can't get {sources} sources within the APIs' remaining quotas.")
+
+        if by_prefix:
+            if ip_addresses_by_api is None:
+                ip_addresses_by_api = {api_name: ip_addresses for api_name in api_keys}
+            ip_addresses_by_api = _dedup_by_prefix(ip_addresses_by_api, db_conn, prefix_lengths)
+
+        display_plan(
             ip_addresses=ip_addresses,
+            api_names=list(api_keys),
             db_conn=db_conn,
-            output_format=output_format,
+            ip_addresses_by_api=ip_addresses_by_api,
         )
-
     finally:
-        # Ensure the DB connection is closed even on errors or interrupts
         db_conn.close()
 
 
+def _resolve_query_apis(query_apis: list[str]) -> list[str]:
+    """Expand the "all", "bulk" and "none" choices of --apis into api names."""
+    if query_apis == ["all"]:
+        return list(API_METADATA.keys())
+    if query_apis == ["bulk"]:
+        return [
+            api_name
+            for api_name, api_information in API_METADATA.items()
+            if api_information["allows_bulk"]
+        ]
+    if query_apis == ["none"]:
+        return []
+    return query_apis
+
+
+def _parse_api_days(parser: argparse.ArgumentParser, option: str, pairs: list[str]) -> dict[str, int]:
+    """Parse API_NAME=DAYS pairs from a command line option."""
+    api_days = {}
+    for pair in pairs:
+        api_name, _, days = pair.partition("=")
+        if api_name not in API_METADATA or not days.isdigit():
+            parser.error(f"Invalid {option} '{pair}'. Use API_NAME=DAYS.")
+        api_days[api_name] = int(days)
+    return api_days
+
+
 def cli():
 
+    # ip_info serve [options]
+    if sys.argv[1:2] == ["serve"]:
+        from ip_info.service import cli as serve_cli
+        serve_cli(sys.argv[2:])
+        return
+
     parser = argparse.ArgumentParser(
         description = "Query IP reputation APIs and store responses."
     )
@@ -185,28 +538,177 @@ def cli():
         default = ["all"],
         help = "Comma separated list of APIs to query."
     )
+    parser.add_argument(
+        "--max_age",
+        "--max-age",
+        dest = "max_age",
+        type = int,
+        metavar = "DAYS",
+        help = "Query again when stored results are older than DAYS days. (default: each API's max_age)"
+    )
+    parser.add_argument(
+        "--api_max_age",
+        dest = "api_max_ages",
+        nargs = "+",
+        default = [],
+        metavar = "API_NAME=DAYS",
+        help = "Per API override of --max_age, e.g. abuseipdbcom=1"
+    )
+    parser.add_argument(
+        "--deadline",
+        dest = "deadline",
+        type = float,
+        metavar = "SECONDS",
+        help = "Show whatever results are in after SECONDS seconds. Unfinished queries are queued for ipi --drain."
+    )
+    parser.add_argument(
+        "--quorum",
+        dest = "quorum",
+        type = int,
+        metavar = "N",
+        help = "Stop once N providers have answered for each IP, asking the fastest first."
+    )
+    parser.add_argument(
+        "--sources",
+        dest = "sources",
+        type = int,
+        metavar = "K",
+        help = "Ask just enough APIs about each IP for K results, sparing the ones with little quota left."
+    )
+    parser.add_argument(
+        "--by_prefix",
+        "--by-prefix",
+        dest = "by_prefix",
+        action = "store_true",
+        help = "Ask geolocation-only APIs about one IP per network (see --prefix_lengths) and copy the answer to the rest, marked as inferred."
+    )
+    parser.add_argument(
+        "--prefix_lengths",
+        dest = "prefix_lengths",
+        nargs = 2,
+        type = int,
+        default = list(PREFIX_LENGTHS),
+        metavar = ("IPV4", "IPV6"),
+        help = "Network sizes for --by_prefix. (default: 24 48)"
+    )
+    parser.add_argument(
+        "--tiered",
+        dest = "tiered",
+        action = "store_true",
+        help = "Ask the cheap bulk APIs about every IP first, and the rest only about IPs flagged as proxy, tor, hosting, high risk etc. (see ESCALATE_FLAGS in config.py)"
+    )
+    parser.add_argument(
+        "--profile",
+        "--stats",
+        dest = "profile",
+        action = "store_true",
+        help = "Print where the run's time went. (api keys, database, rate limits, each provider)"
+    )
+    parser.add_argument(
+        "--metrics_port",
+        dest = "metrics_port",
+        type = int,
+        help = "Serve OpenMetrics (Prometheus) metrics on http://127.0.0.1:PORT/metrics while running."
+    )
+    parser.add_argument(
+        "--server",
+        dest = "server_url",
+        metavar = "URL",
+        help = "Look the IPs up through a running `ip_info serve`, e.g. http://127.0.0.1:8321"
+    )
+    parser.add_argument(
+        "--drain",
+        dest = "drain",
+        action = "store_true",
+        help = "Run the queries earlier runs queued because of rate limits or errors, waiting for providers to allow them, then exit."
+    )
+    parser.add_argument(
+        "--plan",
+        dest = "plan",
+        action = "store_true",
+        help = "Show the requests, remaining quota and estimated time each API needs for the IPs, without querying anything, then exit."
+    )
+    parser.add_argument(
+        "--provider_stats",
+        "--provider-stats",
+        dest = "provider_stats",
+        nargs = "?",
+        type = int,
+        const = 30,
+        metavar = "DAYS",
+        help = "Show latency, error and rate limit stats for each provider over the last DAYS days (default 30), then exit."
+    )
     
     args = parser.parse_args()
 
+    if args.provider_stats is not None:
+        provider_stats(days=args.provider_stats)
+        return
+
+    if args.drain:
+        _set_max_age_overrides(args.max_age, _parse_api_days(parser, "--api_max_age", args.api_max_ages))
+        drain()
+        return
+
     # parse ips from positional or named argument, normalize to list
     user_input = cast(list[str], args.ip_addresses_arg or args.ip_addresses_pos)
 
     # set query_apis
-    if args.query_apis == ["all"]:
-        args.query_apis = list(API_METADATA.keys())
-    elif args.query_apis == ["bulk"]:
-        args.query_apis = [
-            api_name
-            for api_name, api_information in API_METADATA.items()
-            if api_information["allows_bulk"]
+    args.query_apis = _resolve_query_apis(args.query_apis)
+
+    api_max_ages = _parse_api_days(parser, "--api_max_age", args.api_max_ages)
+
+    prefix_lengths = tuple(args.prefix_lengths)
+    if not (0 <= prefix_lengths[0] <= 32 and 0 <= prefix_lengths[1] <= 128):
+        parser.error("--prefix_lengths must be 0-32 for IPv4 and 0-128 for IPv6.")
+    if args.quorum is not None and args.quorum < 1:
+        parser.error("--quorum must be at least 1.")
+    if args.sources is not None and args.sources < 1:
+        parser.error("--sources must be at least 1.")
+
+    if args.plan:
+        _set_max_age_overrides(args.max_age, api_max_ages)
+        plan(
+            user_input=user_input,
+            query_apis=args.query_apis,
+            sources=args.sources,
+            by_prefix=args.by_prefix,
+            prefix_lengths=prefix_lengths,
+        )
+        return
+
+    # the service runs its lookups with its own settings
+    if args.server_url:
+        local_options = [
+            option for option, value in (
+                ("--deadline", args.deadline),
+                ("--quorum", args.quorum),
+                ("--sources", args.sources),
+                ("--tiered", args.tiered),
+                ("--by_prefix", args.by_prefix),
+                ("--max_age", args.max_age),
+                ("--api_max_age", args.api_max_ages),
+            )
+            if value not in (None, False, [])
         ]
-    elif args.query_apis == ["none"]:
-        args.query_apis = []
+        if local_options:
+            parser.error(f"{', '.join(local_options)} can't be used with --server. (give --max_age to ip_info serve instead)")
     
     main(
         user_input = user_input,
         query_apis = args.query_apis,
-        output_format = args.output_format
+        output_format = args.output_format,
+        profile = args.profile,
+        metrics_port = args.metrics_port,
+        server_url = args.server_url,
+        max_age = args.max_age,
+        api_max_ages = api_max_ages,
+        deadline = args.deadline,
+        quorum = args.quorum,
+        tiered = args.tiered,
+        sources = args.sources,
+        by_prefix = args.by_prefix,
+        prefix_lengths = prefix_lengths,
     )
 
 if __name__ == "__main__":
@@ -0,0 +1,142 @@
+import argparse
+import sqlite3
+
+import tabulate
+
+from ip_info.config import API_METADATA, DB_PATH, EXPIRE_AGE
+from ip_info.db._initialize_db import initialize_db, ensure_columns_exist
+from ip_info.db._maintain_db import (
+    db_stats,
+    delete_orphaned_raw_json,
+    expire_ip_data,
+    expire_negative_results,
+    optimize_db,
+    prune_query_log,
+    vacuum_db,
+)
+
+
+def _print_stats(title: str, stats: dict) -> None:
+    print(f"\n{title}")
+    print(f"Size: {stats['size_bytes'] / 1024 / 1024:.1f} MiB "
+          f"({stats['free_bytes'] / 1024 / 1024:.1f} MiB free)")
+
+    tabulate.MIN_PADDING = 0
+    print(
+        tabulate.tabulate(
+            sorted(stats["tables"].items()),
+            headers=["table", "rows"],
+            tablefmt="simple_outline",
+        )
+    )
+    if stats["providers"]:
+        print(
+            tabulate.tabulate(
+                stats["providers"].items(),
+                headers=["api_name", "ip_data rows"],
+                tablefmt="simple_outline",
+            )
+        )
+
+
+def maintain(
+    *,
+    expire_age: int = EXPIRE_AGE,
+    api_expire_ages: dict[str, int] | None = None,
+    full_vacuum: bool = False,
+) -> None:
+    """
+    Expire old rows, reclaim space and refresh planner statistics.
+
+    Args:
+        expire_age: delete ip_data rows older than this many days
+        api_expire_ages: per api_name overrides of expire_age. Falls back to
+            "expire_age" in API_METADATA, then expire_age.
+        full_vacuum: run a full VACUUM. (needed once for databases created
+            before incremental vacuum was enabled)
+    """
+    # per provider ages: API_METADATA, then anything passed in
+    expire_ages = {
+        api_name: api_metadata["expire_age"]
+        for api_name, api_metadata in API_METADATA.items()
+        if "expire_age" in api_metadata
+    }
+    expire_ages.update(api_expire_ages or {})
+
+    db_conn = sqlite3.connect(DB_PATH, detect_types=sqlite3.PARSE_DECLTYPES)
+    try:
+        initialize_db(db_conn=db_conn)
+        ensure_columns_exist(db_conn=db_conn)
+
+        _print_stats("Before maintenance", db_stats(db_conn))
+        print("")
+
+        expired = expire_ip_data(db_conn, expire_ages, expire_age)
+        print(f"Expired {expired} ip_data rows.")
+
+        negatives = expire_negative_results(db_conn)
+        print(f"Expired {negatives} negative results.")
+
+        orphans = delete_orphaned_raw_json(db_conn)
+        print(f"Deleted {orphans} unused raw_json payloads.")
+
+        pruned = prune_query_log(db_conn)
+        print(f"Rolled up {pruned} api_queries rows.")
+
+        print("Vacuuming...")
+        vacuum_db(db_conn, full=full_vacuum)
+
+        print("Analyzing...")
+        optimize_db(db_conn)
+
+        _print_stats("After maintenance", db_stats(db_conn))
+
+    finally:
+        db_conn.close()
+
+
+def cli():
+
+    parser = argparse.ArgumentParser(
+        description = "Expire old data and compact the ip_info database."
+    )
+    parser.add_argument(
+        "--expire_age",
+        dest = "expire_age",
+        type = int,
+        default = EXPIRE_AGE,
+        help = f"Delete results older than this many days. (default {EXPIRE_AGE})"
+    )
+    parser.add_argument(
+        "--api_expire_age",
+        dest = "api_expire_ages",
+        nargs = "+",
+        default = [],
+        metavar = "API_NAME=DAYS",
+        help = "Per API override of --expire_age, e.g. virustotalcom=30"
+    )
+    parser.add_argument(
+        "--full_vacuum",
+        dest = "full_vacuum",
+        action = "store_true",
+        help = "Rewrite the whole database file. Slow, but enables incremental vacuum on older databases."
+    )
+
+    args = parser.parse_args()
+
+    # parse API_NAME=DAYS pairs
+    api_expire_ages = {}
+    for pair in args.api_expire_ages:
+        api_name, _, days = pair.partition("=")
+        if not days.isdigit():
+            parser.error(f"Invalid --api_expire_age '{pair}'. Use API_NAME=DAYS.")
+        api_expire_ages[api_name] = int(days)
+
+    maintain(
+        expire_age = args.expire_age,
+        api_expire_ages = api_expire_ages,
+        full_vacuum = args.full_vacuum,
+    )
+
+if __name__ == "__main__":
+    cli()
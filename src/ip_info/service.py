@@ -0,0 +1,370 @@
+"""
+Long running lookup service. (ip_info serve)
+
+Keeps api keys, provider sessions, worker threads and database connections
+open between lookups, and answers over a local HTTP/JSON API:
+
+    GET  /ip/<ip address>[?apis=api_name,api_name&raw_json=1]
+    POST /lookup   {"ips": [...], "apis": [...], "raw_json": false}
+    GET  /health
+    GET  /metrics  (OpenMetrics)
+
+Stored results that are still recent are returned straight from the
+database. Anything missing or stale is queried first, like ipi does, with
+concurrent lookups sharing provider queries. (see _coalesce)
+"""
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import ipaddress
+import json
+import queue
+import sqlite3
+import traceback
+from typing import Any
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from ip_info import __version__
+from ip_info._coalesce import LookupCoalescer
+from ip_info._metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE
+from ip_info._metrics import enable_metrics, render_metrics
+from ip_info._validate_ip_addresses import _validate_ip_addresses
+from ip_info.config import API_METADATA, SERVICE_HOST, SERVICE_PORT
+from ip_info.db._initialize_db import ensure_columns_exist, initialize_db
+from ip_info.db._maintain_db import prune_query_log
+from ip_info.db._query_db import _fetch_ip_info, _filter_stale_ip_addresses
+from ip_info.db._max_age import _set_max_age_overrides
+import ip_info.main
+from ip_info.main import (
+    _connect_db,
+    _get_api_keys,
+    _parse_api_days,
+    _resolve_query_apis,
+    run_api_function_threadsafe,
+)
+
+# _fetch_ip_info columns that only matter inside the database
+INTERNAL_COLUMNS = ("id", "ip_bytes", "provider_id", "raw_json_id")
+
+MAX_BODY_BYTES = 10 * 1024 * 1024
+
+
+class LookupServer(ThreadingHTTPServer):
+    """
+    HTTP server holding the warm state shared by every request.
+
+    Args:
+        address: (host, port) to listen on
+        api_keys: api_name -> api key, for each api the service queries
+        workers: provider threads shared by all requests
+    """
+    daemon_threads = True
+
+    def __init__(self, address: tuple[str, int], *, api_keys: dict[str, str | None], workers: int = 15):
+        super().__init__(address, _LookupHandler)
+        self.api_keys = api_keys
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ip_info-provider")
+        # concurrent lookups share provider queries
+        self.coalescer = LookupCoalescer(self.executor, self._query_provider)
+        # connections for request threads. They're handed between threads,
+        # but only ever used by one at a time.
+        self._db_conns: queue.LifoQueue[sqlite3.Connection] = queue.LifoQueue()
+
+    @contextmanager
+    def db_conn(self):
+        try:
+            db_conn = self._db_conns.get_nowait()
+        except queue.Empty:
+            db_conn = _connect_db(check_same_thread=False)
+        try:
+            yield db_conn
+        finally:
+            self._db_conns.put(db_conn)
+
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        while not self._db_conns.empty():
+            self._db_conns.get_nowait().close()
+
+    def _query_provider(
+        self,
+        api_name: str,
+        ip_addresses: list[ipaddress.IPv4Address | ipaddress.IPv6Address],
+    ) -> None:
+        api_metadata = API_METADATA[api_name]
+        run_api_function_threadsafe(
+            getattr(ip_info.main, api_name),
+            api_name,
+            api_metadata["api_display_name"],
+            ip_addresses,
+            api_metadata["rate_limits"],
+            self.api_keys[api_name],
+            keep_db_conn=True,
+        )
+
+    def lookup(
+        self,
+        ip_addresses: list[ipaddress.IPv4Address | ipaddress.IPv6Address],
+        api_names: list[str] | None = None,
+        include_raw_json: bool = False,
+    ) -> dict[str, list[dict[str, Any]]]:
+        """
+        Stored results for each ip, querying the providers for any that are
+        missing or stale first.
+
+        Args:
+            api_names: limit queries and results to these apis. (default:
+                query every api the service has, return every stored result)
+                An empty list queries nothing and returns every stored result.
+
+        Returns:
+            ip address -> list of result rows, ready for json.
+        """
+        query_apis = [
+            api_name for api_name in (self.api_keys if api_names is None else api_names)
+            if api_name in self.api_keys
+        ]
+
+        with self.db_conn() as db_conn:
+            stale = {
+                api_name: _filter_stale_ip_addresses(api_name, ip_addresses, db_conn)
+                for api_name in query_apis
+            }
+
+        if any(stale.values()):
+            self.coalescer.lookup(stale)
+
+        results = {}
+        with self.db_conn() as db_conn:
+            for ip_address in ip_addresses:
+                rows = _fetch_ip_info(
+                    api_names=api_names or ["all"],
+                    ip_address=ip_address,
+                    db_conn=db_conn,
+                    include_raw_json=include_raw_json,
+                )
+                results[str(ip_address)] = [_serialize_row(row) for row in rows]
+
+        return results
+
+
+def _serialize_row(row: dict[str, Any]) -> dict[str, Any]:
+    """A _fetch_ip_info row as plain json types."""
+    row = {key: value for key, value in row.items() if key not in INTERNAL_COLUMNS}
+    if row.get("timestamp") is not None:
+        row["timestamp"] = row["timestamp"].isoformat()
+    if "raw_json" in row:
+        row["raw_json"] = json.loads(row["raw_json"])
+    return row
+
+
+class _RequestError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+def _parse_api_names(api_names) -> list[str] | None:
+    """None when no apis were given. An empty list (apis "none") queries nothing."""
+    if api_names is None:
+        return None
+    if not isinstance(api_names, list) or not all(isinstance(name, str) for name in api_names):
+        raise _RequestError(400, "apis must be a list of api names")
+
+    api_names = _resolve_query_apis(api_names)
+    unknown = [api_name for api_name in api_names if api_name not in API_METADATA]
+    if unknown:
+        raise _RequestError(400, f"unknown apis: {', '.join(unknown)}")
+    return api_names
+
+
+class _LookupHandler(BaseHTTPRequestHandler):
+    server: LookupServer
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status: int, body: bytes, content_type: str) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, status: int, value) -> None:
+        self._send(status, json.dumps(value).encode("utf-8"), "application/json")
+
+    def _handle(self, route) -> None:
+        try:
+            route()
+        except _RequestError as error:
+            self._send_json(error.status, {"error": str(error)})
+        except Exception:
+            traceback.print_exc()
+            self._send_json(500, {"error": "lookup failed"})
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+
+        if url.path == "/health":
+            self._send_json(200, {"status": "ok", "version": __version__, "apis": list(self.server.api_keys)})
+        elif url.path == "/metrics":
+            self._send(200, render_metrics().encode("utf-8"), METRICS_CONTENT_TYPE)
+        elif url.path.startswith("/ip/"):
+            self._handle(lambda: self._get_ip(url.path[len("/ip/"):], parse_qs(url.query)))
+        else:
+            self._send_json(404, {"error": f"no route for {url.path}"})
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+
+        if url.path == "/lookup":
+            self._handle(self._post_lookup)
+        else:
+            self._send_json(404, {"error": f"no route for {url.path}"})
+
+    def _get_ip(self, ip_string: str, query: dict[str, list[str]]) -> None:
+        ip_string = unquote(ip_string)
+        ip_addresses = _validate_ip_addresses(user_input=[ip_string], verbose=False)
+        if not ip_addresses:
+            raise _RequestError(400, f"{ip_string!r} is not a public IP address")
+
+        api_names = None
+        if "apis" in query:
+            api_names = _parse_api_names(",".join(query["apis"]).split(","))
+        include_raw_json = query.get("raw_json", ["0"])[0].lower() in ("1", "true", "yes")
+
+        results = self.server.lookup(ip_addresses, api_names, include_raw_json)
+        self._send_json(200, {"ip": str(ip_addresses[0]), "results": results[str(ip_addresses[0])]})
+
+    def _post_lookup(self) -> None:
+        length = int(self.headers.get("Content-Length") or 0)
+        if length > MAX_BODY_BYTES:
+            raise _RequestError(413, "request body too large")
+
+        try:
+            body = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            raise _RequestError(400, "request body must be JSON")
+
+        ips = body.get("ips") if isinstance(body, dict) else None
+        if not isinstance(ips, list) or not all(isinstance(ip, str) for ip in ips):
+            raise _RequestError(400, "ips must be a list of IP address strings")
+
+        api_names = _parse_api_names(body.get("apis"))
+        ip_addresses = _validate_ip_addresses(user_input=ips, verbose=False)
+        valid = {str(ip) for ip in ip_addresses}
+
+        results = self.server.lookup(ip_addresses, api_names, bool(body.get("raw_json")))
+        self._send_json(200, {
+            "results": results,
+            "invalid": [ip for ip in ips if ip.strip() not in valid],
+        })
+
+
+def serve(
+    *,
+    query_apis: list[str],
+    host: str = SERVICE_HOST,
+    port: int = SERVICE_PORT,
+    workers: int = 15,
+    max_age: int | None = None,
+    api_max_ages: dict[str, int] | None = None,
+) -> None:
+    """Run the lookup service until interrupted."""
+    print(f"Package version: {__version__}")
+
+    _set_max_age_overrides(max_age, api_max_ages)
+
+    db_conn = _connect_db()
+    try:
+        initialize_db(db_conn=db_conn)
+        ensure_columns_exist(db_conn=db_conn)
+        prune_query_log(db_conn=db_conn)
+    finally:
+        db_conn.close()
+
+    api_keys = _get_api_keys(query_apis)
+    enable_metrics()
+
+    server = LookupServer((host, port), api_keys=api_keys, workers=workers)
+    print(f"Querying: {', '.join(api_keys) or 'no apis'}")
+    print(f"Listening on http://{host}:{server.server_address[1]}")
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("Shutting down.")
+    finally:
+        server.server_close()
+
+
+def cli(argv: list[str] | None = None):
+
+    parser = argparse.ArgumentParser(
+        prog = "ip_info serve",
+        description = "Serve IP lookups over a local HTTP/JSON API."
+    )
+    parser.add_argument(
+        "--host",
+        dest = "host",
+        default = SERVICE_HOST,
+        help = f"Address to listen on. (default {SERVICE_HOST})"
+    )
+    parser.add_argument(
+        "--port",
+        dest = "port",
+        type = int,
+        default = SERVICE_PORT,
+        help = f"Port to listen on. (default {SERVICE_PORT})"
+    )
+    parser.add_argument(
+        "--api",
+        "--apis",
+        "--query_api",
+        "--query_apis",
+        dest = "query_apis",
+        nargs = "+",
+        choices = ["all", "bulk"] + list(API_METADATA.keys()),
+        default = ["all"],
+        help = "APIs the service queries."
+    )
+    parser.add_argument(
+        "--workers",
+        dest = "workers",
+        type = int,
+        default = 15,
+        help = "Provider threads shared by all lookups. (default 15)"
+    )
+    parser.add_argument(
+        "--max_age",
+        dest = "max_age",
+        type = int,
+        metavar = "DAYS",
+        help = "Query again when stored results are older than DAYS days. (default: each API's max_age)"
+    )
+    parser.add_argument(
+        "--api_max_age",
+        dest = "api_max_ages",
+        nargs = "+",
+        default = [],
+        metavar = "API_NAME=DAYS",
+        help = "Per API override of --max_age, e.g. abuseipdbcom=1"
+    )
+
+    args = parser.parse_args(argv)
+
+    serve(
+        query_apis = _resolve_query_apis(args.query_apis),
+        host = args.host,
+        port = args.port,
+        workers = args.workers,
+        max_age = args.max_age,
+        api_max_ages = _parse_api_days(parser, "--api_max_age", args.api_max_ages),
+    )
+
+if __name__ == "__main__":
+    cli()
@@ -1,9 +1,11 @@
 """
 Shared pytest fixtures for ip_info tests.
 """
+from datetime import datetime, timedelta
 import sqlite3
 import pytest
 
+from ip_info.config import LOCAL_TIMEZONE
 from ip_info.db._initialize_db import initialize_db, ensure_columns_exist
 
 @pytest.fixture
@@ -13,3 +15,23 @@ def db_conn():
     ensure_columns_exist(conn)
     yield conn
     conn.close()
+
+@pytest.fixture
+def ip_entry():
+    """
+    Builds _insert_ip_info rows: ip_entry(api_name, ip_address, days_ago=0,
+    **columns), with empty values for any columns not given.
+    """
+    def _ip_entry(api_name: str, ip_address, *, days_ago: float = 0, **columns) -> dict:
+        entry = {
+            "timestamp": datetime.now(LOCAL_TIMEZONE) - timedelta(days=days_ago),
+            "ip_address": str(ip_address),
+            "api_name": api_name,
+            "api_display_name": api_name,
+            "risk": 0, "city": "", "state": "", "cc": "", "company": "",
+            "isp": "", "as_name": "", "hostname": "", "flags": "-",
+            "raw_json": {},
+        }
+        entry.update(columns)
+        return entry
+    return _ip_entry
@@ -0,0 +1,45 @@
+import ipaddress
+
+import requests
+
+from ip_info._assign import _assign_sources
+from ip_info.db._add_to_db import _insert_ip_info, _insert_query_info
+
+def _ips(count: int) -> list:
+    return [ipaddress.ip_address(f"10.0.0.{i}") for i in range(1, count + 1)]
+
+def _use_quota(api_name: str, count: int, db_conn) -> None:
+    response = requests.Response()
+    response.status_code = 200
+    response._content = b""
+    for _ in range(count):
+        _insert_query_info(api_name, response, db_conn)
+
+def test_unlimited_providers_go_first(db_conn):
+    ips = _ips(10)
+    api_names = ["ipapicom", "ipqueryio", "ipdashapicom"]
+
+    assignment, short = _assign_sources(ip_addresses=ips, api_names=api_names, sources=2, db_conn=db_conn)
+    assert assignment == {"ipqueryio": ips, "ipdashapicom": ips}
+    assert short == []
+
+    assignment, short = _assign_sources(ip_addresses=ips, api_names=api_names, sources=3, db_conn=db_conn)
+    assert assignment["ipapicom"] == ips
+
+def test_scarce_quota_is_kept_back(db_conn):
+    ips = _ips(10)
+    # ipapicom: 100 a month, 10 of them kept back
+    _use_quota("ipapicom", 88, db_conn)
+
+    assignment, short = _assign_sources(ip_addresses=ips, api_names=["ipapicom", "ipqueryio"], sources=2, db_conn=db_conn)
+
+    assert assignment["ipapicom"] == ips[:2]
+    assert short == ips[2:]
+
+def test_stored_results_count_as_sources(db_conn, ip_entry):
+    ips = _ips(3)
+    _insert_ip_info(entries=[ip_entry("ipapiis", ips[0])], db_conn=db_conn)
+
+    assignment, _ = _assign_sources(ip_addresses=ips, api_names=["ipapiis", "ipqueryio"], sources=1, db_conn=db_conn)
+
+    assert assignment == {"ipqueryio": ips[1:]}
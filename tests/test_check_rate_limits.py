@@ -1,17 +1,19 @@
 from datetime import datetime, timedelta
 
+from ip_info.db._add_to_db import _get_provider_id
 from ip_info.db._query_db import _check_rate_limits
 from ip_info.config import LOCAL_TIMEZONE
 
 def _add_past_calls(db_conn, api_name: str, seconds_ago: int, count: int):
     """Insert *count* fake query-log rows at *seconds_ago* into the past."""
     then = datetime.now(LOCAL_TIMEZONE) - timedelta(seconds=seconds_ago)
+    provider_id = _get_provider_id(api_name, db_conn)
     cur  = db_conn.cursor()
     for _ in range(count):
         cur.execute(
-            "INSERT INTO api_queries (api_name,timestamp,status_code,error_text) "
+            "INSERT INTO api_queries (provider_id,timestamp,status_code,error_text) "
             "VALUES (?,?,?,?)",
-            (api_name, then, 200, ""),
+            (provider_id, then, 200, ""),
         )
     db_conn.commit()
 
@@ -0,0 +1,73 @@
+import pytest
+import requests
+
+from ip_info.apis import _circuit_breaker as circuit_breaker
+from ip_info.apis import _request_api as request_api
+from ip_info.apis._circuit_breaker import (
+    CircuitOpenError,
+    _allow_request,
+    _record_result,
+    _reset_circuits,
+    _retry_at,
+)
+from ip_info.apis._request_api import _request_api
+from ip_info.config import CIRCUIT_FAILURE_THRESHOLD
+
+@pytest.fixture(autouse=True)
+def _closed_circuits():
+    yield
+    _reset_circuits()
+
+def _open(api_name: str) -> None:
+    for _ in range(CIRCUIT_FAILURE_THRESHOLD):
+        _record_result(api_name, failed=True)
+
+def test_opens_after_consecutive_failures():
+    for _ in range(CIRCUIT_FAILURE_THRESHOLD - 1):
+        _record_result("ipqueryio", failed=True)
+    _record_result("ipqueryio", failed=False)
+    _record_result("ipqueryio", failed=True)
+    assert _allow_request("ipqueryio")
+
+    _open("ipqueryio")
+    assert not _allow_request("ipqueryio")
+    assert _retry_at("ipqueryio") is not None
+    # other providers aren't affected
+    assert _allow_request("ipdashapicom")
+
+def test_half_open_probe(monkeypatch):
+    monkeypatch.setattr(circuit_breaker, "CIRCUIT_COOL_DOWN", 0)
+    _open("ipqueryio")
+
+    # one probe at a time
+    assert _allow_request("ipqueryio")
+    monkeypatch.setattr(circuit_breaker, "CIRCUIT_COOL_DOWN", 60)
+    assert not _allow_request("ipqueryio")
+
+    # a failed probe opens it again, a working one closes it
+    _record_result("ipqueryio", failed=True)
+    assert not _allow_request("ipqueryio")
+    monkeypatch.setattr(circuit_breaker, "CIRCUIT_COOL_DOWN", 0)
+    assert _allow_request("ipqueryio")
+    _record_result("ipqueryio", failed=False)
+    assert _retry_at("ipqueryio") is None
+
+def test_request_api_stops_calling_a_dead_provider(db_conn, monkeypatch):
+    calls = []
+
+    class _Session:
+        def request(self, method, url, **kwargs):
+            calls.append(kwargs)
+            raise requests.exceptions.ConnectTimeout("timed out")
+
+    monkeypatch.setattr(request_api, "_get_session", lambda: _Session())
+    monkeypatch.setattr(request_api.time, "sleep", lambda seconds: None)
+
+    for _ in range(10):
+        with pytest.raises(requests.exceptions.RequestException):
+            _request_api("GET", "https://example.invalid", api_name="ipqueryio", db_conn=db_conn)
+
+    assert len(calls) == CIRCUIT_FAILURE_THRESHOLD
+    assert calls[0]["timeout"]
+    with pytest.raises(CircuitOpenError):
+        _request_api("GET", "https://example.invalid", api_name="ipqueryio", db_conn=db_conn)
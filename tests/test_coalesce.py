@@ -0,0 +1,52 @@
+import ipaddress
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from ip_info._coalesce import LookupCoalescer
+
+
+def _lookup_concurrently(coalescer, requests):
+    threads = [
+        threading.Thread(target=coalescer.lookup, args=(request,))
+        for request in requests
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=5)
+
+
+def test_concurrent_lookups_share_queries():
+    calls = []
+    lock = threading.Lock()
+
+    def run(api_name, ip_addresses):
+        time.sleep(0.1)
+        with lock:
+            calls.append((api_name, sorted(str(ip) for ip in ip_addresses)))
+
+    ip = ipaddress.ip_address("8.8.8.8")
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        coalescer = LookupCoalescer(executor, run, window=0.05)
+        # virustotalcom doesn't allow bulk, so its query starts right away
+        _lookup_concurrently(coalescer, [{"virustotalcom": [ip]}] * 3)
+
+    assert calls == [("virustotalcom", ["8.8.8.8"])]
+
+
+def test_bulk_ips_merged_into_one_batch():
+    calls = []
+
+    def run(api_name, ip_addresses):
+        calls.append((api_name, sorted(str(ip) for ip in ip_addresses)))
+
+    ips = [ipaddress.ip_address(ip) for ip in ("1.1.1.1", "8.8.8.8", "9.9.9.9")]
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        coalescer = LookupCoalescer(executor, run, window=0.2)
+        _lookup_concurrently(coalescer, [
+            {"ipqueryio": [ips[0], ips[1]]},
+            {"ipqueryio": [ips[1], ips[2]]},
+        ])
+
+    assert calls == [("ipqueryio", ["1.1.1.1", "8.8.8.8", "9.9.9.9"])]
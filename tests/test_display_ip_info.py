@@ -0,0 +1,13 @@
+import ipaddress
+
+from ip_info._display_ip_info import display_ip_info
+from ip_info.config import MAX_AGE
+from ip_info.db._add_to_db import _insert_ip_info
+
+def test_stale_results_are_shown_as_missing(db_conn, ip_entry, capsys):
+    ips = [ipaddress.ip_address("8.8.8.8"), ipaddress.ip_address("1.1.1.1")]
+    _insert_ip_info(entries=[ip_entry("ipqueryio", "8.8.8.8", days_ago=MAX_AGE + 1)], db_conn=db_conn)
+
+    display_ip_info(ip_addresses=ips, output_format="table", db_conn=db_conn, unanswered={"ipqueryio": ips})
+
+    assert capsys.readouterr().out.count("No result yet from IPQuery.io") == 2
@@ -0,0 +1,29 @@
+import ipaddress
+
+from ip_info._escalation import _escalated_ip_addresses, _flag_words, _should_escalate
+from ip_info.config import ESCALATE_MIN_RISK
+from ip_info.db._add_to_db import _insert_ip_info
+
+def test_flag_words():
+    assert _flag_words("proxy:vpn, usage:isp, risk:12") == {"proxy", "vpn", "usage", "isp", "risk", "12"}
+    assert _flag_words("-") == {"-"}
+    assert _flag_words(None) == set()
+
+def test_should_escalate():
+    assert _should_escalate([])
+    assert not _should_escalate([{"flags": "mobile", "risk": ""}, {"flags": "usage:isp", "risk": 0}])
+    assert _should_escalate([{"flags": "mobile", "risk": ""}, {"flags": "datacenter", "risk": ""}])
+    # ip2proxy's proxy types
+    assert _should_escalate([{"flags": "proxy:vpn, usage:commercial", "risk": 0}])
+    assert _should_escalate([{"flags": "-", "risk": ESCALATE_MIN_RISK}])
+
+def test_escalated_ip_addresses(db_conn, ip_entry):
+    _insert_ip_info(entries=[
+        ip_entry("ipqueryio", "8.8.8.8"),
+        ip_entry("ipqueryio", "1.1.1.1", flags="tor"),
+        ip_entry("ip2proxy", "9.9.9.9", flags="proxy:public", risk=80),
+    ], db_conn=db_conn)
+
+    ips = [ipaddress.ip_address(ip) for ip in ("8.8.8.8", "1.1.1.1", "9.9.9.9", "4.4.4.4")]
+
+    assert [str(ip) for ip in _escalated_ip_addresses(ips, db_conn)] == ["1.1.1.1", "9.9.9.9", "4.4.4.4"]
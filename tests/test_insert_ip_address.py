@@ -3,6 +3,7 @@ import sqlite3
 from datetime import datetime, timezone
 
 from ip_info.db._add_to_db import _insert_ip_info
+from ip_info.db._query_db import _fetch_ip_info
 from ip_info.config import IP_TABLE_NAME, IP_INSERT_ORDER
 
 def _single_row(conn: sqlite3.Connection):
@@ -38,7 +39,35 @@ def test_upsert_overwrites(db_conn):
     row = _single_row(db_conn)
     assert row["risk"] == 99                    # updated field
     assert row["timestamp"] == ts2             # updated field
-    assert json.loads(row["raw_json"]) == {}   # serialised OK
+    stored = _fetch_ip_info(
+        api_names=["abc"], ip_address="1.1.1.1", db_conn=db_conn, include_raw_json=True
+    )
+    assert json.loads(stored[0]["raw_json"]) == {}   # serialised OK
 
     # check all expected columns present
     assert set(row) >= set(IP_INSERT_ORDER)
+
+def test_raw_json_is_deduplicated(db_conn):
+    base = {
+        "timestamp": datetime.now(timezone.utc),
+        "api_name": "abc",
+        "api_display_name": "ABC",
+        "risk": 0, "city": "", "state": "", "cc": "", "company": "",
+        "isp": "", "as_name": "", "hostname": "", "flags": "-",
+    }
+    entries = [
+        base | {"ip_address": "1.1.1.1", "raw_json": {"asn": 13335}},
+        base | {"ip_address": "1.0.0.1", "raw_json": {"asn": 13335}},
+        base | {"ip_address": "8.8.8.8", "raw_json": {"asn": 15169}},
+    ]
+    _insert_ip_info(entries=entries, db_conn=db_conn)
+
+    assert db_conn.execute("SELECT COUNT(*) FROM raw_json").fetchone()[0] == 2
+
+    # raw payloads are only loaded on request
+    plain = _fetch_ip_info(api_names=["all"], ip_address="8.8.8.8", db_conn=db_conn)
+    assert "raw_json" not in plain[0]
+    full = _fetch_ip_info(
+        api_names=["all"], ip_address="8.8.8.8", db_conn=db_conn, include_raw_json=True
+    )
+    assert json.loads(full[0]["raw_json"]) == {"asn": 15169}
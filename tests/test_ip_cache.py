@@ -0,0 +1,75 @@
+import ipaddress
+import sqlite3
+
+import pytest
+
+from ip_info._pack_ip_address import _pack_ip_address
+from ip_info.db._add_to_db import _insert_ip_info
+from ip_info.db._initialize_db import ensure_columns_exist, initialize_db
+from ip_info.db._ip_cache import _Connection, _cache_clear, _cache_generation, _cache_get, _cache_key, _cache_put
+from ip_info.db._query_db import _fetch_ip_info, _is_db_entry_recent
+
+
+@pytest.fixture
+def file_db_conn(tmp_path):
+    # the cache skips in-memory databases
+    conn = sqlite3.connect(tmp_path / "ip_info.db", detect_types=sqlite3.PARSE_DECLTYPES, factory=_Connection)
+    initialize_db(conn)
+    ensure_columns_exist(conn)
+    yield conn
+    conn.close()
+    _cache_clear()
+
+
+def test_cached_until_insert(file_db_conn, ip_entry):
+    ip = ipaddress.ip_address("8.8.8.8")
+    _insert_ip_info(entries=[ip_entry("ipqueryio", "8.8.8.8", city="Mountain View", raw_json={"city": "Mountain View"})], db_conn=file_db_conn)
+
+    rows = _fetch_ip_info(api_names=["all"], ip_address=ip, db_conn=file_db_conn)
+    assert [row["city"] for row in rows] == ["Mountain View"]
+
+    # callers get copies
+    rows[0]["city"] = "changed"
+
+    # a change behind the cache's back isn't seen...
+    file_db_conn.execute("DELETE FROM ip_data")
+    file_db_conn.commit()
+    rows = _fetch_ip_info(api_names=["ipqueryio"], ip_address=ip, db_conn=file_db_conn)
+    assert [row["city"] for row in rows] == ["Mountain View"]
+    assert _is_db_entry_recent("ipqueryio", ip, file_db_conn)
+    assert _fetch_ip_info(api_names=["virustotalcom"], ip_address=ip, db_conn=file_db_conn) == []
+
+    # ...but inserts invalidate the ip
+    _insert_ip_info(entries=[ip_entry("ipqueryio", "8.8.8.8", city="Springfield", raw_json={"city": "Springfield"})], db_conn=file_db_conn)
+    rows = _fetch_ip_info(api_names=["all"], ip_address=ip, db_conn=file_db_conn)
+    assert [row["city"] for row in rows] == ["Springfield"]
+
+
+def test_hits_run_no_sql(file_db_conn, ip_entry):
+    ip = ipaddress.ip_address("8.8.8.8")
+    _insert_ip_info(entries=[ip_entry("ipqueryio", "8.8.8.8", city="Mountain View", raw_json={"city": "Mountain View"})], db_conn=file_db_conn)
+    _fetch_ip_info(api_names=["all"], ip_address=ip, db_conn=file_db_conn)
+
+    statements = []
+    file_db_conn.set_trace_callback(statements.append)
+    rows = _fetch_ip_info(api_names=["all"], ip_address=ip, db_conn=file_db_conn)
+    file_db_conn.set_trace_callback(None)
+
+    assert [row["city"] for row in rows] == ["Mountain View"]
+    assert statements == []
+
+
+def test_reads_that_race_a_write_are_not_cached(file_db_conn, ip_entry):
+    ip = ipaddress.ip_address("8.8.8.8")
+    key = _cache_key(file_db_conn, _pack_ip_address(ip))
+
+    # a reader takes its generation and reads no rows...
+    generation = _cache_generation(key)
+    # ...a writer stores a result for the ip...
+    _insert_ip_info(entries=[ip_entry("ipqueryio", "8.8.8.8", city="Mountain View", raw_json={"city": "Mountain View"})], db_conn=file_db_conn)
+    # ...and the reader's rows, older than the write, are dropped
+    _cache_put(key, [], generation)
+
+    assert _cache_get(key) is None
+    rows = _fetch_ip_info(api_names=["all"], ip_address=ip, db_conn=file_db_conn)
+    assert [row["city"] for row in rows] == ["Mountain View"]
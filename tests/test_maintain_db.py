@@ -0,0 +1,19 @@
+from ip_info.db._add_to_db import _insert_ip_info
+from ip_info.db._maintain_db import db_stats, delete_orphaned_raw_json, expire_ip_data
+
+def test_expire_per_provider(db_conn, ip_entry):
+    _insert_ip_info(entries=[
+        ip_entry("virustotalcom", "1.1.1.1", days_ago=40, raw_json={"vt": 1}),
+        ip_entry("virustotalcom", "8.8.8.8", days_ago=5, raw_json={"vt": 2}),
+        ip_entry("ipapico", "1.1.1.1", days_ago=40, raw_json={"geo": 1}),
+    ], db_conn=db_conn)
+
+    deleted = expire_ip_data(db_conn, {"virustotalcom": 30}, default_age=365)
+    assert deleted == 1
+
+    stats = db_stats(db_conn)
+    assert stats["providers"] == {"ipapico": 1, "virustotalcom": 1}
+
+    # the expired row's payload is no longer referenced
+    assert delete_orphaned_raw_json(db_conn) == 1
+    assert db_stats(db_conn)["tables"]["raw_json"] == 2
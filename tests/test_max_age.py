@@ -0,0 +1,51 @@
+import ipaddress
+
+import pytest
+
+from ip_info.config import MAX_AGE
+from ip_info.db._add_to_db import _insert_ip_info, _insert_negative_results
+from ip_info.db._max_age import _provider_max_age, _set_max_age_overrides
+from ip_info.db._query_db import _filter_stale_ip_addresses, _is_db_entry_recent
+
+@pytest.fixture(autouse=True)
+def _reset_overrides():
+    yield
+    _set_max_age_overrides()
+
+def test_provider_max_age():
+    assert _provider_max_age("ipqueryio") == MAX_AGE
+    assert _provider_max_age("abuseipdbcom") < MAX_AGE
+
+    _set_max_age_overrides(30, {"ipqueryio": 2})
+    assert _provider_max_age("ipqueryio") == 2
+    assert _provider_max_age("abuseipdbcom") == 30
+
+def test_reputation_results_go_stale_first(db_conn, ip_entry):
+    ip = ipaddress.ip_address("8.8.8.8")
+    _insert_ip_info(entries=[
+        ip_entry("abuseipdbcom", "8.8.8.8", days_ago=10),
+        ip_entry("ipqueryio", "8.8.8.8", days_ago=10),
+    ], db_conn=db_conn)
+
+    assert not _is_db_entry_recent("abuseipdbcom", ip, db_conn)
+    assert _is_db_entry_recent("ipqueryio", ip, db_conn)
+
+    _set_max_age_overrides(api_max_ages={"ipqueryio": 5})
+    assert not _is_db_entry_recent("ipqueryio", ip, db_conn)
+
+def test_filter_stale_matches_is_db_entry_recent(db_conn, ip_entry):
+    _insert_ip_info(entries=[
+        ip_entry("ipqueryio", "8.8.8.8", days_ago=1),
+        ip_entry("ipqueryio", "1.1.1.1", days_ago=MAX_AGE + 1),
+        ip_entry("ipqueryio", "2001:4860:4860::8888", days_ago=1),
+    ], db_conn=db_conn)
+    _insert_negative_results("ipqueryio", ["9.9.9.9"], db_conn, reason="not in response")
+
+    ips = [ipaddress.ip_address(ip) for ip in (
+        "1.1.1.1", "8.8.8.8", "9.9.9.9", "2001:4860:4860::8888", "::ffff:8.8.4.4", "1.1.1.1",
+    )]
+
+    stale = _filter_stale_ip_addresses("ipqueryio", ips, db_conn)
+
+    assert stale == [ip for ip in ips if not _is_db_entry_recent("ipqueryio", ip, db_conn)]
+    assert [str(ip) for ip in stale] == ["1.1.1.1", "::ffff:808:404", "1.1.1.1"]
@@ -0,0 +1,33 @@
+import urllib.request
+
+from ip_info import _metrics, _timing
+
+
+def test_metrics_follow_timing_events():
+    server = _metrics.start_metrics_server(0)
+    try:
+        with _timing.timed("http", "ipqueryio"):
+            pass
+        _timing.count("cache_hit", api_name="ipqueryio")
+        _timing.count("cache_miss", api_name="ipqueryio")
+        _timing.count("rate_limit_blocked", api_name="virustotalcom")
+
+        port = server.server_address[1]
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics") as response:
+            assert response.headers["Content-Type"].startswith("application/openmetrics-text")
+            text = response.read().decode("utf-8")
+    finally:
+        _metrics.stop_metrics_server()
+
+    lines = text.splitlines()
+    assert lines[-1] == "# EOF"
+    assert 'ip_info_provider_requests_total{api_name="ipqueryio"} 1' in lines
+    assert 'ip_info_provider_request_duration_seconds_count{api_name="ipqueryio"} 1' in lines
+    assert 'ip_info_provider_request_duration_seconds_bucket{api_name="ipqueryio",le="+Inf"} 1' in lines
+    assert 'ip_info_cache_lookups_total{api_name="ipqueryio",result="hit"} 1' in lines
+    assert 'ip_info_cache_lookups_total{api_name="ipqueryio",result="miss"} 1' in lines
+    assert 'ip_info_rate_limit_blocks_total{api_name="virustotalcom"} 1' in lines
+
+    # nothing is collected once the server is stopped
+    _timing.count("rate_limit_blocked", api_name="virustotalcom")
+    assert 'ip_info_rate_limit_blocks_total{api_name="virustotalcom"} 1' in _metrics.render_metrics()
@@ -0,0 +1,91 @@
+import sqlite3
+from datetime import datetime, timedelta, timezone
+
+from ip_info._pack_ip_address import _pack_ip_address
+from ip_info.db._initialize_db import initialize_db
+
+def _old_db():
+    """Database in the layout used before ip_bytes existed."""
+    conn = sqlite3.connect(":memory:", detect_types=sqlite3.PARSE_DECLTYPES)
+    conn.execute(
+        "CREATE TABLE ip_data (id INTEGER PRIMARY KEY AUTOINCREMENT, timestamp TIMESTAMP, "
+        "ip_address TEXT, api_name TEXT, api_display_name TEXT, risk INTEGER, city TEXT, "
+        "state TEXT, cc TEXT, company TEXT, isp TEXT, as_name TEXT, hostname TEXT, "
+        "flags TEXT, raw_json TEXT)"
+    )
+    conn.execute("CREATE UNIQUE INDEX idx_ip_data ON ip_data (api_name, ip_address)")
+    return conn
+
+def test_migration_backfills_and_dedupes(capsys):
+    conn = _old_db()
+    old = datetime.now(timezone.utc) - timedelta(days=1)
+    new = datetime.now(timezone.utc)
+    rows = [
+        (old, "2001:db8:0::1", "abc", "old", "{}"),
+        (new, "2001:db8::1", "abc", "new", "{}"),
+        (new, "::ffff:1.2.3.4", "abc", "mapped", '{"a": 1}'),
+        (new, "not-an-ip", "abc", "junk", "{}"),
+    ]
+    conn.executemany(
+        "INSERT INTO ip_data (timestamp, ip_address, api_name, city, raw_json) "
+        "VALUES (?, ?, ?, ?, ?)",
+        rows,
+    )
+    conn.commit()
+
+    initialize_db(conn)
+
+    # dropped rows are listed
+    output = capsys.readouterr().out
+    assert "Dropped 1 rows" in output
+    assert "ip_data id 4: 'not-an-ip'" in output
+
+    result = conn.execute(
+        "SELECT ip_address, ip_bytes, city FROM ip_data ORDER BY ip_bytes"
+    ).fetchall()
+    assert result == [
+        ("1.2.3.4", _pack_ip_address("1.2.3.4"), "mapped"),
+        ("2001:db8::1", _pack_ip_address("2001:db8::1"), "new"),
+    ]
+    indexes = {row[1] for row in conn.execute("PRAGMA index_list(ip_data)")}
+    assert "idx_ip_data" not in indexes
+
+    # raw payloads moved to the compressed table, one row per distinct payload
+    assert conn.execute("SELECT COUNT(*) FROM raw_json").fetchone()[0] == 2
+    ip_columns = {row[1] for row in conn.execute("PRAGMA table_info(ip_data)")}
+    assert "raw_json" not in ip_columns
+    conn.close()
+
+def test_migration_moves_names_to_providers():
+    conn = _old_db()
+    conn.execute(
+        "CREATE TABLE api_queries (id INTEGER PRIMARY KEY AUTOINCREMENT, api_name TEXT, "
+        "timestamp TIMESTAMP, status_code INTEGER, error_text TEXT)"
+    )
+    now = datetime.now(timezone.utc)
+    conn.execute(
+        "INSERT INTO ip_data (timestamp, ip_address, api_name, api_display_name) "
+        "VALUES (?, ?, ?, ?)",
+        (now, "8.8.8.8", "ipqueryio", "IPQuery.io"),
+    )
+    conn.executemany(
+        "INSERT INTO api_queries (api_name, timestamp, status_code) VALUES (?, ?, ?)",
+        [("virustotalcom", now, 200), ("ipqueryio", now, 200)],
+    )
+    conn.commit()
+
+    initialize_db(conn)
+
+    ip_columns = {row[1] for row in conn.execute("PRAGMA table_info(ip_data)")}
+    assert "api_name" not in ip_columns and "provider_id" in ip_columns
+    assert conn.execute(
+        "SELECT api_name, api_display_name, ip_address FROM ip_data_view"
+    ).fetchall() == [("ipqueryio", "IPQuery.io", "8.8.8.8")]
+    assert conn.execute(
+        "SELECT api_name, status_code FROM api_queries_view ORDER BY api_name"
+    ).fetchall() == [("ipqueryio", 200), ("virustotalcom", 200)]
+    # a provider in both tables gets one row
+    assert conn.execute(
+        "SELECT api_name FROM providers ORDER BY api_name"
+    ).fetchall() == [("ipqueryio",), ("virustotalcom",)]
+    conn.close()
@@ -0,0 +1,57 @@
+from datetime import datetime, timedelta
+import ipaddress
+
+import requests
+
+from ip_info.apis._request_api import _record_missing_results, _record_negative_response
+from ip_info.config import LOCAL_TIMEZONE, NEGATIVE_MAX_AGE
+from ip_info.db._add_to_db import _insert_negative_results
+from ip_info.db._maintain_db import expire_negative_results
+from ip_info.db._query_db import _is_db_entry_recent
+
+def _response(status_code: int, reason: str) -> requests.Response:
+    response = requests.Response()
+    response.status_code = status_code
+    response.reason = reason
+    return response
+
+def test_negative_result_counts_as_recent(db_conn):
+    ip = ipaddress.ip_address("8.8.8.8")
+    assert not _is_db_entry_recent("ipapico", ip, db_conn)
+
+    _insert_negative_results("ipapico", [ip], db_conn, reason="404 Not Found", status_code=404)
+    assert _is_db_entry_recent("ipapico", ip, db_conn)
+
+    # only for the provider that couldn't answer
+    assert not _is_db_entry_recent("ipqueryio", ip, db_conn)
+
+def test_negative_result_expires(db_conn):
+    ip = ipaddress.ip_address("8.8.8.8")
+    _insert_negative_results("ipapico", [ip], db_conn, reason="404 Not Found")
+
+    later = datetime.now(LOCAL_TIMEZONE) + timedelta(days=NEGATIVE_MAX_AGE, hours=1)
+    assert expire_negative_results(db_conn, now=later) == 1
+    assert not _is_db_entry_recent("ipapico", ip, db_conn)
+
+def test_only_ip_specific_errors_are_recorded(db_conn):
+    ip = ipaddress.ip_address("8.8.8.8")
+
+    for status_code, reason in [(429, "Too Many Requests"), (403, "Forbidden"), (503, "Service Unavailable")]:
+        _record_negative_response("ipapico", [ip], _response(status_code, reason), db_conn)
+    assert not _is_db_entry_recent("ipapico", ip, db_conn)
+
+    # abstractapi signals its quota with 422
+    _record_negative_response("abstractapicom", [ip], _response(422, "Unprocessable Entity"), db_conn)
+    assert not _is_db_entry_recent("abstractapicom", ip, db_conn)
+
+    _record_negative_response("ipapico", [ip], _response(400, "Bad Request"), db_conn)
+    assert _is_db_entry_recent("ipapico", ip, db_conn)
+
+def test_missing_bulk_results_are_recorded(db_conn):
+    requested = ["8.8.8.8", "2001:4860:4860::8888", "1.1.1.1"]
+    answered = ["8.8.8.8", "2001:4860:4860:0:0:0:0:8888"]
+
+    _record_missing_results("ipqueryio", requested, answered, db_conn)
+
+    recent = [_is_db_entry_recent("ipqueryio", ipaddress.ip_address(ip), db_conn) for ip in requested]
+    assert recent == [False, False, True]
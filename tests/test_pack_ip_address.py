@@ -0,0 +1,27 @@
+import ipaddress
+import pytest
+
+from ip_info._pack_ip_address import _pack_ip_address, _pack_ip_network, _unpack_ip_address
+
+def test_ipv4_and_mapped_ipv6_pack_the_same():
+    assert _pack_ip_address("1.2.3.4") == _pack_ip_address("::ffff:1.2.3.4")
+    assert len(_pack_ip_address("1.2.3.4")) == 16
+
+def test_non_canonical_ipv6_packs_the_same():
+    assert _pack_ip_address("2001:DB8:0:0::1") == _pack_ip_address("2001:db8::1")
+
+@pytest.mark.parametrize("ip", ["8.8.8.8", "2606:4700::1111"])
+def test_round_trip(ip):
+    assert _unpack_ip_address(_pack_ip_address(ip)) == ipaddress.ip_address(ip)
+
+def test_byte_order_matches_numeric_order():
+    ips = ["9.9.9.9", "1.1.1.1", "2001:db8::1", "100.64.0.1"]
+    by_bytes = sorted(ips, key=_pack_ip_address)
+    by_value = sorted(ips, key=lambda ip: int(ipaddress.IPv6Address(_pack_ip_address(ip))))
+    assert by_bytes == by_value
+    assert by_bytes[0] == "1.1.1.1"
+
+def test_network_bounds():
+    first, last = _pack_ip_network("192.0.2.0/24")
+    assert first == _pack_ip_address("192.0.2.0")
+    assert last == _pack_ip_address("192.0.2.255")
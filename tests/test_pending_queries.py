@@ -0,0 +1,88 @@
+from datetime import datetime, timedelta
+import ipaddress
+
+from ip_info.config import LOCAL_TIMEZONE, PENDING_MAX_ATTEMPTS, PENDING_RETRY_DELAY
+from ip_info.db._add_to_db import _get_provider_id, _insert_ip_info
+from ip_info.db._pending_queries import (
+    _claim_due_queries,
+    _clear_answered_queries,
+    _defer_queries,
+    _pending_summary,
+)
+from ip_info.db._query_db import _check_rate_limits, _next_query_time
+
+def _add_past_calls(db_conn, api_name: str, seconds_ago: int, count: int, status_code: int = 200):
+    then = datetime.now(LOCAL_TIMEZONE) - timedelta(seconds=seconds_ago)
+    provider_id = _get_provider_id(api_name, db_conn)
+    db_conn.executemany(
+        "INSERT INTO api_queries (provider_id, timestamp, status_code, error_text) VALUES (?, ?, ?, ?)",
+        [(provider_id, then, status_code, "")] * count,
+    )
+    db_conn.commit()
+
+def test_every_rate_limit_is_checked(db_conn):
+    rate_limits = [
+        {"query_limit": 100, "timeframe": "minute", "type": "rolling"},
+        {"query_limit": 1, "timeframe": "day", "type": "absolute"},
+    ]
+    _add_past_calls(db_conn, "demo", 5, 1)
+
+    assert _check_rate_limits("demo", rate_limits, db_conn) is True
+
+def test_next_query_time(db_conn):
+    now = datetime.now(LOCAL_TIMEZONE)
+    assert _next_query_time("demo", [{"query_limit": 2, "timeframe": "minute"}], db_conn) - now < timedelta(seconds=1)
+
+    _add_past_calls(db_conn, "demo", 30, 2)
+    next_time = _next_query_time("demo", [{"query_limit": 2, "timeframe": "minute"}], db_conn)
+    assert timedelta(seconds=25) < next_time - now < timedelta(seconds=31)
+
+    # a rate limit response holds off an absolute limit until its window ends
+    _add_past_calls(db_conn, "demo", 0, 1, status_code=429)
+    next_time = _next_query_time(
+        "demo",
+        [{"query_limit": 1000, "timeframe": "day", "type": "absolute", "status_code": 429}],
+        db_conn,
+    )
+    assert next_time == (now + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+
+def test_defer_claim_and_clear(db_conn, ip_entry):
+    ips = [ipaddress.ip_address("8.8.8.8"), ipaddress.ip_address("1.1.1.1")]
+    _defer_queries("ipqueryio", ips, db_conn, error="ConnectionError")
+
+    assert _pending_summary(db_conn)["ipqueryio"]["count"] == 2
+    assert _claim_due_queries(db_conn, ["ipqueryio"]) == {}
+
+    later = datetime.now(LOCAL_TIMEZONE) + timedelta(seconds=PENDING_RETRY_DELAY + 1)
+    assert sorted(_claim_due_queries(db_conn, ["ipqueryio"], now=later)["ipqueryio"]) == sorted(ips)
+    # claimed queries aren't handed out again straight away
+    assert _claim_due_queries(db_conn, ["ipqueryio"], now=later) == {}
+
+    _insert_ip_info(entries=[ip_entry("ipqueryio", "8.8.8.8")], db_conn=db_conn)
+    _clear_answered_queries("ipqueryio", ips, db_conn)
+    assert _pending_summary(db_conn)["ipqueryio"]["count"] == 1
+
+def test_queries_are_dropped_after_max_attempts(db_conn):
+    _defer_queries("ipqueryio", ["8.8.8.8"], db_conn, error="ConnectionError")
+
+    now = datetime.now(LOCAL_TIMEZONE)
+    for attempt in range(PENDING_MAX_ATTEMPTS):
+        now += timedelta(seconds=PENDING_RETRY_DELAY + 1)
+        assert _claim_due_queries(db_conn, ["ipqueryio"], now=now)
+
+    now += timedelta(seconds=PENDING_RETRY_DELAY + 1)
+    assert _claim_due_queries(db_conn, ["ipqueryio"], now=now) == {}
+    assert _pending_summary(db_conn) == {}
+
+def test_rate_limited_queries_are_not_dropped(db_conn):
+    rate_limits = [{"query_limit": 1000, "timeframe": "day", "type": "absolute"}]
+    _defer_queries("abuseipdbcom", ["8.8.8.8"], db_conn, rate_limits=rate_limits)
+
+    # claimed by ipi --drain, then held back by the quota again, every day
+    now = datetime.now(LOCAL_TIMEZONE)
+    for day in range(PENDING_MAX_ATTEMPTS + 2):
+        now += timedelta(days=1)
+        assert _claim_due_queries(db_conn, ["abuseipdbcom"], now=now)
+        _defer_queries("abuseipdbcom", ["8.8.8.8"], db_conn, rate_limits=rate_limits)
+
+    assert _pending_summary(db_conn)["abuseipdbcom"]["count"] == 1
@@ -0,0 +1,64 @@
+from datetime import datetime, timedelta
+import ipaddress
+import json
+
+from ip_info._prefix_dedup import _dedup_by_prefix, _fan_out_results, _group_by_prefix, _representatives
+from ip_info.config import LOCAL_TIMEZONE
+from ip_info.db._add_to_db import _insert_ip_info
+from ip_info.db._query_db import _fetch_ip_info
+
+def _ips(*ips: str) -> list:
+    return [ipaddress.ip_address(ip) for ip in ips]
+
+def _geo_entry(ip_entry, ip: str, **columns) -> dict:
+    return ip_entry(
+        "ipdashapicom", ip,
+        city="Dublin", state="Leinster", cc="IE", isp="Example ISP", as_name="AS64500",
+        hostname=f"host-{ip}", flags="hosting", raw_json={"query": ip, "city": "Dublin"},
+        **columns,
+    )
+
+def test_group_by_prefix():
+    ips = _ips("10.0.0.1", "10.0.1.1", "10.0.0.2", "2001:db8:0:1::1", "2001:db8:0:2::1", "10.0.0.1")
+
+    assert _group_by_prefix(ips) == {
+        ipaddress.ip_network("10.0.0.0/24"): _ips("10.0.0.1", "10.0.0.2"),
+        ipaddress.ip_network("10.0.1.0/24"): _ips("10.0.1.1"),
+        ipaddress.ip_network("2001:db8::/48"): _ips("2001:db8:0:1::1", "2001:db8:0:2::1"),
+    }
+    assert len(_group_by_prefix(ips, (16, 64))) == 3
+
+def test_only_geo_providers_are_deduplicated(db_conn, ip_entry):
+    ips = _ips("10.0.0.1", "10.0.0.2", "10.0.1.1", "10.0.2.1", "10.0.2.2")
+    _insert_ip_info(entries=[_geo_entry(ip_entry, "10.0.2.2")], db_conn=db_conn)
+
+    deduplicated = _dedup_by_prefix({"ipdashapicom": ips, "ipapiis": ips}, db_conn)
+
+    # 10.0.2.0/24 already has an answer to copy
+    assert deduplicated["ipdashapicom"] == _ips("10.0.0.1", "10.0.1.1")
+    assert deduplicated["ipapiis"] == ips
+
+def test_fan_out_marks_results_as_inferred(db_conn, ip_entry):
+    ips = _ips("10.0.0.1", "10.0.0.2", "10.0.0.3", "10.0.1.1")
+    queried = datetime.now(LOCAL_TIMEZONE) - timedelta(days=3)
+    _insert_ip_info(entries=[_geo_entry(ip_entry, "10.0.0.1", timestamp=queried)], db_conn=db_conn)
+
+    assert _fan_out_results("ipdashapicom", ips, db_conn) == 2
+    assert _representatives("ipdashapicom", ips, db_conn) == _ips("10.0.1.1")
+
+    row = _fetch_ip_info(api_names=["ipdashapicom"], ip_address=ips[1], db_conn=db_conn, include_raw_json=True)[0]
+    assert row["flags"] == "inferred from 10.0.0.1, hosting"
+    assert row["city"] == "Dublin"
+    assert row["hostname"] == ""
+    assert row["timestamp"] == queried
+    assert json.loads(row["raw_json"]) == {
+        "inferred_from": "10.0.0.1",
+        "prefix": "10.0.0.0/24",
+        "response": {"query": "10.0.0.1", "city": "Dublin"},
+    }
+
+    # copied again from an inferred result, it still points at the original
+    assert _fan_out_results("ipdashapicom", _ips("10.0.0.2", "10.0.0.9"), db_conn) == 1
+    row = _fetch_ip_info(api_names=["ipdashapicom"], ip_address=_ips("10.0.0.9")[0], db_conn=db_conn, include_raw_json=True)[0]
+    assert row["flags"] == "inferred from 10.0.0.1, hosting"
+    assert json.loads(row["raw_json"])["inferred_from"] == "10.0.0.1"
@@ -0,0 +1,75 @@
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import requests
+
+from ip_info.config import LOCAL_TIMEZONE
+from ip_info.db._add_to_db import _insert_query_info
+from ip_info.db._maintain_db import prune_query_log
+from ip_info.db._query_db import _fetch_provider_stats
+
+
+def _response(status_code: int, reason: str = "", content: bytes = b"{}"):
+    return SimpleNamespace(status_code=status_code, reason=reason, content=content)
+
+
+def test_query_log_metrics(db_conn):
+    _insert_query_info("ipqueryio", _response(200, "OK", b"x" * 100), db_conn, duration=0.1, batch_size=10)
+    _insert_query_info("ipqueryio", _response(200, "OK", b"x" * 300), db_conn, duration=0.3, batch_size=30)
+    _insert_query_info("ipqueryio", _response(429, "Too Many Requests"), db_conn, duration=0.2, batch_size=10)
+    _insert_query_info(
+        "ipqueryio", None, db_conn,
+        duration=5.0, batch_size=10, error=requests.exceptions.Timeout("read timed out"),
+    )
+
+    stats = _fetch_provider_stats(db_conn=db_conn, days=30)
+    assert len(stats) == 1
+    stats = stats[0]
+
+    assert stats["api_name"] == "ipqueryio"
+    assert stats["queries"] == 4
+    assert stats["rate_limited"] == 1
+    assert stats["errors"] == 1
+    assert stats["avg_batch_size"] == 15
+    assert round(stats["avg_duration_ms"]) == 1400
+    assert round(stats["p50_duration_ms"]) == 200
+
+    error_text = db_conn.execute(
+        "SELECT error_text FROM api_queries WHERE status_code IS NULL"
+    ).fetchone()[0]
+    assert error_text == "Timeout: read timed out"
+
+
+def test_rolled_up_metrics_still_counted(db_conn):
+    _insert_query_info("ipqueryio", _response(200, "OK"), db_conn, duration=0.1, batch_size=10)
+    _insert_query_info("ipqueryio", _response(200, "OK"), db_conn, duration=0.3, batch_size=30)
+
+    # roll everything up, as if the rows were older than the retention
+    prune_query_log(db_conn, now=datetime.now(LOCAL_TIMEZONE) + timedelta(days=30))
+
+    assert db_conn.execute("SELECT COUNT(*) FROM api_queries").fetchone()[0] == 0
+
+    stats = _fetch_provider_stats(db_conn=db_conn, days=30)[0]
+    assert stats["queries"] == 2
+    assert stats["avg_batch_size"] == 20
+    assert round(stats["avg_duration_ms"]) == 200
+    # rollups don't keep individual durations
+    assert stats["p50_duration_ms"] is None
+
+
+def test_rows_without_a_duration_are_left_out_of_the_average(db_conn):
+    _insert_query_info("ipqueryio", _response(200, "OK"), db_conn, duration=0.1)
+    _insert_query_info("ipqueryio", _response(200, "OK"), db_conn, duration=0.3)
+    # logged before durations were
+    _insert_query_info("ipqueryio", _response(200, "OK"), db_conn)
+    _insert_query_info("ipdashapicom", _response(200, "OK"), db_conn)
+
+    stats = {row["api_name"]: row for row in _fetch_provider_stats(db_conn=db_conn, days=30)}
+    assert round(stats["ipqueryio"]["avg_duration_ms"]) == 200
+    assert stats["ipdashapicom"]["avg_duration_ms"] is None
+
+    prune_query_log(db_conn, now=datetime.now(LOCAL_TIMEZONE) + timedelta(days=30))
+
+    stats = {row["api_name"]: row for row in _fetch_provider_stats(db_conn=db_conn, days=30)}
+    assert round(stats["ipqueryio"]["avg_duration_ms"]) == 200
+    assert stats["ipdashapicom"]["avg_duration_ms"] is None
@@ -0,0 +1,38 @@
+from datetime import datetime, timedelta
+
+from ip_info.config import LOCAL_TIMEZONE
+from ip_info.db._add_to_db import _get_provider_id
+from ip_info.db._maintain_db import prune_query_log
+
+def _add_call(db_conn, api_name: str, days_ago: int, status_code: int):
+    then = datetime.now(LOCAL_TIMEZONE) - timedelta(days=days_ago)
+    db_conn.execute(
+        "INSERT INTO api_queries (provider_id,timestamp,status_code,error_text) "
+        "VALUES (?,?,?,?)",
+        (_get_provider_id(api_name, db_conn), then, status_code, ""),
+    )
+    db_conn.commit()
+
+def test_old_rows_rolled_up(db_conn):
+    # criminalipio has a monthly limit, so 10 day old rows must be kept
+    _add_call(db_conn, "criminalipio", 10, 200)
+    # ipqueryio has no limits, so only the minimum retention applies
+    _add_call(db_conn, "ipqueryio", 10, 200)
+    _add_call(db_conn, "ipqueryio", 10, 200)
+    _add_call(db_conn, "ipqueryio", 10, 429)
+    _add_call(db_conn, "ipqueryio", 0, 200)
+
+    assert prune_query_log(db_conn) == 3
+
+    remaining = db_conn.execute(
+        "SELECT api_name, COUNT(*) FROM api_queries_view GROUP BY api_name ORDER BY api_name"
+    ).fetchall()
+    assert remaining == [("criminalipio", 1), ("ipqueryio", 1)]
+
+    rollups = db_conn.execute(
+        "SELECT status_code, query_count FROM api_query_rollups ORDER BY status_code"
+    ).fetchall()
+    assert rollups == [(200, 2), (429, 1)]
+
+    # running again is a no-op
+    assert prune_query_log(db_conn) == 0
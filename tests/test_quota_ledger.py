@@ -0,0 +1,64 @@
+from datetime import datetime, timedelta
+import ipaddress
+
+import requests
+
+from ip_info._plan import _build_plan
+from ip_info.config import LOCAL_TIMEZONE
+from ip_info.db._add_to_db import _get_provider_id, _insert_query_info
+from ip_info.db._quota_ledger import _remaining_quota
+
+def _response(status_code: int, reason: str = "") -> requests.Response:
+    response = requests.Response()
+    response.status_code = status_code
+    response.reason = reason
+    response._content = b""
+    return response
+
+def test_ledger_counts_queries(db_conn):
+    # ipapicom has a 100 a month quota
+    assert _remaining_quota("ipapicom", db_conn)[0]["remaining"] == 100
+
+    for _ in range(3):
+        _insert_query_info("ipapicom", _response(200), db_conn)
+
+    quota = _remaining_quota("ipapicom", db_conn)[0]
+    assert (quota["used"], quota["remaining"]) == (3, 97)
+    assert _remaining_quota("ipqueryio", db_conn) == []
+
+def test_ledger_is_seeded_from_the_query_log(db_conn):
+    provider_id = _get_provider_id("ipapicom", db_conn)
+    db_conn.executemany(
+        "INSERT INTO api_queries (provider_id, timestamp, status_code) VALUES (?, ?, 200)",
+        [(provider_id, datetime.now(LOCAL_TIMEZONE))] * 5,
+    )
+
+    assert _remaining_quota("ipapicom", db_conn)[0]["used"] == 5
+    _insert_query_info("ipapicom", _response(200), db_conn)
+    assert _remaining_quota("ipapicom", db_conn)[0]["used"] == 6
+
+def test_ledger_starts_over_each_window(db_conn):
+    _insert_query_info("ipapicom", _response(200), db_conn)
+    next_month = datetime.now(LOCAL_TIMEZONE).replace(day=1) + timedelta(days=32)
+    assert _remaining_quota("ipapicom", db_conn, now=next_month)[0]["used"] == 0
+
+def test_limit_response_uses_up_the_quota(db_conn):
+    # abuseipdbcom answers 429 once its 1000 a day are used
+    _insert_query_info("abuseipdbcom", _response(429, "Too many requests"), db_conn)
+    assert _remaining_quota("abuseipdbcom", db_conn)[0]["remaining"] == 0
+
+def test_build_plan(db_conn):
+    ips = [ipaddress.ip_address(f"10.0.0.{i}") for i in range(1, 151)]
+    for _ in range(95):
+        _insert_query_info("ipapicom", _response(200), db_conn)
+
+    plan = {row["api_name"]: row for row in _build_plan(
+        ip_addresses=ips, api_names=["ipapiis", "ipapicom", "ipqueryio"], db_conn=db_conn,
+    )}
+
+    assert plan["ipapiis"]["requests"] == 2
+    assert plan["ipqueryio"]["quota_left"] is None
+    assert plan["ipapicom"]["requests"] == 150
+    assert plan["ipapicom"]["covered"] == 5
+    # has to wait for next month's quota
+    assert plan["ipapicom"]["duration"] > timedelta(hours=1)
@@ -0,0 +1,122 @@
+import pytest
+import requests
+
+from ip_info.apis import _request_api as request_api
+from ip_info.apis._circuit_breaker import _reset_circuits
+from ip_info.apis._request_api import (
+    DeadlineExceededError,
+    _parse_retry_after,
+    _request_api,
+    _request_deadline,
+    _retry_delay,
+)
+from ip_info.config import RETRY_MAX_ATTEMPTS
+
+def _response(status_code: int, headers: dict | None = None) -> requests.Response:
+    response = requests.Response()
+    response.status_code = status_code
+    response.reason = "reason"
+    response.headers.update(headers or {})
+    response._content = b"{}"
+    return response
+
+class _FakeSession:
+    def __init__(self, outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = 0
+        self.timeouts = []
+
+    def request(self, method, url, **kwargs):
+        self.calls += 1
+        self.timeouts.append(kwargs.get("timeout"))
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+@pytest.fixture(autouse=True)
+def _closed_circuits():
+    yield
+    _reset_circuits()
+
+def _patch(monkeypatch, outcomes) -> _FakeSession:
+    session = _FakeSession(outcomes)
+    monkeypatch.setattr(request_api, "_get_session", lambda: session)
+    monkeypatch.setattr(request_api.time, "sleep", lambda seconds: None)
+    return session
+
+def _retry_counts(db_conn) -> list:
+    cursor = db_conn.cursor()
+    cursor.row_factory = None
+    cursor.execute("SELECT retry_count FROM api_queries ORDER BY id")
+    return [row[0] for row in cursor.fetchall()]
+
+def test_parse_retry_after():
+    assert _parse_retry_after(_response(429, {"Retry-After": "3"})) == 3
+    assert _parse_retry_after(_response(429, {"Retry-After": "Wed, 21 Oct 2015 07:28:00 GMT"})) == 0
+    assert _parse_retry_after(_response(429, {"Retry-After": "soon"})) is None
+    assert _parse_retry_after(_response(429)) is None
+
+def test_retry_delay():
+    # server errors and unconfigured 429s back off
+    assert 0 < _retry_delay("ipqueryio", _response(503), 1) <= 0.5
+    assert 0 < _retry_delay("ipqueryio", _response(429), 3) <= 2
+    assert _retry_delay("ipqueryio", None, 1) is not None
+    # Retry-After, unless it's too long
+    assert 2 <= _retry_delay("ipqueryio", _response(503, {"Retry-After": "2"}), 1) < 3
+    assert _retry_delay("ipqueryio", _response(429, {"Retry-After": "3600"}), 1) is None
+    # a rolling limit's timeframe, but not a used up quota
+    assert _retry_delay("abstractapicom", _response(429), 1) == 1
+    assert _retry_delay("abstractapicom", _response(422), 1) is None
+    assert _retry_delay("virustotalcom", _response(429), 1) is None
+    # errors about the request itself
+    assert _retry_delay("ipqueryio", _response(404), 1) is None
+
+def test_transient_errors_are_retried(db_conn, monkeypatch):
+    session = _patch(monkeypatch, [
+        requests.exceptions.ConnectionError("reset"),
+        _response(503),
+        _response(200),
+    ])
+
+    response = _request_api("GET", "https://example.invalid", api_name="ipqueryio", db_conn=db_conn)
+
+    assert response.status_code == 200
+    assert session.calls == 3
+    assert _retry_counts(db_conn) == [0, 1, 2]
+
+def test_retries_stop_at_max_attempts(db_conn, monkeypatch):
+    session = _patch(monkeypatch, [_response(503)] * 10)
+    assert _request_api("GET", "https://example.invalid", api_name="ipqueryio", db_conn=db_conn).status_code == 503
+    assert session.calls == RETRY_MAX_ATTEMPTS
+
+    # criminalipio sets its own max_attempts
+    session = _patch(monkeypatch, [requests.exceptions.Timeout("slow")] * 10)
+    with pytest.raises(requests.exceptions.Timeout):
+        _request_api("GET", "https://example.invalid", api_name="criminalipio", db_conn=db_conn)
+    assert session.calls == 2
+
+    # a max_attempts below 1 still makes one request
+    monkeypatch.setitem(request_api.API_METADATA["ipqueryio"], "max_attempts", 0)
+    session = _patch(monkeypatch, [_response(503)] * 10)
+    assert _request_api("GET", "https://example.invalid", api_name="ipqueryio", db_conn=db_conn).status_code == 503
+    assert session.calls == 1
+
+def test_other_errors_are_not_retried(db_conn, monkeypatch):
+    session = _patch(monkeypatch, [_response(401)])
+    assert _request_api("GET", "https://example.invalid", api_name="ipqueryio", db_conn=db_conn).status_code == 401
+    assert session.calls == 1
+
+def test_deadline_caps_timeouts_and_retries(db_conn, monkeypatch):
+    session = _patch(monkeypatch, [_response(503)] * 10)
+
+    with _request_deadline(request_api.time.monotonic() + 0.1):
+        response = _request_api("GET", "https://example.invalid", api_name="ipqueryio", db_conn=db_conn)
+    # no time left for a backoff
+    assert response.status_code == 503
+    assert session.calls == 1
+    assert all(part <= 0.1 for part in session.timeouts[0])
+
+    with _request_deadline(request_api.time.monotonic() - 1):
+        with pytest.raises(DeadlineExceededError):
+            _request_api("GET", "https://example.invalid", api_name="ipqueryio", db_conn=db_conn)
@@ -0,0 +1,166 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import ipaddress
+import sqlite3
+import threading
+import time
+
+import pytest
+
+from ip_info._scheduler import run_scheduled
+from ip_info.config import LOCAL_TIMEZONE
+from ip_info.db._add_to_db import _get_provider_id, _insert_ip_info, _insert_query_info
+from ip_info.db._initialize_db import ensure_columns_exist, initialize_db
+from ip_info.db._ip_cache import _cache_clear
+from ip_info.db._pending_queries import _pending_summary
+from ip_info.db._query_db import _rank_providers_by_latency
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    # workers need their own connections to the same database
+    path = tmp_path / "ip_info.db"
+    conn = sqlite3.connect(path, detect_types=sqlite3.PARSE_DECLTYPES)
+    initialize_db(conn)
+    ensure_columns_exist(conn)
+    conn.close()
+    yield path
+    _cache_clear()
+
+
+def _ips(count: int) -> list:
+    return [ipaddress.ip_address(f"10.0.{i // 256}.{i % 256}") for i in range(count)]
+
+
+def _schedule(
+    db_path,
+    ip_entry,
+    ip_addresses_by_api: dict,
+    max_wait: float = 10,
+    deadline=None,
+    unanswered=None,
+    quorum=None,
+    silent=(),
+) -> list:
+    """
+    Run the scheduler with a run() that logs each batch as a query, and
+    stores a result for each ip unless the api is in silent. Returns
+    (api_name, size, start, end) per batch.
+    """
+    calls = []
+    lock = threading.Lock()
+
+    def _run(api_name, ip_addresses):
+        start = time.monotonic()
+        conn = sqlite3.connect(db_path, detect_types=sqlite3.PARSE_DECLTYPES)
+        try:
+            _insert_query_info(api_name, None, conn, batch_size=len(ip_addresses))
+            if api_name not in silent:
+                _insert_ip_info(entries=[ip_entry(api_name, ip_address) for ip_address in ip_addresses], db_conn=conn)
+        finally:
+            conn.close()
+        time.sleep(0.01)
+        with lock:
+            calls.append((api_name, len(ip_addresses), start, time.monotonic()))
+
+    db_conn = sqlite3.connect(db_path, detect_types=sqlite3.PARSE_DECLTYPES)
+    try:
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            result = run_scheduled(
+                executor=executor,
+                ip_addresses_by_api=ip_addresses_by_api,
+                run=_run,
+                db_conn=db_conn,
+                max_wait=max_wait,
+                deadline=deadline,
+                quorum=quorum,
+            )
+            if unanswered is not None:
+                unanswered.update(result)
+    finally:
+        db_conn.close()
+
+    return calls
+
+
+def test_bulk_batches_run_one_at_a_time(db_path, ip_entry):
+    calls = _schedule(db_path, ip_entry, {"ipapiis": _ips(150), "ipqueryio": _ips(3)})
+
+    assert sorted((api_name, size) for api_name, size, _, _ in calls) == [
+        ("ipapiis", 50), ("ipapiis", 100), ("ipqueryio", 3),
+    ]
+    ipapiis = sorted((start, end) for api_name, _, start, end in calls if api_name == "ipapiis")
+    assert ipapiis[0][1] <= ipapiis[1][0]
+
+
+def test_per_second_limit_is_waited_out(db_path, ip_entry):
+    # abstractapicom allows 1 query per second
+    calls = _schedule(db_path, ip_entry, {"abstractapicom": _ips(3)})
+
+    starts = sorted(start for _, _, start, _ in calls)
+    assert len(starts) == 3
+    assert starts[2] - starts[0] >= 1.9
+
+
+def test_long_waits_are_queued(db_path, ip_entry):
+    conn = sqlite3.connect(db_path, detect_types=sqlite3.PARSE_DECLTYPES)
+    provider_id = _get_provider_id("virustotalcom", conn)
+    conn.executemany(
+        "INSERT INTO api_queries (provider_id, timestamp, status_code) VALUES (?, ?, 200)",
+        [(provider_id, datetime.now(LOCAL_TIMEZONE))] * 4,
+    )
+    conn.commit()
+
+    # virustotalcom allows 4 queries a minute
+    calls = _schedule(db_path, ip_entry, {"virustotalcom": _ips(2)}, max_wait=1)
+
+    assert calls == []
+    assert _pending_summary(conn)["virustotalcom"]["count"] == 2
+    conn.close()
+
+
+def test_deadline_queues_unfinished_work(db_path, ip_entry):
+    unanswered = {}
+    start = time.monotonic()
+    ips = _ips(5)
+
+    # abstractapicom allows 1 query per second
+    calls = _schedule(db_path, ip_entry, {"abstractapicom": ips}, deadline=start + 1.5, unanswered=unanswered)
+
+    assert time.monotonic() - start < 2.5
+    assert len(calls) == 2
+    assert sorted(unanswered["abstractapicom"]) == sorted(ips[2:])
+
+    conn = sqlite3.connect(db_path, detect_types=sqlite3.PARSE_DECLTYPES)
+    assert _pending_summary(conn)["abstractapicom"]["count"] == 3
+    conn.close()
+
+
+def test_quorum_stops_asking_providers(db_path, ip_entry):
+    ips = _ips(3)
+    apis = ["ipqueryio", "ipapiis", "ipdashapicom", "ipapiorg"]
+
+    calls = _schedule(db_path, ip_entry, {api_name: ips for api_name in apis}, quorum=2)
+
+    assert sorted(api_name for api_name, _, _, _ in calls) == ["ipapiis", "ipqueryio"]
+
+
+def test_quorum_moves_on_when_a_provider_has_no_answer(db_path, ip_entry):
+    ips = _ips(3)
+    apis = ["ipqueryio", "ipapiis", "ipdashapicom", "ipapiorg"]
+
+    calls = _schedule(db_path, ip_entry, {api_name: ips for api_name in apis}, quorum=2, silent={"ipqueryio"})
+
+    assert sorted(api_name for api_name, _, _, _ in calls) == ["ipapiis", "ipdashapicom", "ipqueryio"]
+
+
+def test_rank_providers_by_latency(db_path):
+    conn = sqlite3.connect(db_path, detect_types=sqlite3.PARSE_DECLTYPES)
+    for api_name, duration in (("ipapiis", 0.5), ("ipqueryio", 0.1)):
+        for _ in range(3):
+            _insert_query_info(api_name, None, conn, duration=duration)
+
+    assert _rank_providers_by_latency(["ipdashapicom", "ipapiis", "ipqueryio"], conn) == [
+        "ipqueryio", "ipapiis", "ipdashapicom",
+    ]
+    conn.close()
@@ -0,0 +1,107 @@
+import ipaddress
+import json
+import threading
+import urllib.error
+import urllib.request
+from datetime import datetime
+
+import pytest
+
+import ip_info.main
+from ip_info.config import LOCAL_TIMEZONE
+from ip_info.db._add_to_db import _insert_ip_info
+from ip_info.db._initialize_db import ensure_columns_exist, initialize_db
+from ip_info.service import LookupServer, _parse_api_names
+
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    monkeypatch.setattr(ip_info.main, "DB_PATH", str(tmp_path / "ip_info.db"))
+
+    db_conn = ip_info.main._connect_db()
+    initialize_db(db_conn)
+    ensure_columns_exist(db_conn)
+    _insert_ip_info(
+        entries=[{
+            "timestamp": datetime.now(LOCAL_TIMEZONE),
+            "ip_address": "8.8.8.8",
+            "api_name": "ipqueryio",
+            "api_display_name": "IPQuery.io",
+            "risk": 0,
+            "city": "Mountain View",
+            "state": "California",
+            "cc": "US",
+            "company": "Google LLC",
+            "isp": "Google LLC",
+            "as_name": "AS15169",
+            "hostname": "",
+            "flags": "-",
+            "raw_json": {"ip": "8.8.8.8"},
+        }],
+        db_conn=db_conn,
+    )
+    db_conn.close()
+
+    # no api keys, so nothing is queried, and only stored results come back
+    server = LookupServer(("127.0.0.1", 0), api_keys={})
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def _request(url: str, body: dict | None = None) -> tuple[int, dict]:
+    data = json.dumps(body).encode("utf-8") if body is not None else None
+    request = urllib.request.Request(url, data=data, headers={"Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(request) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as error:
+        return error.code, json.loads(error.read())
+
+
+def test_get_ip(server):
+    status, body = _request(f"{server}/ip/8.8.8.8?raw_json=1")
+
+    assert status == 200
+    assert body["ip"] == "8.8.8.8"
+    assert len(body["results"]) == 1
+    result = body["results"][0]
+    assert result["api_name"] == "ipqueryio"
+    assert result["city"] == "Mountain View"
+    assert result["raw_json"] == {"ip": "8.8.8.8"}
+    assert "ip_bytes" not in result
+
+    status, body = _request(f"{server}/ip/10.0.0.1")
+    assert status == 400
+
+
+def test_post_lookup(server):
+    status, body = _request(f"{server}/lookup", {"ips": ["8.8.8.8", "1.1.1.1", "nope"]})
+
+    assert status == 200
+    assert [row["city"] for row in body["results"]["8.8.8.8"]] == ["Mountain View"]
+    assert body["results"]["1.1.1.1"] == []
+    assert body["invalid"] == ["nope"]
+
+    status, body = _request(f"{server}/lookup", {"ips": ["8.8.8.8"], "apis": ["nope"]})
+    assert status == 400
+
+
+
+def test_empty_apis_query_nothing(server):
+    # server is only there to set up the database
+    lookup_server = LookupServer(("127.0.0.1", 0), api_keys={"ipqueryio": None})
+    calls = []
+    lookup_server.coalescer.lookup = calls.append
+    ip_addresses = [ipaddress.ip_address("1.1.1.1")]
+    try:
+        assert _parse_api_names([]) == []
+        assert lookup_server.lookup(ip_addresses, []) == {"1.1.1.1": []}
+        assert calls == []
+
+        lookup_server.lookup(ip_addresses, _parse_api_names(None))
+        assert calls == [{"ipqueryio": ip_addresses}]
+    finally:
+        lookup_server.server_close()
@@ -0,0 +1,37 @@
+import io
+
+from ip_info import _timing
+
+
+def test_percentile():
+    values = [0.5, 0.1, 0.4, 0.2, 0.3]
+
+    assert _timing._percentile(values, 50) == 0.3
+    assert _timing._percentile(values, 95) == 0.5
+    assert _timing._percentile([0.7], 95) == 0.7
+
+
+def test_spans_only_recorded_when_enabled():
+
+    @_timing.timed_function("check_rate_limits")
+    def check(api_name):
+        return api_name
+
+    _timing.disable()
+    check("ipqueryio")
+    assert not _timing._spans
+
+    _timing.enable()
+    try:
+        assert check("ipqueryio") == "ipqueryio"
+        with _timing.timed("http", "ipqueryio"):
+            pass
+
+        assert len(_timing._spans[("check_rate_limits", "ipqueryio")]) == 1
+        assert len(_timing._spans[("http", "ipqueryio")]) == 1
+
+        output = io.StringIO()
+        _timing.report(file=output)
+        assert "ipqueryio" in output.getvalue()
+    finally:
+        _timing.disable()